@@ -1,29 +1,27 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import optparse
-from PIL import Image
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def check_img(fname):
+from core.pictogram import check_img
+
+
+def report(fname):
     """
     Checks if those params are correct:
     - name xxx-yyy-zzz_AA__BB
     - size (100x100px)
     - monochrome
     """
-    im = Image.open(fname)
-    if im.size != (100, 100):
-        print "WRONG SIZE: %s\t%s" % (im.size, fname)
-
-    im = im.convert('RGB')
-    w, h = im.size
-    for i in range(w):
-        for j in range(h):
-            r, g, b = im.getpixel((i, j))
-            if r != g != b:
-                print "NOT MONOCHROME: %s" % fname
-
-    
+    img = check_img(fname)
+    for err in img['errors']:
+        print("ERROR %s" % err)
+    for warn in img['warnings']:
+        print("WARNING %s" % warn)
+
+
 def main(path):
     # preserve original path before chdir
     curr_path = os.path.abspath(os.path.curdir)
@@ -36,9 +34,9 @@ def main(path):
                     continue
                 if not filename.endswith(".png"):
                     continue
-                check_img(filename)
+                report(os.path.join(root, filename))
     else:
-        check_img(path)
+        report(path)
 
     os.chdir(curr_path)
 
@@ -49,13 +47,11 @@ if __name__ == '__main__':
 
     try:
         dirname = args[0]
-    except:
-        print "ERROR: path not provided!"
-        exit()
+    except IndexError:
+        sys.exit("ERROR: path not provided!")
 
     path = os.path.abspath(dirname)
     if not os.path.exists(path):
-        print "ERROR: path %s does not exist!" % dirname
-        exit()
+        sys.exit("ERROR: path %s does not exist!" % dirname)
 
     main(path)
@@ -3,6 +3,8 @@ Helper functions for ``image_slicer``.
 '''
 import os
 
+from PIL import Image
+
 
 def get_basename(filename):
     """Strip path and extension. Return basename."""
@@ -10,7 +12,8 @@ def get_basename(filename):
 
 def open_images(directory):
     """Open all images in a directory. Return tuple of Image instances."""
-    return [Image.open(file) for file in os.listdir(directory)]
+    return [Image.open(os.path.join(directory, file))
+            for file in os.listdir(directory)]
 
 def get_columns_rows(filenames):
     """Derive number of columns and rows from filenames."""
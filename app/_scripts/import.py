@@ -19,7 +19,6 @@ import math
 import random
 import optparse
 
-from PIL import Image
 from PIL import ImageFont
 from PIL import ImageDraw
 
@@ -28,66 +27,10 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 
 from core.models import TaggedUserItem, Score, ScoredItem
+from core.pictogram import check_img
 from asana.models import Asana, AsanaForm
 
 
-def get_info(fname):
-    info = {
-        'filename': fname,
-        'name': '',
-        'variant': None,
-        'difficulty': -1,
-        'errors': [],
-        }
-    name = os.path.basename(fname).replace('.png', '')
-    try:
-        name, difficulty = name.rsplit('__', 1)
-        info['difficulty'] = int(difficulty)
-    except ValueError:
-        info['errors'].append('%s: difficulty not specified or wrong type' % fname)
-        return info
-
-    try:
-        name, variant = name.rsplit('_', 1)
-        variant = int(variant)
-    except ValueError:
-        info['errors'].append('%s: variant not specified or wrong type' % fname)
-        return info
-
-    info.update({
-        'name': name.title(),
-        'variant': variant
-        })
-    return info
-
-
-def check_img(fname):
-    """
-    Checks if those params are correct:
-    - size (100x100px)
-    - monochrome
-    """
-    info = get_info(fname)
-    im = Image.open(fname)
-    info.update({'image': im})
-    if im.size != (100, 100):
-        info['errors'].append('%s: wrong size %s' % (fname, im.size))
-
-    im1 = im.convert('RGB')
-    grayscale = True
-    w, h = im1.size
-    for i in range(w):
-        for j in range(h):
-            r, g, b = im1.getpixel((i, j))
-            if r != g != b:
-                grayscale = False
-                break
-    if not grayscale:
-        info['errors'].append('%s: not monochrome' % fname)
-
-    return info
-
-
 def main(path):
     user = User.objects.get(username="deko")
     asana_form_ct = ContentType.objects.get(app_label='asana', model='asanaform')
@@ -110,6 +53,9 @@ def main(path):
                     print("\t%s" % err)
                 continue
 
+            for warn in img['warnings']:
+                print("[~] %s" % warn)
+
             curr_name = "{name}_{variant}".format(**img)
 
             # upload and create a record of asana and its form
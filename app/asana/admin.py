@@ -1,17 +1,42 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.utils.html import format_html
 
 from genery.utils import smart_truncate
 
 from .models import Asana, AsanaForm
+from .search import search
+from .sprites import get_sprite
 from core.admin import admin_method_attrs
 
 
+class SearchChangeList(ChangeList):
+    """
+    Search results ordered by rank (see asana.search), unless ordered
+    explicitly.
+    """
+    def get_ordering(self, request, queryset):
+        if self.query.strip() and ORDER_VAR not in self.params:
+            return ["-search_rank", "name", "-pk"]
+        return super().get_ordering(request, queryset)
+
+
 class AsanaAdmin(admin.ModelAdmin):
     list_display = ("name", "_note", "created", "updated", )
     ordering = ("name", "updated", )
     list_filter = ("updated", )
     search_fields = ("name", "note", )
 
+    def get_search_results(self, request, queryset, search_term):
+        # Ranked and typo tolerant (see asana.search), instead of
+        # substring matches over search_fields.
+        if not search_term.strip():
+            return queryset, False
+        return search(search_term, queryset), False
+
+    def get_changelist(self, request, **kwargs):
+        return SearchChangeList
+
     @admin_method_attrs(admin_order_field='body')
     def _note(self, obj):
         note = obj.note or ''
@@ -23,6 +48,12 @@ class AsanaFormAdmin(admin.ModelAdmin):
     ordering = ("asana__name", )
     search_fields = ("asana__name", )
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(asana__in=search(search_term).values('pk')), \
+            False
+
     @admin_method_attrs(short_description='name',
                         admin_order_field='asana__name')
     def _name(self, obj):
@@ -30,7 +61,16 @@ class AsanaFormAdmin(admin.ModelAdmin):
 
     @admin_method_attrs(short_description='pict')
     def _pict(self, obj):
-        return obj.pict_100x100
+        # Pictograms from the sprite atlas (one request for many forms),
+        # unless the atlas is not built yet or outdated.
+        sprite = get_sprite(obj)
+        if sprite is None:
+            return obj.pict_100x100
+        return format_html(
+            '<div style="width: 100px; height: 100px; '
+            'background: url({}) -{}px -{}px no-repeat;"></div>',
+            *sprite
+            )
 
 
 admin.site.register(Asana, AsanaAdmin)
@@ -0,0 +1,635 @@
+"""
+Asana import pipeline.
+
+Stages:
+    discovery - `iter_entries` yields PNG files found under a directory
+                or in an archive, `Writer.select` drops those known to be
+                imported already;
+    preparing - `prepare` decodes, validates and normalises a pictogram.
+                It does not touch the database, so it can run in a pool
+                of worker processes (see `iter_prepared`);
+    writing   - `Writer` saves pictograms and database records in batches.
+                It runs in the main process only, in the order of discovery.
+"""
+
+import io
+import os
+import time
+import hashlib
+import tarfile
+import zipfile
+import posixpath
+import multiprocessing
+from contextlib import contextmanager
+from collections import namedtuple, deque, Counter
+
+from PIL import Image
+
+import django
+from django.core.files.base import ContentFile
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from core.models import TaggedUserItem, ScoredItem
+from core.pictogram import PictError, check_pixels, get_info, phash, \
+    hamming
+from core.utils import BKTree, chunked
+from asana.models import Asana, AsanaForm, AsanaFormSource
+
+
+# Files handed to a worker process at once.
+CHUNKSIZE = 16
+
+# Pictograms written to the database in one transaction.
+BATCH_SIZE = 500
+
+# Pictograms, whose perceptual hashes differ in no more bits than this,
+# are considered near-duplicates.
+PHASH_DISTANCE = 6
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    Adds time spent in the block to `timings[stage]` (seconds).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - started
+
+
+class Stats:
+    """
+    Counts files, bytes read, actions and other events (`counters`), and
+    accumulates time spent in every stage of the import (`timings`):
+
+        discovery - walking a directory or reading an archive
+                    (including reading members of archives);
+        read      - reading files from disk (in workers);
+        hash      - hashing content (in workers);
+        decode    - decoding images (in workers);
+        check     - validating pixels (in workers);
+        encode    - re-encoding pictograms (in workers);
+        phash     - computing perceptual hashes (in workers);
+        save      - writing pictograms to MEDIA_ROOT;
+        db        - database writes.
+
+    Worker stages are summed over all workers, so with `jobs` > 1 they can
+    exceed the elapsed time.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.bytes = 0
+        self.actions = Counter()
+        self.counters = Counter()
+        self.timings = Counter()
+
+    @property
+    def errors(self):
+        return self.actions['error']
+
+    def add(self, action, img=None):
+        self.files += 1
+        self.actions[action] += 1
+        if img is not None:
+            self.bytes += img['entry'].size
+            self.timings.update(img.get('timings', {}))
+
+    def timed(self, stage):
+        return timed(self.timings, stage)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Yields from `iterable`, timing it as `stage`.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.timed(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'elapsed': round(elapsed, 3),
+            'files_per_sec': round(self.files / elapsed, 1),
+            'bytes_per_sec': round(self.bytes / elapsed),
+            'actions': dict(self.actions),
+            'counters': dict(self.counters),
+            'timings': {k: round(v, 3) for k, v in self.timings.items()},
+            }
+
+
+def as_record(action, entry, img=None):
+    """
+    Report line on a file (JSON-serializable).
+    """
+    record = {
+        'action': action,
+        'path': entry.filename,
+        'tag': entry.tagname,
+        'size': entry.size,
+        }
+    if img is not None:
+        record.update({
+            'asana': img['name'],
+            'variant': img['variant'],
+            'difficulty': img['difficulty'],
+            'digest': img['digest'],
+            'errors': [str(x) for x in img['errors']],
+            'warnings': [str(x) for x in img['warnings']],
+            })
+        if img.get('duplicate_of'):
+            record['duplicate_of'] = '{}_{}'.format(*img['duplicate_of'])
+    return record
+
+
+class Entry(namedtuple('Entry', 'tagname filename size mtime digest data skip',
+                       defaults=(False, ))):
+    """
+    File found by discovery. `digest` is the content hash of the file
+    recorded at the previous import (None if it was never imported).
+    `data` holds content of archive members (files on disk are read by
+    `prepare`). Entries marked with `skip` are not read at all, they are
+    only passed on (in order) to be reported.
+    """
+    __slots__ = ()
+
+    @property
+    def path(self):
+        """Manifest key (see `AsanaFormSource`)."""
+        return os.path.abspath(self.filename)
+
+
+def is_pict(filename):
+    filename = os.path.basename(filename)
+    return not filename.startswith('.') and filename.endswith('.png')
+
+
+def iter_entries(path, select=None):
+    """
+    Yields `Entry` for PNG files under directory `path`, or in zip or tar
+    (optionally compressed) archive `path`, which is read as a stream,
+    without extracting it.
+
+    A name of each sub-directory becomes a tag (in archives - a name of
+    the directory inside the archive, or of the archive itself for files
+    at its top level).
+
+    `select(entry)` returns the entry to import (possibly amended), the
+    entry marked with `skip` (to pass it on without reading), or None to
+    drop it. Members of archives are only read if selected.
+    """
+    if select is None:
+        select = lambda entry: entry
+
+    if os.path.isdir(path):
+        entries = iter_dir(path, select)
+    elif zipfile.is_zipfile(path):
+        entries = iter_zip(path, select)
+    elif tarfile.is_tarfile(path):
+        entries = iter_tar(path, select)
+    else:
+        raise ValueError(f'{path} is neither a directory nor an archive')
+
+    for entry in entries:
+        if entry is not None:
+            yield entry
+
+
+def count_entries(path):
+    """
+    Returns number of PNG files under directory `path` or in zip archive
+    `path`, or None for tar archives (which can only be read once).
+    """
+    if os.path.isdir(path):
+        return sum(
+            sum(1 for x in files if is_pict(x))
+            for _, _, files in os.walk(path)
+            )
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for x in archive.infolist()
+                       if not x.is_dir() and is_pict(x.filename))
+    return None
+
+
+def iter_dir(path, select):
+    for root, _, files in os.walk(path, topdown=False):
+        tagname = os.path.basename(root)
+        for filename in files:
+            if not is_pict(filename):
+                continue
+
+            filename = os.path.join(root, filename)
+            stat = os.stat(filename)
+            yield select(Entry(tagname, filename, stat.st_size,
+                               stat.st_mtime_ns, None, None))
+
+
+def archive_tagname(path, member):
+    root = posixpath.dirname(member)
+    if root:
+        return posixpath.basename(root)
+    return os.path.basename(path).split('.', 1)[0]
+
+
+def iter_zip(path, select):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_pict(info.filename):
+                continue
+
+            mtime = int(time.mktime(info.date_time + (0, 0, -1))) * 10**9
+            entry = select(Entry(archive_tagname(path, info.filename),
+                                 os.path.join(path, info.filename),
+                                 info.file_size, mtime, None, None))
+            if entry is not None and not entry.skip:
+                entry = entry._replace(data=archive.read(info))
+            yield entry
+
+
+def iter_tar(path, select):
+    # Stream mode: members are read in order, compressed archives are
+    # decompressed once.
+    with tarfile.open(path, mode='r|*') as archive:
+        for info in archive:
+            if not info.isfile() or not is_pict(info.name):
+                continue
+
+            entry = select(Entry(archive_tagname(path, info.name),
+                                 os.path.join(path, info.name),
+                                 info.size, int(info.mtime) * 10**9,
+                                 None, None))
+            if entry is not None and not entry.skip:
+                entry = entry._replace(
+                    data=archive.extractfile(info).read())
+            yield entry
+
+
+def prepare(entry):
+    """
+    Decodes and checks a file, and (if it is correct) re-encodes the
+    pictogram into PNG bytes. Files with the same content as at the
+    previous import are not decoded at all ('unchanged').
+
+    Returns info (as `core.pictogram.check_img` does, but without the PIL
+    image) with 'entry', 'digest', 'tagname', 'size', 'data', 'phash' and
+    'timings', so that it can be passed between processes. Entries marked
+    with `skip` are returned as {'entry': entry, 'skipped': True}.
+    """
+    if entry.skip:
+        return {'entry': entry, 'skipped': True}
+
+    timings = {}
+    content = entry.data
+    if content is None:
+        with timed(timings, 'read'):
+            with open(entry.filename, 'rb') as f:
+                content = f.read()
+    with timed(timings, 'hash'):
+        digest = hashlib.sha256(content).hexdigest()
+    img = get_info(entry.filename)
+    img.update({
+        'entry': entry._replace(data=None),
+        'digest': digest,
+        'tagname': entry.tagname,
+        'unchanged': False,
+        'timings': timings,
+        })
+    if img['digest'] == entry.digest:
+        img.update({'unchanged': True, 'errors': [], 'warnings': []})
+        return img
+
+    with timed(timings, 'decode'):
+        image = Image.open(io.BytesIO(content))
+        image.load()
+    with timed(timings, 'check'):
+        errors, warnings = check_pixels(image, entry.filename)
+    img['errors'].extend(errors)
+    img['warnings'].extend(warnings)
+    img.update({'size': image.size, 'data': None, 'phash': None})
+    if not img['errors']:
+        with timed(timings, 'encode'):
+            buf = io.BytesIO()
+            image.save(buf, 'PNG')
+            img['data'] = buf.getvalue()
+        with timed(timings, 'phash'):
+            img['phash'] = phash(image)
+    image.close()
+    return img
+
+
+def prepare_chunk(entries):
+    return [prepare(entry) for entry in entries]
+
+
+def iter_prepared(entries, jobs=1):
+    """
+    Yields results of `prepare` for every entry, in the order of `entries`.
+
+    With `jobs` > 1 files are prepared in a pool of processes. Entries are
+    taken from `entries` only as workers become free, so that no more than
+    a few chunks of (archive members') content are held in memory.
+    """
+    if jobs <= 1:
+        yield from map(prepare, entries)
+        return
+
+    # Workers must not inherit open connections of the parent process.
+    connections.close_all()
+    with multiprocessing.Pool(jobs, initializer=django.setup) as pool:
+        pending = deque()
+        for chunk in chunked(entries, CHUNKSIZE):
+            pending.append(pool.apply_async(prepare_chunk, (chunk, )))
+            if len(pending) > 2 * jobs:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+class Writer:
+    """
+    Saves prepared pictograms as asana forms, tags and scores them.
+
+    Existing asanas, forms, tags and scores are loaded into memory once,
+    new pictograms are accumulated and written in batches of `batch_size`
+    (one transaction and a constant number of queries per batch). Call
+    `flush` after the last `write`.
+
+    A form is identified by its asana and variant: importing the same
+    `<name>_<variant>` again updates the form instead of adding a new one.
+
+    Every imported file is recorded in the manifest (`AsanaFormSource`)
+    in the same transaction as its form, so that re-running an import
+    (including after a crash) skips files committed before.
+
+    Perceptual hashes of all forms are kept in a BK-tree, so that every
+    new pictogram is checked for near-duplicates (within `phash_distance`
+    bits) among all forms and the ones imported earlier. They are flagged
+    with a warning, or with `merge` a new form is not created: the file is
+    attached (tagged) to the existing form instead.
+
+    In `dry` mode nothing is written, `write` only tells what would be done.
+    """
+    def __init__(self, user, score, content_type, batch_size=BATCH_SIZE,
+                 dry=False, stats=None, phash_distance=PHASH_DISTANCE,
+                 merge=False):
+        self.user = user
+        self.score = score
+        self.content_type = content_type
+        self.batch_size = batch_size
+        self.dry = dry
+        self.phash_distance = phash_distance
+        self.merge = merge
+        self.stats = Stats() if stats is None else stats
+        self.pending = []
+        self.written = set()
+        self.load()
+
+    def load(self):
+        self.asanas = {x.name: x for x in Asana.objects.all()}
+        self.forms = {}
+        self.phashes = BKTree(hamming)
+        for form in AsanaForm.objects.select_related('asana').order_by('id'):
+            self.forms[(form.asana_id, form.variant)] = form
+            if form.phash is not None:
+                self.phashes.add(form.phash, (form.asana.name, form.variant))
+        self.tags = set(
+            TaggedUserItem.objects.filter(
+                user=self.user,
+                content_type=self.content_type
+                ).values_list('name', 'object_id')
+            )
+        self.scores = {}
+        if self.score.pk is not None:
+            self.scores = {
+                x.object_id: x
+                for x in ScoredItem.objects.filter(
+                    score=self.score,
+                    content_type=self.content_type
+                    ).order_by('id')
+                }
+        self.sources = {x.path: x for x in AsanaFormSource.objects.all()}
+
+    def select(self, entry):
+        """
+        Returns `entry` (with the digest known from the manifest), if it is
+        new or its size or modification time differ from the manifest,
+        otherwise None.
+        """
+        try:
+            source = self.sources[entry.path]
+        except KeyError:
+            return entry
+
+        if (source.size, source.mtime) == (entry.size, entry.mtime):
+            return None
+
+        return entry._replace(digest=source.digest)
+
+    def find_duplicate(self, img):
+        """
+        Returns (distance, (name, variant)) of the nearest other form,
+        whose pictogram is a near-duplicate of `img`, or None.
+        """
+        key = (img['name'], img['variant'])
+        for found in self.phashes.search(img['phash'], self.phash_distance):
+            if found[1] != key:
+                return found
+        return None
+
+    def write(self, img):
+        """
+        Queues prepared `img` for writing (unless in dry mode).
+        Returns what is done to it: 'create', 'update', 'merge' (into a
+        near-duplicate) or 'skip' (same content as imported before).
+        Near-duplicates are added to `img['warnings']`, unless merged.
+        """
+        if img['unchanged']:
+            action = 'skip'
+        else:
+            key = (img['name'], img['variant'])
+            asana = self.asanas.get(img['name'])
+            if key in self.written \
+                    or (asana and (asana.id, img['variant']) in self.forms):
+                action = 'update'
+            else:
+                action = 'create'
+
+            duplicate = self.find_duplicate(img)
+            if duplicate is not None:
+                distance, img['duplicate_of'] = duplicate
+                if self.merge and action == 'create':
+                    action = 'merge'
+                else:
+                    img['warnings'].append(PictError(
+                        img['filename'],
+                        'duplicate',
+                        'near-duplicate of {}_{} (distance {})'.format(
+                            *img['duplicate_of'], distance)
+                        ))
+            if action != 'merge':
+                self.written.add(key)
+                self.phashes.add(img['phash'], key)
+        img['action'] = action
+
+        if not self.dry:
+            self.pending.append(img)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+        return action
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        imported = [img for img in self.pending if not img['unchanged']]
+        with self.stats.timed('save'):
+            self.save_picts([x for x in imported if x['action'] != 'merge'])
+        with self.stats.timed('db'), \
+                connection.execute_wrapper(self.count_query), \
+                transaction.atomic():
+            forms = self.save_forms(imported)
+            self.save_tags(imported, forms)
+            self.save_scores(imported, forms)
+            self.save_sources(self.pending, dict(zip(map(id, imported), forms)))
+        self.stats.counters['batches'] += 1
+        self.pending = []
+
+    def count_query(self, execute, sql, params, many, context):
+        self.stats.counters['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def save_picts(self, imgs):
+        """
+        Saves pictograms to the storage of `AsanaForm.pict` (named by
+        content, identical pictograms are stored once).
+        """
+        storage = AsanaForm.pict.field.storage
+        for img in imgs:
+            name = posixpath.join(AsanaForm.pict.field.upload_to,
+                                  "{name}_{variant}.png".format(**img))
+            img['upload_to'] = storage.save(name, ContentFile(img['data']))
+            self.stats.counters['bytes_written'] += len(img['data'])
+
+    def save_forms(self, imgs):
+        """
+        Creates missing asanas, creates or updates forms.
+        Returns a list of forms (one per image).
+        """
+        new_asanas = {}
+        for img in imgs:
+            if img['action'] == 'merge':
+                continue
+            if img['name'] not in self.asanas:
+                new_asanas.setdefault(img['name'], Asana(name=img['name']))
+        Asana.objects.bulk_create(new_asanas.values())
+        self.asanas.update(new_asanas)
+
+        forms, created, updated = [], {}, {}
+        now = timezone.now()
+        for img in imgs:
+            if img['action'] == 'merge':
+                name, variant = img['duplicate_of']
+                forms.append(self.forms[(self.asanas[name].id, variant)])
+                continue
+
+            key = (self.asanas[img['name']].id, img['variant'])
+            try:
+                form = self.forms[key]
+            except KeyError:
+                form = AsanaForm(asana=self.asanas[img['name']],
+                                 variant=img['variant'])
+                self.forms[key] = created[key] = form
+            else:
+                if key not in created:
+                    form.updated = now
+                    updated[key] = form
+            form.pict = img['upload_to']
+            form.pict_width, form.pict_height = img['size']
+            form.phash = img['phash']
+            forms.append(form)
+        AsanaForm.objects.bulk_create(created.values())
+        AsanaForm.objects.bulk_update(
+            updated.values(),
+            ['pict', 'pict_width', 'pict_height', 'phash', 'updated']
+            )
+        return forms
+
+    def save_tags(self, imgs, forms):
+        created = []
+        for img, form in zip(imgs, forms):
+            key = (img['tagname'], form.id)
+            if key in self.tags:
+                continue
+
+            self.tags.add(key)
+            created.append(TaggedUserItem(
+                name=img['tagname'],
+                content_type=self.content_type,
+                object_id=form.id,
+                user=self.user
+                ))
+        TaggedUserItem.objects.bulk_create(created)
+
+    def save_scores(self, imgs, forms):
+        created, updated = {}, {}
+        now = timezone.now()
+        for img, form in zip(imgs, forms):
+            if img['action'] == 'merge':
+                # difficulty of the existing form stays
+                continue
+            try:
+                scored = self.scores[form.id]
+            except KeyError:
+                scored = ScoredItem(
+                    score=self.score,
+                    content_type=self.content_type,
+                    object_id=form.id
+                    )
+                self.scores[form.id] = created[form.id] = scored
+            else:
+                if scored.val == img['difficulty']:
+                    continue
+                if form.id not in created:
+                    scored.updated = now
+                    updated[form.id] = scored
+            scored.val = img['difficulty']
+        ScoredItem.objects.bulk_create(created.values())
+        ScoredItem.objects.bulk_update(updated.values(), ['val', 'updated'])
+
+    def save_sources(self, imgs, forms):
+        """
+        Records files in the manifest. `forms` maps id(img) to its form,
+        unchanged files only get their size and modification time updated.
+        """
+        created, updated = {}, {}
+        now = timezone.now()
+        for img in imgs:
+            entry = img['entry']
+            source = self.sources.get(entry.path)
+            if source is None:
+                source = AsanaFormSource(path=entry.path)
+                self.sources[entry.path] = created[entry.path] = source
+            elif entry.path not in created:
+                source.updated = now
+                updated[entry.path] = source
+            source.size, source.mtime = entry.size, entry.mtime
+            source.digest = img['digest']
+            if id(img) in forms:
+                source.form = forms[id(img)]
+        AsanaFormSource.objects.bulk_create(created.values())
+        AsanaFormSource.objects.bulk_update(
+            updated.values(),
+            ['size', 'mtime', 'digest', 'form', 'updated']
+            )
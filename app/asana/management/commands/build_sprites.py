@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+Builds sprite atlases of asana pictograms (see `asana.sprites`): of all
+forms, and of forms with every tag given with --tag.
+
+Only sheets with added, changed or removed pictograms are re-rendered,
+so it is cheap to run after every import.
+"""
+
+from django.core.management.base import BaseCommand
+
+from asana.sprites import build
+
+
+def main(**kwargs):
+    tags = kwargs.get('tags') or []
+    if not tags or kwargs.get('all'):
+        tags.insert(0, None)
+
+    for tag in tags:
+        name, sheets = build(tag)
+        if sheets:
+            print(f'[+] {name}: re-rendered sheet(s) '
+                  f'{", ".join(map(str, sheets))}')
+        else:
+            print(f'[=] {name}: up to date')
+
+
+class Command(BaseCommand):
+    help = """Build sprite sheets of asana pictograms."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-t',
+            '--tag',
+            action='append', dest='tags', default=[],
+            help='Build atlas of forms with this tag (can be repeated).')
+        parser.add_argument(
+            '-a',
+            '--all',
+            action='store_true', dest='all', default=False,
+            help='Build atlas of all forms too (default without --tag).')
+
+    def handle(self, *args, **opts):
+        main(**opts)
@@ -5,160 +5,193 @@ One off import of asanas into Yogascape db with renaming the files and
 labelling 'difficulty' as admin (the earliest created superuser).
 
 Requires `dirname`, whose subdirectories are being scanned recoursively.
-A name of each sub-directory becomes a tag.
+A name of each sub-directory becomes a tag. `dirname` can also be a zip or
+tar(.gz, .bz2, .xz) archive, which is read without extracting it to disk.
 
 Warning! Only PNG images are being imported.
 
+Imported files are recorded (see AsanaFormSource): on re-run files that
+did not change are skipped.
+
+Near-duplicate pictograms (by perceptual hash) are reported, or merged into
+existing forms with --merge.
+
 Naming files:
 <name-of-asana>_<variant 0..N>__<difficulty 1..60>.png
 """
 
-import os
+import json
 
-from PIL import Image
-
-from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.management.base import BaseCommand
 
-from core.models import TaggedUserItem, Score, ScoredItem
-from asana.models import Asana, AsanaForm
-
-
-def get_info(fname):
-    info = {
-        'filename': fname,
-        'name': '',
-        'variant': None,
-        'difficulty': -1,
-        'errors': [],
-        }
-    name = os.path.basename(fname).replace('.png', '')
-    try:
-        name, difficulty = name.rsplit('__', 1)
-        info['difficulty'] = int(difficulty)
-    except ValueError:
-        info['errors'].append(f'{fname}: difficulty not specified or wrong type')
-        return info
-
-    try:
-        name, variant = name.rsplit('_', 1)
-        variant = int(variant)
-    except ValueError:
-        info['errors'].append(f'{fname}: variant not specified or wrong type')
-        return info
-
-    info.update({
-        'name': name.title(),
-        'variant': variant
-        })
-    return info
-
-
-def check_img(fname):
-    """
-    Checks if those params are correct:
-    - size (100x100px)
-    - monochrome
-    """
-    info = get_info(fname)
-    im = Image.open(fname)
-    info.update({'image': im})
-    if im.size != (100, 100):
-        info['errors'].append(f'{fname}: wrong size {im.size}')
-
-    im1 = im.convert('RGB')
-    grayscale = True
-    w, h = im1.size
-    for i in range(w):
-        for j in range(h):
-            r, g, b = im1.getpixel((i, j))
-            if r != g != b:
-                grayscale = False
-                break
-    if not grayscale:
-        info['errors'].append(f'{fname}: not monochrome')
-
-    return info
+from core.models import Score
+from core.utils import Progress
+from asana.importer import Writer, Stats, as_record, count_entries, \
+    iter_entries, iter_prepared, BATCH_SIZE, PHASH_DISTANCE
+
 
 def get_user():
     users = User.objects.filter(is_superuser=True).order_by('date_joined')
     return users[0]
 
-def main(**kwargs):
-    path = kwargs.get('dirname', None)
-    if not path:
-        raise Exception('Directory name is missing!')
+def get_score(user, dry=False):
+    params = {'name': 'difficulty', 'minval': 0, 'maxval': 40, 'user': user}
+    if dry:
+        return Score.objects.filter(**params).first() or Score(**params)
+    return Score.objects.get_or_create(**params)[0]
+
+def import_entries(entries, total=None, **kwargs):
+    """
+    Imports asanas from `entries(select)` - a function returning iterable
+    of `Entry` (see `asana.importer.iter_entries`), `total` is their
+    expected number (if known).
+
+    With `dry` nothing is written: every file is reported as a JSON line
+    (what would be done with it), followed by a summary line with
+    throughput and time spent in every stage (see `Stats`). The same
+    summary is written to `stats` file, if given.
+
+    Progress is reported to stderr unless `verbosity` is 0.
+    """
+    dry = kwargs.get('dry', False)
+    stats = Stats()
+    progress = None
+    if kwargs.get('verbosity', 1):
+        progress = Progress(total=total)
+
+    def report(action, entry, img=None):
+        stats.add(action, img)
+        if dry:
+            print(json.dumps(as_record(action, entry, img)), flush=True)
+        if progress is not None:
+            progress.update(stats.files, stats.errors)
+
+    def select(entry):
+        # Skipped entries are reported in order with the prepared ones
+        # (see `asana.importer.prepare`), whatever the number of jobs.
+        selected = writer.select(entry)
+        if selected is None:
+            return entry._replace(skip=True)
+        return selected
 
     user = get_user()
     asana_form_ct = ContentType.objects.get(app_label='asana',
                                             model='asanaform')
-    score, _ = Score.objects.get_or_create(name='difficulty',
-                                           minval=0,
-                                           maxval=40,
-                                           user=user)
-
-    for root, _, files in os.walk(path, topdown=False):
-        tagname = os.path.basename(root)
-        for filename in files:
-            if filename.startswith('.'):
-                continue
-
-            if not filename.endswith('.png'):
-                continue
-
-            filename = os.path.join(root, filename)
-            img = check_img(filename)
-            if img['errors']:
-                print(f'\n[!] Errors found in {filename}')
+    writer = Writer(user=user,
+                    score=get_score(user, dry=dry),
+                    content_type=asana_form_ct,
+                    batch_size=kwargs.get('batch_size') or BATCH_SIZE,
+                    dry=dry,
+                    stats=stats,
+                    phash_distance=kwargs.get('phash_distance',
+                                              PHASH_DISTANCE),
+                    merge=kwargs.get('merge', False))
+
+    jobs = kwargs.get('jobs') or 1
+    entries = stats.timed_iter('discovery', entries(select))
+    for img in iter_prepared(entries, jobs=jobs):
+        if img.get('skipped'):
+            report('skip', img['entry'])
+            continue
+
+        if img['errors']:
+            report('error', img['entry'], img)
+            if not dry:
+                print(f'\n[!] Errors found in {img["filename"]}')
                 for err in img['errors']:
                     print(f'\t{err}')
-                continue
-
-            curr_name = "{name}_{variant}".format(**img)
-
-            # upload and create a record of asana and its form
-            upload_to = os.path.join(
-                settings.MEDIA_ROOT,
-                AsanaForm.pict.field.upload_to,
-                curr_name+".png"
-                # os.path.basename(img['filename'])
-                )
-            img['image'].save(upload_to)
-            asana, _ = Asana.objects.get_or_create(name=img['name'])
-            asana_form = AsanaForm(asana=asana, variant=img['variant'])
-            asana_form.pict = upload_to
-            asana_form.save()
-
-            # tag it
-            tag, _ = TaggedUserItem.objects.get_or_create(
-                name=tagname,
-                content_type=asana_form_ct,
-                object_id=asana_form.id,
-                user=user
-                )
-            # score it
-            scored, _ = ScoredItem.objects.get_or_create(
-                score=score,
-                val=img['difficulty'],
-                content_type=asana_form_ct,
-                object_id=asana_form.id
-                )
+            continue
+
+        action = writer.write(img)
+        if not dry:
+            for warn in img['warnings']:
+                print(f'[~] {warn}')
+            if action == 'merge':
+                print('[~] {}: merged into {}_{}'.format(
+                    img['filename'], *img['duplicate_of']))
+
+        report(action, img['entry'], img)
+
+    writer.flush()
+    if progress is not None:
+        progress.finish(stats.files, stats.errors)
+
+    summary = stats.summary()
+    if kwargs.get('stats'):
+        with open(kwargs['stats'], 'w') as f:
+            json.dump(summary, f, indent=4)
+
+    if dry:
+        print(json.dumps({'summary': summary}))
+        return
+
+    if stats.actions['skip']:
+        print(f'\n[=] Skipped {stats.actions["skip"]} unchanged file(s)')
+    print(
+        f'\n[=] {summary["files"]} file(s) in {summary["elapsed"]}s '
+        f'({summary["files_per_sec"]}/s): '
+        f'{summary["actions"].get("create", 0)} created, '
+        f'{summary["actions"].get("update", 0)} updated, '
+        f'{summary["actions"].get("merge", 0)} merged, '
+        f'{summary["errors"]} error(s)'
+        )
+
+
+def main(**kwargs):
+    """
+    Imports asanas from `dirname` (a directory or an archive),
+    see `import_entries`.
+    """
+    path = kwargs.get('dirname', None)
+    if not path:
+        raise Exception('Directory or archive name is missing!')
+
+    import_entries(lambda select: iter_entries(path, select),
+                   total=count_entries(path),
+                   **kwargs)
 
 
 class Command(BaseCommand):
-    help = """Import asanas from directory."""
+    help = """Import asanas from directory or zip/tar archive."""
 
     def add_arguments(self, parser):
         parser.add_argument(
             '-d',
             '--dry',
             action='store_true', dest='dry', default=False,
-            help='Dry run (do not perform anything, only report).')
+            help='Dry run (do not write anything, report as JSON lines).')
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            action='store', dest='jobs', type=int, default=1,
+            help='Number of processes decoding and checking images.')
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            action='store', dest='batch_size', type=int, default=BATCH_SIZE,
+            help='Number of images written to the database at once.')
+        parser.add_argument(
+            '--phash-distance',
+            action='store', dest='phash_distance', type=int,
+            default=PHASH_DISTANCE,
+            help='Max. Hamming distance between perceptual hashes of '
+                 'near-duplicate pictograms.')
+        parser.add_argument(
+            '-m',
+            '--merge',
+            action='store_true', dest='merge', default=False,
+            help='Attach near-duplicates to existing forms instead of '
+                 'creating new ones.')
+        parser.add_argument(
+            '-s',
+            '--stats',
+            action='store', dest='stats', default=None,
+            help='File to write JSON summary (throughput, stage timings) to.')
         parser.add_argument(
             action='store', dest='dirname',
-            help='Directory name with images.'
+            help='Directory name or zip/tar archive with images.'
             )
 
     def handle(self, *args, **opts):
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+Import of asanas straight from a contact sheet: the sheet is sliced in
+memory and tiles are imported as if they were files
+`<sheet>/<name-of-asana>_<variant>__<difficulty>.png` (see import_asanas),
+without writing them to disk.
+
+Names of tiles are given by a manifest - a text file with one line per
+row of the grid and one name per cell, separated by spaces (`-` marks an
+empty cell, lines starting with `#` are ignored):
+
+    # row 1
+    tadasana_0__1  tadasana_1__2  vrksasana_0__8
+    # row 2
+    utkatasana_0__6  -  garudasana_0__14
+
+The size of the grid is taken from the manifest. A name of the sheet
+(without extension) becomes a tag, unless given with --tag.
+"""
+
+import io
+import os
+
+from django.core.management.base import BaseCommand
+
+from core.pictogram import fit
+from core.slicer import get_basename, iter_tiles
+from asana.importer import Entry, BATCH_SIZE, PHASH_DISTANCE
+from asana.management.commands.import_asanas import import_entries
+
+
+EMPTY_CELL = '-'
+
+
+def read_manifest(filename):
+    """
+    Returns manifest as a dict {(row, column): name}, and the number of
+    columns and rows of the grid.
+    """
+    cells, columns, rows = {}, 0, 0
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            rows += 1
+            names = line.split()
+            columns = max(columns, len(names))
+            for column, name in enumerate(names, 1):
+                if name != EMPTY_CELL:
+                    cells[(rows, column)] = os.path.splitext(name)[0]
+    if not cells:
+        raise Exception(f'No cells in manifest {filename}!')
+    return cells, columns, rows
+
+
+def iter_sheet(sheet, cells, columns, rows, select, tagname=None,
+               detect=False, resize=False):
+    """
+    Yields `Entry` with PNG content of every tile of `sheet` named in
+    `cells` (see `read_manifest`). Arguments as of
+    `asana.importer.iter_entries`.
+    """
+    tagname = tagname or get_basename(sheet)
+    mtime = os.stat(sheet).st_mtime_ns
+    for tile in iter_tiles(sheet, columns, rows, detect):
+        name = cells.get((tile.row, tile.column))
+        if name is None:
+            continue
+
+        image = fit(tile.image) if resize else tile.image
+        buf = io.BytesIO()
+        image.save(buf, 'PNG')
+        data = buf.getvalue()
+        entry = select(Entry(tagname, os.path.join(sheet, f'{name}.png'),
+                             len(data), mtime, None, None))
+        if entry is not None:
+            yield entry._replace(data=None if entry.skip else data)
+
+
+def main(**kwargs):
+    """
+    Imports asanas from contact sheet `sheet` named by `manifest`,
+    see `import_asanas.import_entries`.
+    """
+    sheet, manifest = kwargs.get('sheet'), kwargs.get('manifest')
+    if not sheet or not os.path.isfile(sheet):
+        raise Exception('Contact sheet is missing!')
+
+    cells, columns, rows = read_manifest(manifest)
+    import_entries(
+        lambda select: iter_sheet(sheet, cells, columns, rows, select,
+                                  tagname=kwargs.get('tag'),
+                                  detect=kwargs.get('detect', False),
+                                  resize=kwargs.get('resize', False)),
+        total=len(cells),
+        **kwargs
+        )
+
+
+class Command(BaseCommand):
+    help = """Slice contact sheet and import asanas from it."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-d',
+            '--dry',
+            action='store_true', dest='dry', default=False,
+            help='Dry run (do not write anything, report as JSON lines).')
+        parser.add_argument(
+            '-a',
+            '--auto',
+            action='store_true', dest='detect', default=False,
+            help='Detect grid from gutters instead of equal cells.')
+        parser.add_argument(
+            '-r',
+            '--resize',
+            action='store_true', dest='resize', default=False,
+            help='Fit tiles into pictogram size (in gray levels).')
+        parser.add_argument(
+            '-t',
+            '--tag',
+            action='store', dest='tag', default=None,
+            help='Tag of imported asanas (default: name of the sheet).')
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            action='store', dest='jobs', type=int, default=1,
+            help='Number of processes decoding and checking images.')
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            action='store', dest='batch_size', type=int, default=BATCH_SIZE,
+            help='Number of images written to the database at once.')
+        parser.add_argument(
+            '--phash-distance',
+            action='store', dest='phash_distance', type=int,
+            default=PHASH_DISTANCE,
+            help='Max. Hamming distance between perceptual hashes of '
+                 'near-duplicate pictograms.')
+        parser.add_argument(
+            '-m',
+            '--merge',
+            action='store_true', dest='merge', default=False,
+            help='Attach near-duplicates to existing forms instead of '
+                 'creating new ones.')
+        parser.add_argument(
+            '-s',
+            '--stats',
+            action='store', dest='stats', default=None,
+            help='File to write JSON summary (throughput, stage timings) to.')
+        parser.add_argument(
+            action='store', dest='sheet',
+            help='Contact sheet (image).'
+            )
+        parser.add_argument(
+            action='store', dest='manifest',
+            help='Manifest: names of tiles, one line per row of the grid.'
+            )
+
+    def handle(self, *args, **opts):
+        main(**opts)
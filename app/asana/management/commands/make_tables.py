@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Contact sheets ("tables") of asana pictograms: pages of captioned cells
+(see `core.tables`) as JPEG or PNG files, or a multi-page PDF.
+
+Pictograms are taken from the database (all forms, or those tagged with
+--tag), or from PNG files in `dirname` named as for import:
+<name-of-asana>_<variant 0..N>__<difficulty 1..60>.png
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.pdf import PDFWriter
+from core.pictogram import check_img
+from core.tables import FORMATS, PER_PAGE, iter_pages
+from core.utils import Progress
+from asana.models import AsanaForm
+
+
+def caption(name, variant):
+    if variant:
+        return f'{name} {variant}'
+    return name
+
+
+def db_items(tag=None):
+    """
+    Returns list of (pictogram path, caption) of asana forms, optionally
+    tagged with `tag`.
+    """
+    forms = AsanaForm.objects.select_related('asana').exclude(pict='')
+    if tag:
+        forms = forms.tagged(tag)
+    return [
+        (form.pict.path, caption(form.asana.name, form.variant))
+        for form in forms.order_by('asana__name', 'variant').iterator()
+        ]
+
+
+def dir_items(path):
+    """
+    Returns list of (pictogram path, caption) of PNG files under `path`,
+    and list of errors in their names and pixels (see
+    `core.pictogram.check_img`).
+    """
+    items, errors = [], []
+    for root, _, files in sorted(os.walk(path)):
+        for filename in sorted(files):
+            if filename.startswith('.') or not filename.endswith('.png'):
+                continue
+            info = check_img(os.path.join(root, filename))
+            info['image'].close()
+            errors.extend(info['errors'])
+            items.append((info['filename'],
+                          caption(info['name'], info['variant'])))
+    return items, errors
+
+
+def main(**kwargs):
+    """
+    Renders pages in `jobs` processes and writes them to `output` as
+    they are ready: a directory of `tables_<page>.<format>` files, or a
+    PDF file.
+    """
+    path = kwargs.get('dirname')
+    if path:
+        items, errors = dir_items(path)
+        if errors:
+            print('ERRORS FOUND:')
+            for err in errors:
+                print(err)
+            return
+    else:
+        items = db_items(kwargs.get('tag'))
+    if not items:
+        print('[!] No pictograms found')
+        return
+
+    fmt = kwargs.get('format') or 'pdf'
+    output = kwargs.get('output') or ('tables.pdf' if fmt == 'pdf'
+                                      else 'tables')
+    cache_root = None
+    if not kwargs.get('no_cache', False):
+        cache_root = str(kwargs.get('cache') or settings.CELL_CACHE_ROOT)
+    pages = iter_pages(items,
+                       jobs=kwargs.get('jobs') or 1,
+                       font_path=kwargs.get('font'),
+                       format=fmt,
+                       cache_root=cache_root)
+    progress = None
+    if kwargs.get('verbosity', 1):
+        progress = Progress(total=-(-len(items) // PER_PAGE), label='pages')
+
+    num = rendered = 0
+    if fmt == 'pdf':
+        with open(output, 'wb') as f, PDFWriter(f) as pdf:
+            for num, data, page_rendered in pages:
+                pdf.add_jpeg(data)
+                rendered += page_rendered
+                if progress is not None:
+                    progress.update(num)
+    else:
+        os.makedirs(output, exist_ok=True)
+        ext = 'jpg' if fmt == 'jpeg' else fmt
+        for num, data, page_rendered in pages:
+            rendered += page_rendered
+            with open(os.path.join(output, f'tables_{num:03d}.{ext}'),
+                      'wb') as f:
+                f.write(data)
+            if progress is not None:
+                progress.update(num)
+
+    if progress is not None:
+        progress.finish(num)
+    print(f'[=] Exported {len(items)} images on {num} page(s) to {output} '
+          f'({rendered} cell(s) rendered, {len(items) - rendered} cached)')
+
+
+class Command(BaseCommand):
+    help = """Make contact sheets (tables) of asana pictograms."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-f',
+            '--format',
+            action='store', dest='format', choices=FORMATS, default='pdf',
+            help='Output format: pages as JPEG or PNG files, or PDF.')
+        parser.add_argument(
+            '-o',
+            '--output',
+            action='store', dest='output', default=None,
+            help='Output PDF file or directory for pages '
+                 '(default: tables.pdf or tables/).')
+        parser.add_argument(
+            '-t',
+            '--tag',
+            action='store', dest='tag', default=None,
+            help='Only forms with this tag (from the database).')
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            action='store', dest='jobs', type=int, default=1,
+            help='Number of processes rendering pages.')
+        parser.add_argument(
+            '--font',
+            action='store', dest='font', default=None,
+            help='TrueType font for captions (default: DejaVu Sans Mono '
+                 'or Monaco, if installed).')
+        parser.add_argument(
+            '--cache',
+            action='store', dest='cache', default=None,
+            help='Directory of cached cells (default: CELL_CACHE_ROOT).')
+        parser.add_argument(
+            '--no-cache',
+            action='store_true', dest='no_cache', default=False,
+            help='Render all cells, do not use the cache.')
+        parser.add_argument(
+            action='store', dest='dirname', nargs='?', default=None,
+            help='Directory with pictograms (default: from the database).'
+            )
+
+    def handle(self, *args, **opts):
+        main(**opts)
@@ -0,0 +1,26 @@
+# Generated by Django 4.1 on 2026-10-18 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asana', '0002_alter_asanaform_pict_height_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AsanaFormSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('mtime', models.BigIntegerField(help_text='Modified, ns since epoch')),
+                ('digest', models.CharField(help_text='SHA-256', max_length=64)),
+                ('updated', models.DateTimeField(auto_now=True, help_text='Last updated')),
+                ('form', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sources', to='asana.asanaform')),
+            ],
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1 on 2026-10-18 08:56
+
+import os
+
+import core.storage
+from django.conf import settings
+from django.core.files import File
+from django.db import migrations, models
+
+
+def move_picts(apps, schema_editor):
+    """
+    Re-saves existing pictograms into the content-addressed layout.
+    (Older imports stored absolute paths, missing files are left alone.)
+    """
+    AsanaForm = apps.get_model('asana', 'AsanaForm')
+    storage = core.storage.ContentAddressedStorage()
+    for form in AsanaForm.objects.exclude(pict=''):
+        path = form.pict.name
+        if not os.path.isabs(path):
+            path = os.path.join(settings.MEDIA_ROOT, path)
+        if not os.path.isfile(path):
+            continue
+
+        with open(path, 'rb') as f:
+            name = storage.save(
+                'asana/pict/' + os.path.basename(path),
+                File(f)
+                )
+        AsanaForm.objects.filter(pk=form.pk).update(pict=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asana', '0003_asanaformsource'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='asanaform',
+            name='pict',
+            field=models.ImageField(height_field='pict_height', help_text='Pictogram 100x100px', max_length=255, storage=core.storage.ContentAddressedStorage(), upload_to='asana/pict/', width_field='pict_width'),
+        ),
+        migrations.RunPython(move_picts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.1 on 2026-10-18 08:56
+
+import numpy as np
+from PIL import Image
+
+from django.db import migrations, models
+
+
+# Frozen copy of `core.pictogram.phash` (as of this migration), so that
+# later changes of the module do not change the migration.
+
+INK_THRESHOLD = 128
+PHASH_SIZE = 32
+
+
+def flatten(im):
+    if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+    rgba = np.asarray(im).astype(np.uint32)
+    gray = (rgba[..., 0] * 19595 + rgba[..., 1] * 38470
+            + rgba[..., 2] * 7471 + 0x8000) >> 16
+    alpha = rgba[..., 3]
+    return ((gray * alpha + 255 * (255 - alpha)) // 255).astype(np.uint8)
+
+
+def dct_matrix(n):
+    k = np.arange(n).reshape(-1, 1)
+    m = np.cos(np.pi * (2 * np.arange(n) + 1) * k / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+def phash(im):
+    gray = flatten(im)
+    rows = np.flatnonzero((gray < INK_THRESHOLD).any(axis=1))
+    cols = np.flatnonzero((gray < INK_THRESHOLD).any(axis=0))
+    if rows.size:
+        gray = gray[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    h, w = gray.shape
+    side = max(h, w)
+    square = np.full((side, side), 255, dtype=np.uint8)
+    square[(side - h) // 2:(side - h) // 2 + h,
+           (side - w) // 2:(side - w) // 2 + w] = gray
+
+    dct = dct_matrix(PHASH_SIZE)
+    small = Image.fromarray(square).resize((PHASH_SIZE, PHASH_SIZE),
+                                           Image.LANCZOS)
+    freq = (dct @ np.asarray(small, dtype=np.float64) @ dct.T)[:8, :8]
+    bits = (freq > np.median(freq.flat[1:])).flatten()
+    value = int(np.packbits(bits).view('>u8')[0])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def compute_phash(apps, schema_editor):
+    AsanaForm = apps.get_model('asana', 'AsanaForm')
+    for form in AsanaForm.objects.exclude(pict=''):
+        try:
+            with form.pict.open('rb') as f:
+                value = phash(Image.open(f))
+        except (OSError, ValueError):
+            continue
+        AsanaForm.objects.filter(pk=form.pk).update(phash=value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asana', '0004_content_addressed_pict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asanaform',
+            name='phash',
+            field=models.BigIntegerField(blank=True, help_text='Perceptual hash of the pictogram', null=True),
+        ),
+        migrations.RunPython(compute_phash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1 on 2026-10-18 09:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asana', '0005_asanaform_phash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asanaform',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, help_text='Last updated'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,52 @@
+"""
+Indexes of asana search (see asana.search): trigrams of names of asanas
+and tags, and full text of names and notes of asanas. PostgreSQL only,
+other databases are searched without them.
+"""
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+INDEXES = (
+    ('asana', 'Asana', GinIndex(
+        fields=['name'], opclasses=['gin_trgm_ops'],
+        name='asana_asana_name_trgm_idx')),
+    ('asana', 'Asana', GinIndex(
+        SearchVector('name', 'note', config='english'),
+        name='asana_asana_search_idx')),
+    ('core', 'TaggedUserItem', GinIndex(
+        fields=['name'], opclasses=['gin_trgm_ops'],
+        name='core_tagged_name_trgm_idx')),
+    )
+
+
+def add_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for app_label, model_name, index in INDEXES:
+        schema_editor.add_index(apps.get_model(app_label, model_name), index)
+
+
+def remove_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for app_label, model_name, index in INDEXES:
+        schema_editor.remove_index(apps.get_model(app_label, model_name),
+                                   index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asana', '0006_asanaform_updated'),
+        ('core', '0002_tag_score_indexes'),
+    ]
+
+    operations = [
+        # Does nothing on other databases.
+        TrigramExtension(),
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
@@ -1,12 +1,13 @@
 from __future__ import unicode_literals
 
 from django.db import models
-from django.conf import settings
+from django.contrib.contenttypes.fields import GenericRelation
 from django.core.validators import MinValueValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import mark_safe
 
-from core.models import NamedModel
+from core.models import NamedModel, ScoredItem, TaggedUserItem
+from core.storage import ContentAddressedStorage
 
 
 class Asana(NamedModel):
@@ -16,6 +17,49 @@ class Asana(NamedModel):
     pass
 
 
+# Name of the score of forms' difficulty (see ScoredItem).
+DIFFICULTY = 'difficulty'
+
+
+class AsanaFormQuerySet(models.QuerySet):
+    """
+    Forms by their scores and tags, in one query (joined through
+    `AsanaForm.scores` and `AsanaForm.tags`), e.g. forms of difficulty
+    10 to 20 by `user`, tagged 'Doable':
+
+        AsanaForm.objects.with_difficulty(10, 20, user=user) \
+            .tagged('Doable', user=user)
+
+    Without `user` scores and tags of any user count, and forms are made
+    distinct.
+    """
+    def with_difficulty(self, low=None, high=None, user=None):
+        """
+        Forms with difficulty from `low` to `high` (inclusive, unbounded if
+        None). Forms without difficulty (0) are never included.
+        """
+        filters = {
+            'scores__score__name': DIFFICULTY,
+            'scores__val__gte': max(low or 1, 1),
+            }
+        if high is not None:
+            filters['scores__val__lte'] = high
+        if user is not None:
+            filters['scores__score__user'] = user
+        forms = self.filter(**filters)
+        return forms if user is not None else forms.distinct()
+
+    def tagged(self, tag, user=None):
+        """
+        Forms with `tag`.
+        """
+        filters = {'tags__name': tag}
+        if user is not None:
+            filters['tags__user'] = user
+        forms = self.filter(**filters)
+        return forms if user is not None else forms.distinct()
+
+
 class AsanaForm(models.Model):
     asana = models.ForeignKey(
         Asana,
@@ -28,6 +72,7 @@ class AsanaForm(models.Model):
     pict = models.ImageField(
         max_length=255,
         upload_to='asana/pict/',
+        storage=ContentAddressedStorage(),
         height_field='pict_height',
         width_field='pict_width',
         help_text=_('Pictogram 100x100px')
@@ -40,6 +85,20 @@ class AsanaForm(models.Model):
         default=100,
         validators=[MinValueValidator(1)]
         )
+    phash = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text=_('Perceptual hash of the pictogram')
+        )
+    updated = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        help_text=_('Last updated')
+        )
+    scores = GenericRelation(ScoredItem, related_query_name='asana_form')
+    tags = GenericRelation(TaggedUserItem, related_query_name='asana_form')
+
+    objects = AsanaFormQuerySet.as_manager()
 
     @property
     def name(self):
@@ -49,10 +108,30 @@ class AsanaForm(models.Model):
 
     @property
     def pict_100x100(self):
-        img_url = settings.MEDIA_URL \
-            + self.__class__.pict.field.upload_to \
-            + self.pict.name.rsplit("/", 1)[-1]
-        return mark_safe(f'<img src="{img_url}" width="100" height="100" />')
+        return mark_safe(
+            f'<img src="{self.pict.url}" width="100" height="100" />'
+            )
 
     def __unicode__(self):
         return self.name
+
+
+class AsanaFormSource(models.Model):
+    """
+    Manifest of imported files: a file (by path), its size, modification
+    time and content hash, and the form created from it. Lets the importer
+    skip files that did not change since they were imported.
+    """
+    path = models.CharField(max_length=1024, unique=True)
+    size = models.PositiveBigIntegerField()
+    mtime = models.BigIntegerField(help_text=_('Modified, ns since epoch'))
+    digest = models.CharField(max_length=64, help_text=_('SHA-256'))
+    form = models.ForeignKey(
+        AsanaForm,
+        related_name='sources',
+        on_delete=models.CASCADE
+        )
+    updated = models.DateTimeField(auto_now=True, help_text=_('Last updated'))
+
+    def __str__(self):
+        return self.path
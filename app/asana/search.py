@@ -0,0 +1,118 @@
+"""
+Search of asanas by name, note and tags of their forms.
+
+On PostgreSQL asanas are matched by full text (name and note, see
+CONFIG) or by trigram word similarity of the name or a tag (so that
+misspelled names are found too, see WORD_SIMILARITY), and ranked by
+both. All conditions are served by GIN indexes (see migration asana
+0007). The threshold of word similarity is set for the transaction of
+every query comparing it (see `word_similarity`), whenever and wherever
+the query is evaluated.
+
+On other databases it falls back to case-insensitive substring matches
+(no typo tolerance), names ranked above notes and tags.
+"""
+
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchVector, TrigramWordSimilarity
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Q, \
+    Value, When
+
+from core.models import TaggedUserItem
+from asana.models import Asana
+
+
+# Text search configuration, must be the same as in the index.
+CONFIG = 'english'
+
+# Least trigram word similarity of a match (pg_trgm's default 0.6 misses
+# a letter dropped from a short name: 'tadsana' is 0.55 to 'tadasana').
+WORD_SIMILARITY = 0.5
+
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def word_similarity(execute, sql, params, many, context):
+    """
+    Database execute wrapper (see `install`): runs queries with trigram
+    word similarity operators in a transaction, with their threshold set
+    to WORD_SIMILARITY for that transaction only.
+    """
+    if TrigramWordSimilar.postgres_operator not in sql:
+        return execute(sql, params, many, context)
+
+    with transaction.atomic(using=context['connection'].alias):
+        context['cursor'].execute(
+            "SELECT set_config('pg_trgm.word_similarity_threshold', %s, "
+            "true)", [str(WORD_SIMILARITY)])
+        return execute(sql, params, many, context)
+
+
+def install(sender, connection, **kwargs):
+    if connection.vendor == 'postgresql' \
+            and word_similarity not in connection.execute_wrappers:
+        connection.execute_wrappers.append(word_similarity)
+
+
+def search(query, queryset=None):
+    """
+    Returns asanas of `queryset` (all by default) matching `query`,
+    annotated with `search_rank` and ordered by it (best first).
+    """
+    if queryset is None:
+        queryset = Asana.objects.all()
+    query = (query or '').strip()
+    if not query:
+        return queryset.none()
+
+    if connections[queryset.db].vendor == 'postgresql':
+        return search_postgres(query, queryset)
+    return search_fallback(query, queryset)
+
+
+def search_postgres(query, queryset):
+    # Asanas matching by name or note, and those with matching tags, are
+    # found separately: an OR of the conditions with a subquery can't be
+    # served by indexes, each of them (and an OR of the first two) can.
+    search_query = SearchQuery(query, config=CONFIG, search_type='websearch')
+    matched = Asana.objects \
+        .annotate(document=SearchVector('name', 'note', config=CONFIG)) \
+        .filter(Q(document=search_query)
+                | Q(TrigramWordSimilar(F('name'), query))) \
+        .values('pk')
+    tagged = TaggedUserItem.objects \
+        .filter(TrigramWordSimilar(F('name'), query),
+                asana_form__asana__isnull=False) \
+        .values('asana_form__asana')
+    weighted = SearchVector('name', weight='A', config=CONFIG) \
+        + SearchVector('note', weight='B', config=CONFIG)
+    return queryset \
+        .filter(pk__in=matched.union(tagged)) \
+        .annotate(search_rank=SearchRank(weighted, search_query)
+                  + TrigramWordSimilarity(query, 'name')) \
+        .order_by('-search_rank', 'name')
+
+
+def search_fallback(query, queryset):
+    tags = TaggedUserItem.objects.filter(
+        name__icontains=query,
+        asana_form__asana=OuterRef('pk')
+        )
+    return queryset \
+        .annotate(tag_match=Exists(tags)) \
+        .filter(Q(name__icontains=query)
+                | Q(note__icontains=query)
+                | Q(tag_match=True)) \
+        .annotate(search_rank=Case(
+            When(name__icontains=query, then=Value(2.0)),
+            When(note__icontains=query, then=Value(1.0)),
+            default=Value(0.5),
+            output_field=FloatField())) \
+        .order_by('-search_rank', 'name')
+
+
+connection_created.connect(install)
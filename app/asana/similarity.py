@@ -0,0 +1,146 @@
+"""
+Visual similarity search over pictograms of asana forms.
+
+Perceptual hashes (see `core.pictogram.phash`) of all forms are held in
+packed numpy arrays and compared with a query all at once (XOR and
+popcount). Every process loads the index once (see `get_index`) and then
+only fetches forms updated since the last refresh (with an overlap, see
+REFRESH_OVERLAP), reloading it all every FULL_RELOAD_INTERVAL.
+"""
+
+import time
+import threading
+from datetime import timedelta
+
+import numpy as np
+
+from django.db.models.signals import post_delete, post_save
+
+from asana.models import AsanaForm
+
+
+# Number of set bits in every byte value.
+POPCOUNT = np.array([bin(x).count('1') for x in range(256)], dtype=np.uint8)
+
+# Seconds between checks for updated forms in the database (changes made
+# in the same process are picked up immediately).
+REFRESH_INTERVAL = 5
+
+# Forms updated up to so long before the latest change seen are fetched
+# again on refresh: `updated` is set before the transaction commits, so
+# a form committed after a refresh can have an earlier timestamp.
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+# Seconds between full reloads, which catch whatever refreshes missed
+# (e.g. transactions longer than REFRESH_OVERLAP).
+FULL_RELOAD_INTERVAL = 300
+
+
+class PictIndex:
+    """
+    Perceptual hashes of asana forms: `arrays` of form ids and of their
+    hashes (uint64), of the same length.
+
+    The arrays are built under `lock` and published together as a new
+    tuple, never modified in place, so that searches read them without
+    the lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrays = (np.empty(0, dtype=np.int64),
+                       np.empty(0, dtype=np.uint64))
+        self.updated = None
+        self.loaded = 0
+        self.checked = 0
+        self.stale = True
+
+    def __len__(self):
+        return len(self.arrays[0])
+
+    def load(self):
+        rows = AsanaForm.objects.filter(phash__isnull=False) \
+            .order_by('id').values_list('id', 'phash', 'updated')
+        ids, hashes, updated = [], [], None
+        for form_id, value, form_updated in rows:
+            ids.append(form_id)
+            hashes.append(value)
+            updated = max(updated or form_updated, form_updated)
+        self.arrays = (np.array(ids, dtype=np.int64),
+                       np.array(hashes, dtype=np.int64).view(np.uint64))
+        self.updated = updated
+        self.loaded = time.monotonic()
+
+    def refresh(self):
+        """
+        Adds or replaces forms updated since the last refresh (forms seen
+        before are replaced by id). Reloads the whole index if forms were
+        deleted, or if it was loaded FULL_RELOAD_INTERVAL ago.
+        """
+        if self.updated is None \
+                or time.monotonic() - self.loaded > FULL_RELOAD_INTERVAL:
+            self.load()
+            return
+
+        changed = {}
+        for form_id, value, form_updated in AsanaForm.objects \
+                .filter(updated__gte=self.updated - REFRESH_OVERLAP) \
+                .values_list('id', 'phash', 'updated'):
+            changed[form_id] = value
+            self.updated = max(self.updated, form_updated)
+        if changed:
+            ids, hashes = self.arrays
+            kept = ~np.isin(ids, list(changed))
+            added = [(x, v) for x, v in changed.items() if v is not None]
+            self.arrays = (
+                np.concatenate((ids[kept], np.array(
+                    [x for x, _ in added], dtype=np.int64))),
+                np.concatenate((hashes[kept], np.array(
+                    [v for _, v in added], dtype=np.int64).view(np.uint64))),
+                )
+
+        total = AsanaForm.objects.filter(phash__isnull=False).count()
+        if total != len(self):
+            self.load()
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if not self.stale and now - self.checked < REFRESH_INTERVAL:
+            return
+        with self.lock:
+            self.refresh()
+            self.checked = now
+            self.stale = False
+
+    def search(self, value, limit=10):
+        """
+        Returns list of (form id, distance) for `limit` forms nearest to
+        perceptual hash `value`.
+        """
+        self.ensure_fresh()
+        ids, hashes = self.arrays
+        if not len(ids):
+            return []
+
+        query = np.array([value], dtype=np.int64).view(np.uint64)
+        xor = np.bitwise_xor(hashes, query)
+        distances = POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        limit = min(limit, len(ids))
+        nearest = np.argpartition(distances, limit - 1)[:limit]
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        return [(int(ids[i]), int(distances[i])) for i in nearest]
+
+
+_index = PictIndex()
+
+
+def get_index():
+    """Returns the index of this process."""
+    return _index
+
+
+def mark_stale(sender, **kwargs):
+    _index.stale = True
+
+
+post_save.connect(mark_stale, sender=AsanaForm)
+post_delete.connect(mark_stale, sender=AsanaForm)
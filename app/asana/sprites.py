@@ -0,0 +1,229 @@
+"""
+Sprite atlases of pictograms: pictograms of many forms packed into a few
+sprite sheets (PNG), with a JSON index of their offsets, so that a list of
+forms loads in a few requests instead of one per pictogram.
+
+An atlas holds either all forms ('all') or forms with a tag. Every form
+keeps its slot across builds: a build re-renders only sheets in which a
+pictogram was added, changed or removed. Sheets are stored by content
+(see `core.storage`), so their URLs can be cached forever.
+
+Index (`MEDIA_ROOT/sprites/<atlas>/index.json`):
+
+    {
+        "tile": [100, 100],
+        "columns": 16,
+        "rows": 16,
+        "sheets": ["sprites/all/ab/cd/abcd...ef.png", ...],
+        "forms": {"<form id>": [<sheet>, <x>, <y>, "<pict name>"], ...}
+    }
+"""
+
+import io
+import os
+import json
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.text import slugify
+
+from core.pictogram import PICT_SIZE
+from core.storage import ContentAddressedStorage
+from core.utils import atomic_write
+from asana.models import AsanaForm
+
+
+ALL = 'all'
+SPRITE_DIR = 'sprites'
+
+# Slots of a sprite sheet.
+COLUMNS = 16
+ROWS = 16
+
+storage = ContentAddressedStorage()
+
+# Indexes read by `get_index`: {atlas: (mtime, index)}.
+_indexes = {}
+
+
+def atlas_name(tag=None):
+    return slugify(tag) if tag else ALL
+
+
+def index_path(name):
+    return os.path.join(settings.MEDIA_ROOT, SPRITE_DIR, name, 'index.json')
+
+
+def read_index(name):
+    try:
+        with open(index_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def get_index(name=ALL):
+    """
+    Returns index of atlas `name` (None if it is not built), re-reading
+    it only when the file changes.
+    """
+    path = index_path(name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _indexes.get(name)
+    if cached is None or cached[0] != mtime:
+        cached = _indexes[name] = (mtime, read_index(name))
+    return cached[1]
+
+
+def get_sprite(form, name=ALL):
+    """
+    Returns (sheet URL, x, y) of the pictogram of `form` in atlas `name`,
+    or None if it is not there or outdated.
+    """
+    index = get_index(name)
+    if not index:
+        return None
+
+    found = index['forms'].get(str(form.id))
+    if found is None or found[3] != form.pict.name:
+        return None
+    sheet, x, y, _ = found
+    return storage.url(index['sheets'][sheet]), x, y
+
+
+def get_forms(tag=None):
+    forms = AsanaForm.objects.exclude(pict='')
+    if tag:
+        forms = forms.tagged(tag)
+    return forms
+
+
+class Atlas:
+    """
+    Builds atlas `name` from `forms` (queryset of `AsanaForm`).
+    """
+    def __init__(self, name, forms):
+        self.name = name
+        self.forms = forms
+        self.index = read_index(name) or {}
+        if (self.index.get('columns'), self.index.get('rows'),
+                self.index.get('tile')) != (COLUMNS, ROWS, list(PICT_SIZE)):
+            # Layout changed: start over.
+            self.index = {}
+
+    @property
+    def per_sheet(self):
+        return COLUMNS * ROWS
+
+    def position(self, slot):
+        sheet, pos = divmod(slot, self.per_sheet)
+        row, column = divmod(pos, COLUMNS)
+        return sheet, column * PICT_SIZE[0], row * PICT_SIZE[1]
+
+    def slot(self, sheet, x, y):
+        return (sheet * self.per_sheet
+                + y // PICT_SIZE[1] * COLUMNS
+                + x // PICT_SIZE[0])
+
+    def assign(self):
+        """
+        Returns ({slot: (form id, pict name)}, set of sheets to render).
+        Forms keep their slots, new forms take the first free slots.
+        """
+        current = dict(self.forms.values_list('id', 'pict'))
+        slots, dirty = {}, set()
+        for form_id, (sheet, x, y, pict) in self.index.get('forms', {}).items():
+            form_id = int(form_id)
+            if current.get(form_id) == pict:
+                slots[self.slot(sheet, x, y)] = (form_id, pict)
+            else:
+                # Removed or changed.
+                dirty.add(sheet)
+
+        placed = {form_id for form_id, _ in slots.values()}
+        free = 0
+        for form_id, pict in sorted(current.items()):
+            if form_id in placed:
+                continue
+            while free in slots:
+                free += 1
+            slots[free] = (form_id, pict)
+            dirty.add(self.position(free)[0])
+        return slots, dirty
+
+    def render(self, sheet, slots):
+        """
+        Renders sprite sheet `sheet` and returns its name in the storage.
+        """
+        first = sheet * self.per_sheet
+        used = [slot for slot in range(first, first + self.per_sheet)
+                if slot in slots]
+        rows = (max(used) - first) // COLUMNS + 1 if used else 1
+        im = Image.new('RGBA', (COLUMNS * PICT_SIZE[0], rows * PICT_SIZE[1]),
+                       (255, 255, 255, 0))
+        for slot in used:
+            _, x, y = self.position(slot)
+            with storage.open(slots[slot][1]) as f, Image.open(f) as pict:
+                pict = pict.convert('RGBA')
+                if pict.size != PICT_SIZE:
+                    pict = pict.resize(PICT_SIZE, Image.LANCZOS)
+                im.paste(pict, (x, y))
+
+        buf = io.BytesIO()
+        im.save(buf, 'PNG', optimize=True)
+        return storage.save(
+            os.path.join(SPRITE_DIR, self.name, 'sheet.png'),
+            ContentFile(buf.getvalue())
+            )
+
+    def build(self):
+        """
+        Re-renders changed sheets and writes the index. Returns list of
+        numbers of re-rendered sheets.
+        """
+        slots, dirty = self.assign()
+        count = max(slots) // self.per_sheet + 1 if slots else 0
+        sheets = list(self.index.get('sheets', []))[:count]
+        sheets += [None] * (count - len(sheets))
+        dirty = sorted(x for x in dirty | {
+            i for i, name in enumerate(sheets) if name is None} if x < count)
+
+        old = set(self.index.get('sheets', []))
+        for sheet in dirty:
+            sheets[sheet] = self.render(sheet, slots)
+
+        forms = {}
+        for slot, (form_id, pict) in sorted(slots.items()):
+            sheet, x, y = self.position(slot)
+            forms[str(form_id)] = [sheet, x, y, pict]
+        self.index = {
+            'tile': list(PICT_SIZE),
+            'columns': COLUMNS,
+            'rows': ROWS,
+            'sheets': sheets,
+            'forms': forms,
+            }
+        self.write_index()
+
+        for name in old - set(sheets):
+            storage.delete(name)
+        return dirty
+
+    def write_index(self):
+        with atomic_write(index_path(self.name), 'w') as f:
+            json.dump(self.index, f)
+
+
+def build(tag=None):
+    """
+    Builds atlas of all forms or of forms tagged with `tag`.
+    Returns (atlas name, list of re-rendered sheets).
+    """
+    name = atlas_name(tag)
+    return name, Atlas(name, get_forms(tag)).build()
@@ -1,3 +1,924 @@
-from django.test import TestCase
+import contextlib
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import RestrictedError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Score, ScoredItem, TaggedUserItem
+from core.pictogram import hamming, phash
+from core.testing import TempMediaMixin, make_pict
+from asana.importer import Writer, count_entries, iter_entries, \
+    iter_prepared, prepare
+from asana.management.commands.import_sheet import read_manifest
+from asana.models import Asana, AsanaForm, AsanaFormSource
+from asana.search import search
+from asana.similarity import FULL_RELOAD_INTERVAL, PictIndex
+from asana import sprites
+from sequence.models import Sequence, SequenceItem
+
+
+# name: (shape, offset, tag), shapes are drawn by `make_pict`.
+PICTS = {
+    'tadasana_0__5': ('figure', (0, 0), 'standing'),
+    'vrksasana_0__10': ('box', (0, 0), 'standing'),
+    # Near-duplicate of vrksasana_0.
+    'vrksasana_1__12': ('box', (6, 4), 'balance'),
+    'utkatasana_0__20': ('figure', (0, 0), 'standing'),
+    'blank_0__3': (None, (0, 0), 'standing'),
+    'nodifficulty_0': ('figure', (0, 0), 'balance'),
+    }
+
+
+class ImportTestMixin(TempMediaMixin):
+    def setUp(self):
+        super().setUp()
+        self.root = os.path.join(self.tmp, 'picts')
+        for name in PICTS:
+            self.save_pict(name)
+        self.user = User.objects.create(username='admin', is_staff=True,
+                                        is_superuser=True)
+
+    def save_pict(self, name, shape=None):
+        default, offset, tag = PICTS[name]
+        os.makedirs(os.path.join(self.root, tag), exist_ok=True)
+        filename = os.path.join(self.root, tag, f'{name}.png')
+        make_pict(shape or default, offset).save(filename)
+        return filename
+
+    def run_import(self, **kwargs):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command('import_asanas', self.root, verbosity=0, **kwargs)
+        return out.getvalue()
+
+
+class WriterTest(ImportTestMixin, TestCase):
+    def writer(self, **kwargs):
+        score, _ = Score.objects.get_or_create(
+            name='difficulty', minval=0, maxval=40, user=self.user)
+        return Writer(
+            user=self.user,
+            score=score,
+            content_type=ContentType.objects.get_for_model(AsanaForm),
+            **kwargs)
+
+    def write_all(self, writer):
+        errors = []
+        for img in iter_prepared(iter_entries(self.root, writer.select)):
+            if img['errors']:
+                errors.append(os.path.basename(img['filename']))
+            else:
+                writer.write(img)
+        writer.flush()
+        return sorted(errors)
+
+    def test_write(self):
+        self.assertEqual(self.write_all(self.writer()),
+                         ['blank_0__3.png', 'nodifficulty_0.png'])
+        self.assertEqual(self.writer().write(prepare(next(
+            x for x in iter_entries(self.root)
+            if x.filename.endswith('tadasana_0__5.png')))), 'update')
+
+        forms = {(x.asana.name, x.variant): x
+                 for x in AsanaForm.objects.select_related('asana')}
+        self.assertEqual(sorted(forms), [
+            ('Tadasana', 0), ('Utkatasana', 0),
+            ('Vrksasana', 0), ('Vrksasana', 1),
+            ])
+        tags = set(TaggedUserItem.objects.values_list('name', 'object_id'))
+        self.assertEqual(tags, {
+            ('standing', forms['Tadasana', 0].id),
+            ('standing', forms['Utkatasana', 0].id),
+            ('standing', forms['Vrksasana', 0].id),
+            ('balance', forms['Vrksasana', 1].id),
+            })
+        scores = dict(ScoredItem.objects.values_list('object_id', 'val'))
+        self.assertEqual(scores[forms['Vrksasana', 1].id], 12)
+        self.assertTrue(os.path.exists(forms['Tadasana', 0].pict.path))
+        # Identical pictograms are stored once.
+        self.assertEqual(forms['Tadasana', 0].pict,
+                         forms['Utkatasana', 0].pict)
+
+    def test_batches(self):
+        imgs = [x for x in iter_prepared(iter_entries(self.root))
+                if not x['errors']]
+        writer = self.writer(batch_size=2)
+        # Asanas, forms, tags, scores and the manifest, in a transaction.
+        with self.assertNumQueries(7):
+            writer.write(imgs[0])
+            writer.write(imgs[1])
+        with self.assertNumQueries(0):
+            writer.write(imgs[2])
+        with self.assertNumQueries(7):
+            writer.write(imgs[3])
+        self.assertEqual(writer.stats.counters['batches'], 2)
+        self.assertEqual(writer.stats.counters['queries'], 14)
+        self.assertEqual(writer.stats.counters['bytes_written'],
+                         sum(len(x['data']) for x in imgs))
+
+    def test_reimport(self):
+        self.write_all(self.writer())
+        self.save_pict('vrksasana_1__12', shape='figure')
+        filename = self.save_pict('tadasana_0__5')
+        os.rename(filename, filename.replace('__5', '__7'))
+        self.write_all(self.writer())
+
+        self.assertEqual(AsanaForm.objects.count(), 4)
+        form = AsanaForm.objects.get(asana__name='Tadasana')
+        self.assertEqual(
+            list(ScoredItem.objects.filter(object_id=form.id)
+                 .values_list('val', flat=True)),
+            [7])
+
+    def test_manifest(self):
+        self.write_all(self.writer())
+        self.assertEqual(AsanaFormSource.objects.count(), 4)
+        writer = self.writer()
+        entries = {os.path.basename(x.filename)[:-4]: x
+                   for x in iter_entries(self.root, writer.select)}
+        # Imported and not modified: skipped. Never imported (had errors).
+        self.assertEqual(sorted(entries), ['blank_0__3', 'nodifficulty_0'])
+
+        # Touched, but the same content: not decoded, not written again.
+        filename = self.save_pict('tadasana_0__5')
+        entry, = [x for x in iter_entries(self.root, writer.select)
+                  if x.filename == filename]
+        source = AsanaFormSource.objects.get(path=entry.path)
+        self.assertEqual(entry.digest, source.digest)
+        img = prepare(entry)
+        self.assertTrue(img['unchanged'])
+        self.assertNotIn('data', img)
+        writer.write(img)
+        writer.flush()
+        source.refresh_from_db()
+        self.assertEqual(source.mtime, entry.mtime)
+
+        # Changed content: the form is updated.
+        self.save_pict('tadasana_0__5', shape='box')
+        self.write_all(self.writer())
+        self.assertNotEqual(AsanaFormSource.objects.get(path=entry.path)
+                            .digest, source.digest)
+        self.assertEqual(AsanaForm.objects.count(), 4)
+
+    def test_duplicates(self):
+        writer = self.writer()
+        imgs = {}
+        for img in iter_prepared(iter_entries(self.root)):
+            if not img['errors']:
+                imgs[img['name'], img['variant']] = img
+                writer.write(img)
+        writer.flush()
+        # Flagged, not merged: identical pictograms of different asanas,
+        # and a near-duplicate (whichever of them comes second).
+        flagged = sorted(key for key, img in imgs.items()
+                         if [x.code for x in img['warnings']]
+                         == ['duplicate'])
+        self.assertEqual(len(flagged), 2)
+        self.assertIn(flagged[0], [('Tadasana', 0), ('Utkatasana', 0)])
+        self.assertIn(flagged[1], [('Vrksasana', 0), ('Vrksasana', 1)])
+        self.assertEqual(AsanaForm.objects.count(), 4)
+        self.assertEqual(
+            AsanaForm.objects.filter(asana__name='Tadasana').get().phash,
+            AsanaForm.objects.filter(asana__name='Utkatasana').get().phash)
+
+    def test_merge(self):
+        filename = self.save_pict('vrksasana_1__12')
+        os.rename(filename, f'{filename}.tmp')
+        self.write_all(self.writer())
+        os.rename(f'{filename}.tmp', filename)
+
+        writer = self.writer(merge=True)
+        img = prepare(next(x for x in iter_entries(self.root, writer.select)
+                           if x.filename == filename))
+        self.assertEqual(writer.write(img), 'merge')
+        self.assertEqual(img['duplicate_of'], ('Vrksasana', 0))
+        writer.flush()
+
+        form = AsanaForm.objects.get(asana__name='Vrksasana')
+        self.assertFalse(AsanaForm.objects.filter(variant=1).exists())
+        self.assertEqual(set(TaggedUserItem.objects.filter(object_id=form.id)
+                             .values_list('name', flat=True)),
+                         {'standing', 'balance'})
+        self.assertEqual(AsanaFormSource.objects.get(path=img['entry'].path)
+                         .form, form)
+        # Difficulty of the form it is merged into is kept.
+        self.assertEqual(
+            list(ScoredItem.objects.filter(object_id=form.id)
+                 .values_list('val', flat=True)),
+            [10])
+
+
+class PrepareTest(TempMediaMixin, SimpleTestCase):
+    def test_jobs(self):
+        root = os.path.join(self.tmp, 'picts')
+        for i, shape in enumerate(('figure', 'box', None) * 12):
+            os.makedirs(os.path.join(root, f'tag{i % 4}'), exist_ok=True)
+            make_pict(shape).save(os.path.join(root, f'tag{i % 4}',
+                                               f'asana_{i}__{i}.png'))
+        entries = list(iter_entries(root))
+        prepared = list(iter_prepared(entries))
+        self.assertEqual([x['filename'] for x in prepared],
+                         [x.filename for x in entries])
+        self.assertEqual(sum(bool(x['errors']) for x in prepared), 12)
+        # Results of a pool come in the order of discovery, too.
+        self.assertEqual([dict(x, timings=None)
+                          for x in iter_prepared(entries, jobs=3)],
+                         [dict(x, timings=None) for x in prepared])
+
+
+class ArchiveTest(ImportTestMixin, TestCase):
+    def test_archives(self):
+        for fmt, ext in (('zip', '.zip'), ('gztar', '.tar.gz'),
+                         ('xztar', '.tar.xz')):
+            with self.subTest(fmt=fmt):
+                archive = shutil.make_archive(
+                    os.path.join(self.tmp, 'picts'), fmt, self.root)
+                self.assertTrue(archive.endswith(ext))
+                entries = {x.path: x for x in iter_entries(archive)}
+                self.assertEqual(
+                    sorted(x.tagname for x in entries.values()),
+                    ['balance', 'balance', 'standing', 'standing',
+                     'standing', 'standing'])
+                path = os.path.join(archive, 'standing', 'tadasana_0__5.png')
+                with open(self.save_pict('tadasana_0__5'), 'rb') as f:
+                    self.assertEqual(entries[path].data, f.read())
+                os.remove(archive)
+
+    def test_import(self):
+        archive = shutil.make_archive(os.path.join(self.tmp, 'picts'),
+                                      'gztar', self.tmp,
+                                      'picts/standing')
+        self.root = archive
+        self.run_import()
+        self.assertEqual(
+            set(TaggedUserItem.objects.values_list('name', flat=True)),
+            {'standing'})
+        self.assertEqual(AsanaForm.objects.count(), 3)
+        self.assertEqual(AsanaFormSource.objects.filter(
+            path__startswith=f'{archive}/picts/standing/').count(), 3)
+
+        # Only members selected for import are read.
+        selected = iter_entries(archive, select=lambda entry: (
+            entry if 'blank' in entry.filename else None))
+        self.assertEqual([x.data is not None for x in selected], [True])
+        lines = self.run_import(dry=True).splitlines()
+        self.assertEqual(json.loads(lines[-1])['summary']['actions'],
+                         {'skip': 3, 'error': 1})
+
+    def test_count(self):
+        self.assertEqual(count_entries(self.root), 6)
+        for fmt, count in (('zip', 6), ('gztar', None)):
+            archive = shutil.make_archive(os.path.join(self.tmp, 'picts'),
+                                          fmt, self.root)
+            self.assertEqual(count_entries(archive), count)
+
+    def test_not_archive(self):
+        filename = self.save_pict('tadasana_0__5')
+        with self.assertRaises(ValueError):
+            list(iter_entries(filename))
+
+
+class ImportSheetTest(ImportTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # 2 rows of 3 cells, 120x120 each.
+        self.sheet = os.path.join(self.tmp, 'standing-poses.png')
+        sheet = Image.new('RGB', (360, 240), 'white')
+        for i, shape in enumerate(('figure', 'box', None, 'box', None,
+                                   'figure')):
+            sheet.paste(make_pict(shape), (i % 3 * 120 + 10,
+                                           i // 3 * 120 + 10))
+        sheet.save(self.sheet)
+        self.manifest = os.path.join(self.tmp, 'manifest.txt')
+        with open(self.manifest, 'w') as f:
+            f.write('# row 1\n'
+                    'tadasana_0__5  vrksasana_0__10  -\n'
+                    '\n'
+                    'vrksasana_1__12  blank_0__3  utkatasana_0__20.png\n')
+
+    def run_sheet(self, **kwargs):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command('import_sheet', self.sheet, self.manifest,
+                         verbosity=0, **kwargs)
+        return out.getvalue()
+
+    def test_manifest(self):
+        cells, columns, rows = read_manifest(self.manifest)
+        self.assertEqual((columns, rows), (3, 2))
+        self.assertEqual(cells, {
+            (1, 1): 'tadasana_0__5', (1, 2): 'vrksasana_0__10',
+            (2, 1): 'vrksasana_1__12', (2, 2): 'blank_0__3',
+            (2, 3): 'utkatasana_0__20'})
+
+    def test_import(self):
+        output = self.run_sheet(resize=True)
+        self.assertIn('blank_0__3.png: blank image', output)
+        forms = AsanaForm.objects.select_related('asana')
+        self.assertEqual(
+            sorted((x.asana.name, x.variant, x.pict_width, x.pict_height)
+                   for x in forms),
+            [('Tadasana', 0, 100, 100), ('Utkatasana', 0, 100, 100),
+             ('Vrksasana', 0, 100, 100), ('Vrksasana', 1, 100, 100)])
+        self.assertEqual(
+            set(TaggedUserItem.objects.values_list('name', flat=True)),
+            {'standing-poses'})
+        self.assertEqual(
+            sorted(AsanaFormSource.objects.values_list('path', flat=True)),
+            [os.path.join(self.sheet, f'{x}.png')
+             for x in ('tadasana_0__5', 'utkatasana_0__20',
+                       'vrksasana_0__10', 'vrksasana_1__12')])
+        # Tiles are not written to disk.
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['manifest.txt', 'media', 'picts',
+                          'standing-poses.png'])
+
+        lines = self.run_sheet(resize=True, dry=True).splitlines()
+        self.assertEqual(json.loads(lines[-1])['summary']['actions'],
+                         {'skip': 4, 'error': 1})
+
+    def test_not_resized(self):
+        self.run_sheet(tag='sheet')
+        self.assertFalse(AsanaForm.objects.exists())
+        with self.assertRaisesMessage(Exception, 'sheet is missing'):
+            call_command('import_sheet', f'{self.sheet}.bmp', self.manifest)
+
+
+class MakeTablesTest(ImportTestMixin, TestCase):
+    def make_tables(self, *args, **kwargs):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            call_command('make_tables', *args, verbosity=0, **kwargs)
+        return out.getvalue()
+
+    def test_dir(self):
+        output = os.path.join(self.tmp, 'tables.pdf')
+        self.assertIn('ERRORS FOUND',
+                      self.make_tables(self.root, output=output))
+        self.assertFalse(os.path.exists(output))
+
+        os.remove(os.path.join(self.root, 'balance', 'nodifficulty_0.png'))
+        # Pixels are checked too.
+        output_text = self.make_tables(self.root, output=output)
+        self.assertIn('ERRORS FOUND', output_text)
+        self.assertIn('blank_0__3.png', output_text)
+        self.assertFalse(os.path.exists(output))
+
+        os.remove(os.path.join(self.root, 'standing', 'blank_0__3.png'))
+        self.assertIn('Exported 4 images on 1 page(s)',
+                      self.make_tables(self.root, output=output))
+        with open(output, 'rb') as f:
+            self.assertIn(b'/Count 1', f.read())
+        self.assertIn('(0 cell(s) rendered, 4 cached)',
+                      self.make_tables(self.root, output=output))
+        self.assertIn('(4 cell(s) rendered, 0 cached)',
+                      self.make_tables(self.root, output=output,
+                                       no_cache=True))
+
+    def test_db(self):
+        self.run_import()
+        output = os.path.join(self.tmp, 'tables')
+        self.assertIn(
+            'Exported 1 images on 1 page(s)',
+            self.make_tables(tag='balance', format='png', output=output))
+        self.assertEqual(os.listdir(output), ['tables_001.png'])
+
+
+class DryRunTest(ImportTestMixin, TestCase):
+    def test_dry(self):
+        self.run_import()
+        self.save_pict('tadasana_0__5', shape='box')
+        os.utime(self.save_pict('blank_0__3'), ns=(0, 0))
+        os.remove(self.save_pict('utkatasana_0__20'))
+        state = (
+            list(AsanaForm.objects.values_list('id', 'pict', 'variant')),
+            list(AsanaFormSource.objects.values_list('path', 'mtime',
+                                                     'digest')),
+            sorted(os.path.join(root, x)
+                   for root, _, files in os.walk(settings.MEDIA_ROOT)
+                   for x in files),
+            )
+
+        lines = self.run_import(dry=True).splitlines()
+        records = {os.path.basename(x['path']): x
+                   for x in map(json.loads, lines[:-1])}
+        self.assertEqual(
+            {k: v['action'] for k, v in records.items()},
+            {'tadasana_0__5.png': 'update', 'vrksasana_0__10.png': 'skip',
+             'vrksasana_1__12.png': 'skip', 'blank_0__3.png': 'error',
+             'nodifficulty_0.png': 'error'})
+        self.assertEqual(len(records['blank_0__3.png']['errors']), 1)
+        summary = json.loads(lines[-1])['summary']
+        self.assertEqual(summary['files'], 5)
+        self.assertEqual(summary['actions'],
+                         {'update': 1, 'skip': 2, 'error': 2})
+
+        self.assertEqual(state, (
+            list(AsanaForm.objects.values_list('id', 'pict', 'variant')),
+            list(AsanaFormSource.objects.values_list('path', 'mtime',
+                                                     'digest')),
+            sorted(os.path.join(root, x)
+                   for root, _, files in os.walk(settings.MEDIA_ROOT)
+                   for x in files),
+            ))
+
+
+class ImportJobsTest(ImportTestMixin, TransactionTestCase):
+    """
+    Output of an import does not depend on the number of processes.
+    """
+    def test_write(self):
+        def run(jobs):
+            output = self.run_import(jobs=jobs)
+            output = re.sub(r'file\(s\) in .*:', '', output)
+            forms = sorted(AsanaForm.objects.values_list('asana__name',
+                                                         'variant'))
+            AsanaForm.objects.all().delete()
+            TaggedUserItem.objects.all().delete()
+            return output, forms
+
+        output, forms = run(1)
+        self.assertIn('[!] Errors found in', output)
+        self.assertEqual(len(forms), 4)
+        self.assertIn('4 created, 0 updated, 0 merged, 2 error(s)', output)
+        self.assertEqual(run(2), (output, forms))
+
+    def test_dry(self):
+        self.run_import()
+        self.save_pict('tadasana_0__5', shape='box')
+        os.utime(self.save_pict('vrksasana_1__12'), ns=(0, 0))
+        lines = {}
+        for jobs in (1, 2, 3):
+            output = self.run_import(dry=True, jobs=jobs).splitlines()
+            lines[jobs] = [(os.path.basename(x['path']), x['action'])
+                           for x in map(json.loads, output[:-1])]
+        self.assertEqual(sorted(lines[1]), [
+            ('blank_0__3.png', 'error'),
+            ('nodifficulty_0.png', 'error'),
+            ('tadasana_0__5.png', 'update'),
+            ('utkatasana_0__20.png', 'skip'),
+            ('vrksasana_0__10.png', 'skip'),
+            ('vrksasana_1__12.png', 'skip'),
+            ])
+        # Skipped files are reported in their place (in the order of
+        # discovery) with any number of processes.
+        self.assertEqual(lines[2], lines[1])
+        self.assertEqual(lines[3], lines[1])
+
+    def test_stats(self):
+        filename = os.path.join(self.tmp, 'stats.json')
+        self.run_import(jobs=2, stats=filename)
+        with open(filename) as f:
+            summary = json.load(f)
+        self.assertEqual((summary['files'], summary['errors']), (6, 2))
+        self.assertEqual(summary['actions'], {'create': 4, 'error': 2})
+        self.assertEqual(summary['counters']['batches'], 1)
+        self.assertEqual(set(summary['timings']), {
+            'discovery', 'read', 'hash', 'decode', 'check', 'phash',
+            'encode', 'save', 'db'})
+
+
+class FormQueryTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=x) for x in ('a', 'b')]
+        scores = [Score.objects.create(name='difficulty', minval=0,
+                                       maxval=40, user=user)
+                  for user in self.users]
+        # name: difficulty by each user, tag of the first user.
+        self.forms = {}
+        for name, vals, tag in (('tadasana', (5, 15), 'standing'),
+                                ('vrksasana', (15, 15), 'balance'),
+                                ('utkatasana', (25, 0), 'standing'),
+                                ('sirsasana', (0, 0), None)):
+            form = AsanaForm.objects.create(
+                asana=Asana.objects.create(name=name))
+            for score, val in zip(scores, vals):
+                ScoredItem.objects.create(name='difficulty', score=score,
+                                          content_object=form, val=val)
+            if tag:
+                TaggedUserItem.objects.create(name=tag, user=self.users[0],
+                                              content_object=form)
+            self.forms[name] = form
+
+    def names(self, forms):
+        with self.assertNumQueries(1):
+            return sorted(x.asana.name for x in forms.select_related('asana'))
+
+    def test_with_difficulty(self):
+        forms = AsanaForm.objects
+        a, b = self.users
+        self.assertEqual(self.names(forms.with_difficulty(10, 20, user=a)),
+                         ['vrksasana'])
+        self.assertEqual(self.names(forms.with_difficulty(10, 20, user=b)),
+                         ['tadasana', 'vrksasana'])
+        # Each form once, whatever the number of matching scores.
+        self.assertEqual(self.names(forms.with_difficulty(10, 20)),
+                         ['tadasana', 'vrksasana'])
+        self.assertEqual(self.names(forms.with_difficulty(20)),
+                         ['utkatasana'])
+        # Forms without difficulty are never in a range.
+        self.assertEqual(self.names(forms.with_difficulty(user=b)),
+                         ['tadasana', 'vrksasana'])
+        self.assertEqual(self.names(forms.with_difficulty(0, 0)), [])
+
+    def test_tagged(self):
+        forms = AsanaForm.objects
+        a, b = self.users
+        self.assertEqual(self.names(forms.tagged('standing')),
+                         ['tadasana', 'utkatasana'])
+        self.assertEqual(self.names(forms.tagged('standing', user=b)), [])
+        self.assertEqual(
+            self.names(forms.with_difficulty(1, 10, user=a)
+                       .tagged('standing', user=a)),
+            ['tadasana'])
+
+    def test_cascade(self):
+        self.forms['tadasana'].delete()
+        self.assertEqual(ScoredItem.objects.count(), 6)
+        self.assertEqual(TaggedUserItem.objects.count(), 2)
+
+
+class DeleteFormTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', is_staff=True,
+                                        is_superuser=True)
+        self.asana = Asana.objects.create(name='tadasana')
+        self.form = AsanaForm.objects.create(asana=self.asana)
+        self.tag = TaggedUserItem.objects.create(
+            name='seq', user=self.user, content_object=self.form)
+        self.sequence = Sequence.objects.create(name='seq', user=self.user)
+
+    def test_unused(self):
+        self.form.delete()
+        self.assertFalse(TaggedUserItem.objects.filter(id=self.tag.id)
+                         .exists())
+
+    def test_shown_in_sequence(self):
+        item = SequenceItem.objects.create(sequence=self.sequence, order=1,
+                                           item=self.tag)
+        version = Sequence.objects.get(id=self.sequence.id).version
+        for obj in (self.form, self.asana):
+            with self.subTest(obj=obj), self.assertRaises(RestrictedError):
+                obj.delete()
+        self.assertTrue(SequenceItem.objects.filter(id=item.id).exists())
+        self.assertTrue(AsanaForm.objects.filter(id=self.form.id).exists())
+        self.assertEqual(Sequence.objects.get(id=self.sequence.id).version,
+                         version)
+
+        item.delete()
+        self.asana.delete()
+        self.assertFalse(AsanaForm.objects.filter(id=self.form.id).exists())
+
+    def test_tag_deleted(self):
+        SequenceItem.objects.create(sequence=self.sequence, order=1,
+                                    item=self.tag)
+        with self.assertRaises(RestrictedError):
+            self.tag.delete()
+        self.sequence.delete()
+        self.form.delete()
+        self.assertFalse(TaggedUserItem.objects.exists())
+
+    def test_admin(self):
+        SequenceItem.objects.create(sequence=self.sequence, order=1,
+                                    item=self.tag)
+        self.client.force_login(self.user)
+        for url in (reverse('admin:asana_asanaform_delete',
+                            args=[self.form.id]),
+                    reverse('admin:asana_asana_delete',
+                            args=[self.asana.id])):
+            with self.subTest(url=url):
+                response = self.client.post(url, {'post': 'yes'})
+                self.assertContains(response, 'SequenceItem object')
+        self.assertTrue(AsanaForm.objects.filter(id=self.form.id).exists())
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='user')
+        for name, note, tag in (
+                ('Tadasana', 'Mountain pose', None),
+                ('Mountain Climber', None, None),
+                ('Virabhadrasana', 'Warrior pose', None),
+                ('Vrksasana', 'Tree pose', 'balance'),
+                ('Adho Mukha Svanasana', 'Downward facing dog', None),
+                ):
+            form = AsanaForm.objects.create(
+                asana=Asana.objects.create(name=name, note=note))
+            if tag:
+                TaggedUserItem.objects.create(name=tag, user=user,
+                                              content_object=form)
+
+    def names(self, query):
+        return [x.name for x in search(query)]
+
+    def test_name(self):
+        self.assertEqual(self.names('tadasana'), ['Tadasana'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Trigrams of PostgreSQL')
+    def test_typo(self):
+        self.assertEqual(self.names('tadsana'), ['Tadasana'])
+        self.assertEqual(self.names('svanasna')[0], 'Adho Mukha Svanasana')
+        self.assertEqual(self.names('balanse'), ['Vrksasana'])
+
+    def test_note(self):
+        self.assertEqual(self.names('warriors'), ['Virabhadrasana'])
+
+    def test_name_ranked_above_note(self):
+        self.assertEqual(self.names('mountain'),
+                         ['Mountain Climber', 'Tadasana'])
+
+    def test_tag(self):
+        self.assertEqual(self.names('balance'), ['Vrksasana'])
+
+    def test_empty(self):
+        self.assertEqual(self.names('  '), [])
+
+    def test_lazy(self):
+        with self.assertNumQueries(0):
+            search('tadsana')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Indexes of PostgreSQL')
+    def test_indexes(self):
+        sql, params = search('tadsana').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        for index in ('asana_asana_name_trgm_idx', 'asana_asana_search_idx'):
+            self.assertIn(index, plan)
+
+    def test_endpoint(self):
+        url = reverse('asana:search')
+        data = self.client.get(url, {'q': 'mountain', 'limit': 1}).json()
+        self.assertEqual([x['name'] for x in data['results']],
+                         ['Mountain Climber'])
+        self.assertEqual(len(data['results'][0]['forms']), 1)
+        response = self.client.get(url, {'q': 'mountain', 'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PhashMigrationTest(SimpleTestCase):
+    def test_frozen_phash(self):
+        migration = importlib.import_module(
+            'asana.migrations.0005_asanaform_phash')
+        for shape, offset, _ in PICTS.values():
+            im = make_pict(shape, offset)
+            self.assertEqual(migration.phash(im), phash(im))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Trigrams of PostgreSQL')
+class SearchThresholdTest(TransactionTestCase):
+    def threshold(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW pg_trgm.word_similarity_threshold')
+            return cursor.fetchone()[0]
+
+    def test_transaction_local(self):
+        Asana.objects.create(name='Tadasana')
+        default = self.threshold()
+        self.assertEqual([x.name for x in search('tadsana')], ['Tadasana'])
+        self.assertEqual(search('tadsana').count(), 1)
+        self.assertEqual(self.threshold(), default)
+
+
+class SimilarTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.picts = {
+            'Tadasana': make_pict(),
+            'Vrksasana': make_pict('box'),
+            'Utkatasana': make_pict(offset=(5, 3)),
+            }
+        cls.forms = {
+            name: AsanaForm.objects.create(
+                asana=Asana.objects.create(name=name), phash=phash(im))
+            for name, im in cls.picts.items()
+            }
+
+    def setUp(self):
+        index = PictIndex()
+        patcher = mock.patch('asana.similarity._index', index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = index
+
+    def test_search(self):
+        box = phash(make_pict('box', offset=(2, 2)))
+        expected = sorted(
+            ((x.id, hamming(box, x.phash)) for x in self.forms.values()),
+            key=lambda x: x[1])
+        self.assertEqual(self.index.search(box, 3), expected)
+        self.assertEqual(self.index.search(box, 1), expected[:1])
+        self.assertEqual(len(self.index), 3)
+
+    def test_refresh(self):
+        self.index.refresh()
+        form = self.forms['Vrksasana']
+        # As the importer does it: no signals.
+        AsanaForm.objects.filter(id=form.id).update(
+            phash=phash(make_pict()), updated=timezone.now())
+        other = AsanaForm.objects.create(
+            asana=form.asana, variant=1, phash=phash(make_pict('box')))
+        # Changed forms and a count, no reload.
+        with self.assertNumQueries(2):
+            self.index.refresh()
+        self.assertEqual(self.index.search(other.phash, 1), [(other.id, 0)])
+        self.assertEqual(
+            sorted(x for x, d in self.index.search(phash(make_pict()), 4)
+                   if d == 0),
+            sorted([form.id, self.forms['Tadasana'].id,
+                    self.forms['Utkatasana'].id]))
+
+        AsanaForm.objects.filter(id=other.id).delete()
+        self.index.refresh()
+        self.assertEqual(len(self.index), 3)
+        self.assertNotIn(other.id,
+                         [x for x, _ in self.index.search(other.phash, 4)])
+
+    def test_refresh_publishes(self):
+        self.index.refresh()
+        arrays = self.index.arrays
+        before = [x.copy() for x in arrays]
+        form = self.forms['Vrksasana']
+        AsanaForm.objects.filter(id=form.id).update(
+            phash=phash(make_pict()), updated=timezone.now())
+        self.index.refresh()
+        # Arrays read by a search in another thread are left as they were.
+        self.assertIsNot(self.index.arrays, arrays)
+        for array, copy in zip(arrays, before):
+            np.testing.assert_array_equal(array, copy)
+        ids, hashes = self.index.arrays
+        self.assertEqual(len(ids), len(hashes))
+        self.assertIn((form.id, 0), self.index.search(phash(make_pict()), 3))
+
+    def test_refresh_late_commit(self):
+        self.index.refresh()
+        form = self.forms['Vrksasana']
+        # Committed after the refresh, stamped before the latest change.
+        AsanaForm.objects.filter(id=form.id).update(
+            phash=phash(make_pict()),
+            updated=self.index.updated - timedelta(seconds=30))
+        self.index.refresh()
+        self.assertEqual(len(self.index), 3)
+        self.assertIn((form.id, 0), self.index.search(phash(make_pict()), 3))
+
+        # Older than the overlap: left to the full reload.
+        AsanaForm.objects.filter(id=form.id).update(
+            phash=phash(make_pict('box')),
+            updated=self.index.updated - timedelta(hours=1))
+        self.index.refresh()
+        self.assertNotIn((form.id, 0),
+                         self.index.search(phash(make_pict('box')), 3))
+        with mock.patch('time.monotonic',
+                        return_value=self.index.loaded
+                        + FULL_RELOAD_INTERVAL + 1):
+            self.index.refresh()
+        self.assertIn((form.id, 0),
+                      self.index.search(phash(make_pict('box')), 3))
+
+    def test_saved_in_process(self):
+        self.assertEqual(len(self.index.search(0)), 3)
+        self.forms['Tadasana'].delete()
+        self.assertEqual(len(self.index.search(0)), 2)
+
+    def test_endpoint(self):
+        buf = io.BytesIO()
+        self.picts['Vrksasana'].save(buf, 'PNG')
+        buf.seek(0)
+        buf.name = 'query.png'
+        response = self.client.post(reverse('asana:similar'),
+                                    {'image': buf, 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0], {
+            'id': self.forms['Vrksasana'].id, 'asana': 'Vrksasana',
+            'variant': 0, 'pict': None, 'distance': 0})
+
+    def test_endpoint_errors(self):
+        url = reverse('asana:similar')
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        buf = io.BytesIO(b'not an image')
+        buf.name = 'query.png'
+        response = self.client.post(url, {'image': buf})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('invalid image', response.json()['error'])
+
+
+@mock.patch.multiple('asana.sprites', COLUMNS=2, ROWS=1)
+class SpritesTest(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.forms = [self.add_form(name, shape) for name, shape in (
+            ('Tadasana', 'figure'), ('Vrksasana', 'box'),
+            ('Utkatasana', 'figure'), ('Garudasana', 'box'))]
+
+    def add_form(self, name, shape):
+        form = AsanaForm(asana=Asana.objects.create(name=name))
+        self.set_pict(form, shape, offset=(len(name), 0))
+        return form
+
+    def set_pict(self, form, shape, offset=(0, 0)):
+        buf = io.BytesIO()
+        make_pict(shape, offset).save(buf, 'PNG')
+        form.pict.save('pict.png', ContentFile(buf.getvalue()))
+
+    def sheet_files(self):
+        root = os.path.join(settings.MEDIA_ROOT, sprites.SPRITE_DIR)
+        return sorted(x for _, _, files in os.walk(root) for x in files
+                      if x != 'index.json')
+
+    def test_build(self):
+        self.assertEqual(sprites.build(), ('all', [0, 1]))
+        index = sprites.read_index('all')
+        self.assertEqual(len(index['sheets']), 2)
+        self.assertEqual(len(self.sheet_files()), 2)
+        for form in self.forms:
+            sheet, x, y, pict = index['forms'][str(form.id)]
+            self.assertEqual(pict, form.pict.name)
+            with sprites.storage.open(index['sheets'][sheet]) as f, \
+                    Image.open(f) as im, form.pict.open() as f, \
+                    Image.open(f) as expected:
+                self.assertEqual(
+                    im.crop((x, y, x + 100, y + 100)).convert('RGB')
+                    .tobytes(),
+                    expected.convert('RGB').tobytes())
+        # Nothing changed.
+        self.assertEqual(sprites.build(), ('all', []))
+
+    def test_incremental(self):
+        sprites.build()
+        index = sprites.read_index('all')
+        slots = {k: v[:3] for k, v in index['forms'].items()}
+
+        # A changed pictogram: only its sheet is rendered again, the
+        # replaced sheet is removed.
+        form = self.forms[3]
+        self.set_pict(form, 'figure')
+        sheet = index['forms'][str(form.id)][0]
+        self.assertEqual(sprites.build(), ('all', [sheet]))
+        self.assertEqual(len(self.sheet_files()), 2)
+
+        # A removed form frees its slot for a new one.
+        removed = str(self.forms[0].id)
+        sheet = index['forms'][removed][0]
+        self.forms[0].delete()
+        added = self.add_form('Savasana', 'box')
+        self.assertEqual(sprites.build(), ('all', [sheet]))
+        index = sprites.read_index('all')
+        self.assertEqual(index['forms'][str(added.id)][:3],
+                         slots[removed])
+        for form in self.forms[1:]:
+            self.assertEqual(index['forms'][str(form.id)][:3],
+                             slots[str(form.id)])
+
+    def test_tag(self):
+        user = User.objects.create(username='user')
+        TaggedUserItem.objects.create(name='Standing Poses', user=user,
+                                      content_object=self.forms[1])
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('build_sprites', tags=['Standing Poses'], all=True)
+        self.assertEqual(list(sprites.read_index('standing-poses')['forms']),
+                         [str(self.forms[1].id)])
+        self.assertEqual(len(sprites.read_index('all')['forms']), 4)
+
+    def test_sprite(self):
+        form = self.forms[0]
+        self.assertIsNone(sprites.get_sprite(form))
+        sprites.build()
+        url, x, y = sprites.get_sprite(form)
+        self.assertTrue(url.startswith(settings.MEDIA_URL))
+        self.set_pict(form, 'box')
+        # Outdated.
+        self.assertIsNone(sprites.get_sprite(form))
+
+    def test_endpoint(self):
+        self.assertEqual(
+            self.client.get(reverse('asana:sprites')).status_code, 404)
+        sprites.build()
+        response = self.client.get(reverse('asana:sprites'))
+        self.assertEqual(response.status_code, 200)
+        index = response.json()
+        self.assertEqual(len(index['forms']), 4)
+        self.assertTrue(all(x.startswith(settings.MEDIA_URL)
+                            for x in index['sheets']))
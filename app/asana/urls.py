@@ -0,0 +1,13 @@
+from django.urls import path
+
+from asana import views
+
+
+app_name = 'asana'
+
+urlpatterns = [
+    path('search/', views.search, name='search'),
+    path('similar/', views.similar, name='similar'),
+    path('sprites/', views.sprites, name='sprites'),
+    path('sprites/<slug:name>/', views.sprites, name='sprites'),
+]
@@ -1,3 +1,101 @@
-from django.shortcuts import render
+from PIL import Image, UnidentifiedImageError
 
-# Create your views here.
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from core.pictogram import phash
+from asana.models import AsanaForm
+from asana.search import SEARCH_LIMIT, SEARCH_MAX_LIMIT, search as \
+    search_asanas
+from asana.similarity import get_index
+from asana.sprites import get_index as get_sprite_index, storage
+
+
+SIMILAR_LIMIT = 10
+SIMILAR_MAX_LIMIT = 100
+
+
+@csrf_exempt
+@require_POST
+def similar(request):
+    """
+    Finds asana forms whose pictograms look like the uploaded image
+    (multipart field 'image'). Optional field 'limit' - number of results.
+    """
+    upload = request.FILES.get('image')
+    if upload is None:
+        return JsonResponse({'error': 'image not provided'}, status=400)
+
+    try:
+        limit = int(request.POST.get('limit', SIMILAR_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be integer'}, status=400)
+    limit = max(1, min(limit, SIMILAR_MAX_LIMIT))
+
+    try:
+        with Image.open(upload) as im:
+            value = phash(im)
+    except (UnidentifiedImageError, OSError) as exc:
+        return JsonResponse({'error': f'invalid image: {exc}'}, status=400)
+
+    nearest = get_index().search(value, limit)
+    forms = AsanaForm.objects.select_related('asana') \
+        .in_bulk([form_id for form_id, _ in nearest])
+    results = []
+    for form_id, distance in nearest:
+        form = forms.get(form_id)
+        if form is None:
+            continue
+        results.append({
+            'id': form.id,
+            'asana': form.asana.name,
+            'variant': form.variant,
+            'pict': form.pict.url if form.pict else None,
+            'distance': distance,
+            })
+    return JsonResponse({'results': results})
+
+
+def sprites(request, name='all'):
+    """
+    Index of sprite atlas `name` (see `asana.sprites`) with URLs of sheets.
+    """
+    index = get_sprite_index(name)
+    if index is None:
+        raise Http404(f'No sprite atlas {name}')
+    return JsonResponse(dict(
+        index,
+        sheets=[storage.url(sheet) for sheet in index['sheets']]
+        ))
+
+
+@require_GET
+def search(request):
+    """
+    Asanas matching `?q=` by name, note or tags of their forms (see
+    `asana.search`), best first, with their forms. Optional `?limit=`.
+    """
+    try:
+        limit = int(request.GET.get('limit', SEARCH_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be integer'}, status=400)
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    asanas = search_asanas(request.GET.get('q')) \
+        .prefetch_related('forms')[:limit]
+    return JsonResponse({'results': [
+        {
+            'id': asana.id,
+            'name': asana.name,
+            'note': asana.note,
+            'rank': asana.search_rank,
+            'forms': [
+                {'id': form.id,
+                 'variant': form.variant,
+                 'pict': form.pict.url if form.pict else None}
+                for form in asana.forms.all()
+                ],
+            }
+        for asana in asanas
+        ]})
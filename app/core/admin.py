@@ -22,14 +22,29 @@ def pict_or_name(obj):
         return obj
 
 
+class ContentObjectAdmin(admin.ModelAdmin):
+    """
+    Admin of models with `content_object`: objects of all rows on a page
+    are fetched with a query per content type (and `content_related` of
+    them, see `core.models.resolve_content_objects`), not a few queries
+    per row.
+    """
+    content_related = {'asana.asanaform': 'asana'}
+
+    def get_queryset(self, request):
+        return super().get_queryset(request) \
+            .with_content_objects(self.content_related)
+
+
 class ScoreAdmin(admin.ModelAdmin):
     list_display = ("name", "minval", "maxval", "user", "privacy", )
     list_filter = ("user", "privacy", )
 
 
 # XXX display scores of authenticated user (unless SU, then display all)
-class ScoredItemAdmin(admin.ModelAdmin):
+class ScoredItemAdmin(ContentObjectAdmin):
     list_display = ("_content_object", "score", "val", )
+    list_select_related = ("score__user", )
     ordering = ("score", "val", "object_id", )
     list_filter = ("score__name", "content_type", )
 
@@ -38,8 +53,9 @@ class ScoredItemAdmin(admin.ModelAdmin):
         return pict_or_name(obj)
 
 
-class TaggedUserItemAdmin(admin.ModelAdmin):
+class TaggedUserItemAdmin(ContentObjectAdmin):
     list_display = ("_content_object", "name", "user", )
+    list_select_related = ("user", )
     ordering = ("user", "name", "object_id", )
     list_filter = ("name", "user", "content_type", )
 
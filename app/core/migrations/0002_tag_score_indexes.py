@@ -0,0 +1,29 @@
+# Generated by Django 4.1 on 2026-10-18 09:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scoreditem',
+            index=models.Index(condition=models.Q(('val__gt', 0)), fields=['score', 'content_type', 'val'], include=('object_id',), name='core_scored_range_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scoreditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='core_scored_object_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taggeduseritem',
+            index=models.Index(fields=['content_type', 'name', 'user'], include=('object_id',), name='core_tagged_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taggeduseritem',
+            index=models.Index(fields=['content_type', 'object_id'], name='core_tagged_object_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 """Abstracts classes and Mixins used in all apps."""
 
+from collections import defaultdict
+
 from django.db import models
+from django.db.models.query import ModelIterable
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
@@ -47,6 +50,89 @@ def user_directory_path(instance, filename):
     return f'user_{instance.user.id}/{filename}'
 
 
+def resolve_content_objects(items, related=None):
+    """
+    Sets `content_object` (and `content_type`) of `items` - instances of
+    TaggedModel/TaggedUserModel, - grouped by content type: objects of
+    every model are fetched in a single `in_bulk` query, instead of a
+    query per item when `content_object` is accessed.
+
+    `related` maps models (classes or labels, such as 'asana.asanaform')
+    to `select_related` fields of their objects (a name or a list),
+    e.g. {AsanaForm: 'asana'}.
+
+    Items whose objects no longer exist get None (as accessing
+    `content_object` would, but without a query). Returns `items`.
+    """
+    related = {
+        (key if isinstance(key, str) else key._meta.label_lower):
+        ([val] if isinstance(val, str) else list(val))
+        for key, val in (related or {}).items()
+        }
+    by_type = defaultdict(set)
+    for item in items:
+        by_type[item.content_type_id].add(item.object_id)
+
+    objects, content_types = {}, {}
+    for ct_id, ids in by_type.items():
+        content_type = content_types[ct_id] = \
+            ContentType.objects.get_for_id(ct_id)
+        model = content_type.model_class()
+        if model is None:
+            # Model no longer exists.
+            objects[ct_id] = {}
+            continue
+        found = model._base_manager.all()
+        fields = related.get(model._meta.label_lower)
+        if fields:
+            found = found.select_related(*fields)
+        objects[ct_id] = found.in_bulk(ids)
+
+    for item in items:
+        cls = type(item)
+        cls._meta.get_field('content_type').set_cached_value(
+            item, content_types[item.content_type_id])
+        cls.content_object.set_cached_value(
+            item, objects[item.content_type_id].get(item.object_id))
+    return items
+
+
+class GenericQuerySet(models.QuerySet):
+    """
+    QuerySet of models with `content_object`, able to resolve them in
+    bulk (see `resolve_content_objects`):
+
+        TaggedUserItem.objects.filter(name=tag) \
+            .with_content_objects({AsanaForm: 'asana'})
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._content_related = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._content_related = self._content_related
+        return clone
+
+    def _fetch_all(self):
+        resolve = (self._result_cache is None
+                   and self._content_related is not None
+                   and self._iterable_class is ModelIterable)
+        super()._fetch_all()
+        if resolve:
+            resolve_content_objects(self._result_cache, self._content_related)
+
+    def with_content_objects(self, related=None):
+        """
+        Resolves `content_object` of all rows when the queryset is
+        evaluated (not with `iterator()`), `related` as in
+        `resolve_content_objects`.
+        """
+        clone = self._chain()
+        clone._content_related = related or {}
+        return clone
+
+
 class DictDocumentMixin(object):
     @property
     def _dict(self):
@@ -102,6 +188,8 @@ class TaggedUserModel(NamedUserModel):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    objects = GenericQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
@@ -116,11 +204,24 @@ class TaggedModel(NamedModel):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    objects = GenericQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
 
 class TaggedUserItem(TaggedUserModel):
+    class Meta:
+        indexes = [
+            # Objects with a tag (of a user).
+            models.Index(fields=['content_type', 'name', 'user'],
+                         include=['object_id'],
+                         name='core_tagged_name_idx'),
+            # Tags of objects (generic relations).
+            models.Index(fields=['content_type', 'object_id'],
+                         name='core_tagged_object_idx'),
+            ]
+
     def __str__(self):
         try:
             return '#{} {} <{}:{}:{}>'.format(
@@ -169,10 +270,27 @@ class ScoredItem(TaggedModel):
                                                  model='asanaform'),
             val__gte=40
             )
+
+        or, joined to forms (see asana.models.AsanaFormQuerySet):
+
+        qs = AsanaForm.objects.with_difficulty(40)
     """
     score = models.ForeignKey(Score, on_delete=models.CASCADE)
     val = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Objects by range of values of a score (unscored objects, 0,
+            # are never looked up by range).
+            models.Index(fields=['score', 'content_type', 'val'],
+                         include=['object_id'],
+                         condition=models.Q(val__gt=0),
+                         name='core_scored_range_idx'),
+            # Scores of objects (generic relations).
+            models.Index(fields=['content_type', 'object_id'],
+                         name='core_scored_object_idx'),
+            ]
+
     def __str__(self):
         try:
             return '{} <{}:{}:{}> {}:{} ({})'.format(
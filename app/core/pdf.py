@@ -0,0 +1,154 @@
+"""
+Minimal PDF writer: a document of full-page JPEG images, written page by
+page, so that only the current page is held in memory.
+
+Documents can also be produced as a stream of chunks (see `iter_pdf`),
+e.g. for `StreamingHttpResponse`.
+"""
+
+import io
+
+from PIL import Image
+
+
+class PDFWriter:
+    """
+    Writes pages to file object `f` (opened in binary mode) as they come:
+
+        with open('tables.pdf', 'wb') as f, PDFWriter(f) as pdf:
+            for page in pages:
+                pdf.add_image(page)
+
+    Pages are sized in points (1/72 inch) - `dpi` pixels per inch.
+    """
+    # Objects 1 and 2 are the catalog and the page tree, written last.
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, f, dpi=72):
+        self.f = f
+        self.dpi = dpi
+        self.offsets = {}
+        self.pages = []
+        self.next_id = self.PAGES + 1
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def reserve(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def write_object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(f'{obj_id} 0 obj\n'.encode())
+        self.f.write(body.encode())
+        if stream is not None:
+            self.f.write(b'\nstream\n')
+            self.f.write(stream)
+            self.f.write(b'\nendstream')
+        self.f.write(b'\nendobj\n')
+
+    def add_image(self, im, quality=90):
+        """
+        Adds PIL image `im` as a page (encoded as JPEG).
+        """
+        if im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        buf = io.BytesIO()
+        im.save(buf, 'JPEG', quality=quality)
+        self.add_jpeg(buf.getvalue())
+
+    def add_jpeg(self, data):
+        """
+        Adds JPEG image `data` (bytes) as a page.
+        """
+        with Image.open(io.BytesIO(data)) as im:
+            (width, height), mode = im.size, im.mode
+        colorspace = '/DeviceGray' if mode == 'L' else '/DeviceRGB'
+        page_w, page_h = width * 72 / self.dpi, height * 72 / self.dpi
+
+        image_id, content_id, page_id = (self.reserve() for _ in range(3))
+        self.write_object(
+            image_id,
+            f'<< /Type /XObject /Subtype /Image /Width {width} '
+            f'/Height {height} /ColorSpace {colorspace} '
+            f'/BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>',
+            data
+            )
+        content = f'q {page_w:.2f} 0 0 {page_h:.2f} 0 0 cm /Im0 Do Q'.encode()
+        self.write_object(content_id, f'<< /Length {len(content)} >>', content)
+        self.write_object(
+            page_id,
+            f'<< /Type /Page /Parent {self.PAGES} 0 R '
+            f'/MediaBox [0 0 {page_w:.2f} {page_h:.2f}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'
+            )
+        self.pages.append(page_id)
+
+    def close(self):
+        """
+        Writes the page tree, the catalog and the cross-reference table.
+        """
+        kids = ' '.join(f'{x} 0 R' for x in self.pages)
+        self.write_object(
+            self.PAGES,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>'
+            )
+        self.write_object(
+            self.CATALOG,
+            f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'
+            )
+
+        xref = self.f.tell()
+        self.f.write(f'xref\n0 {self.next_id}\n'.encode())
+        self.f.write(b'0000000000 65535 f \n')
+        for obj_id in range(1, self.next_id):
+            self.f.write(f'{self.offsets[obj_id]:010d} 00000 n \n'.encode())
+        self.f.write(
+            f'trailer\n<< /Size {self.next_id} /Root {self.CATALOG} 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n'.encode()
+            )
+
+
+class StreamBuffer:
+    """
+    Write-only file object keeping only what was written since the last
+    `drain`, while counting the position for `PDFWriter`.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_pdf(pages, dpi=72):
+    """
+    Yields PDF document of `pages` (iterable of JPEG data) in chunks, one
+    per page, as pages come.
+    """
+    buf = StreamBuffer()
+    pdf = PDFWriter(buf, dpi)
+    for data in pages:
+        pdf.add_jpeg(data)
+        yield buf.drain()
+    pdf.close()
+    yield buf.drain()
@@ -0,0 +1,221 @@
+"""
+Pictogram validation shared by all importers.
+
+Checks run on the whole pixel buffer at once (as numpy arrays) instead of
+looping over pixels with `getpixel`.
+
+Naming files:
+<name-of-asana>_<variant 0..N>__<difficulty 1..60>.png
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+
+PICT_SIZE = (100, 100)
+
+# Pixels darker than this (after flattening onto white) count as "ink".
+INK_THRESHOLD = 128
+
+# Perceptual hash: image is reduced to PHASH_SIZE x PHASH_SIZE, of whose
+# DCT the lowest 8x8 frequencies make 64 bits of the hash.
+PHASH_SIZE = 32
+MASK64 = (1 << 64) - 1
+
+
+class PictError(namedtuple('PictError', ('filename', 'code', 'message'))):
+    """
+    Single problem found in a pictogram.
+
+    `code` is machine-readable (e.g. 'size', 'monochrome'), `message` is
+    human-readable; str() gives the same line importers used to print.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return f'{self.filename}: {self.message}'
+
+
+def get_info(fname):
+    """
+    Parses `fname` into asana name, variant and difficulty.
+    """
+    info = {
+        'filename': fname,
+        'name': '',
+        'variant': None,
+        'difficulty': -1,
+        'errors': [],
+        'warnings': [],
+        }
+    name = os.path.basename(fname).replace('.png', '')
+    try:
+        name, difficulty = name.rsplit('__', 1)
+        info['difficulty'] = int(difficulty)
+    except ValueError:
+        info['errors'].append(PictError(
+            fname, 'difficulty', 'difficulty not specified or wrong type'))
+        return info
+
+    try:
+        name, variant = name.rsplit('_', 1)
+        variant = int(variant)
+    except ValueError:
+        info['errors'].append(PictError(
+            fname, 'variant', 'variant not specified or wrong type'))
+        return info
+
+    info.update({
+        'name': name.title(),
+        'variant': variant
+        })
+    return info
+
+
+def to_arrays(im):
+    """
+    Returns RGB pixels (h, w, 3) and alpha (h, w) of `im` as uint8 arrays.
+    """
+    if im.mode != 'RGBA':
+        im = im.convert('RGBA')
+    rgba = np.asarray(im)
+    return rgba[..., :3], rgba[..., 3]
+
+
+def luminance(rgb):
+    """
+    Returns luminance (h, w) of RGB pixels, as in `Image.convert('L')`
+    (ITU-R 601-2 weights, exact for gray pixels).
+    """
+    rgb = rgb.astype(np.uint32)
+    return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471
+             + 0x8000) >> 16).astype(np.uint8)
+
+
+def flatten(rgb, alpha):
+    """
+    Returns gray levels (h, w) of the image composed onto white background.
+    """
+    gray = luminance(rgb).astype(np.uint16)
+    alpha = alpha.astype(np.uint16)
+    return ((gray * alpha + 255 * (255 - alpha)) // 255).astype(np.uint8)
+
+
+def check_pixels(im, fname=''):
+    """
+    Checks pixel buffer of the image `im`:
+    - size (100x100px)
+    - monochrome (every visible pixel has R == G == B)
+    - blank (no ink at all)
+    and additionally reports:
+    - alpha (semi-transparent or transparent pixels)
+    - border (ink touches the edge, i.e. pictogram is probably cropped)
+
+    Returns a tuple of two lists of `PictError`: errors and warnings.
+    """
+    errors, warnings = [], []
+    if im.size != PICT_SIZE:
+        errors.append(PictError(fname, 'size', f'wrong size {im.size}'))
+
+    rgb, alpha = to_arrays(im)
+    visible = alpha > 0
+    gray = (rgb[..., 0] == rgb[..., 1]) & (rgb[..., 1] == rgb[..., 2])
+    if not (gray | ~visible).all():
+        errors.append(PictError(fname, 'monochrome', 'not monochrome'))
+
+    if (alpha < 255).any():
+        warnings.append(PictError(fname, 'alpha', 'has transparent pixels'))
+
+    ink = flatten(rgb, alpha) < INK_THRESHOLD
+    if not ink.any():
+        errors.append(PictError(fname, 'blank', 'blank image'))
+    elif ink[0].any() or ink[-1].any() or ink[:, 0].any() or ink[:, -1].any():
+        warnings.append(PictError(fname, 'border', 'touches the border'))
+
+    return errors, warnings
+
+
+def check_img(fname, info=None, fp=None):
+    """
+    Opens and checks image `fname` (or reads it from file object `fp`).
+
+    Returns `info` (parsed from filename by default) extended with 'image',
+    'errors' and 'warnings'.
+    """
+    if info is None:
+        info = get_info(fname)
+    info.setdefault('errors', [])
+    info.setdefault('warnings', [])
+
+    im = Image.open(fp or fname)
+    info.update({'image': im})
+    errors, warnings = check_pixels(im, fname)
+    info['errors'].extend(errors)
+    info['warnings'].extend(warnings)
+    return info
+
+
+def fit(im, size=PICT_SIZE):
+    """
+    Returns `im` in gray levels, scaled down (keeping proportions) and
+    centered on white background of `size`.
+    """
+    im = Image.fromarray(flatten(*to_arrays(im)))
+    im.thumbnail(size, Image.LANCZOS)
+    canvas = Image.new('L', size, 255)
+    canvas.paste(im, ((size[0] - im.width) // 2, (size[1] - im.height) // 2))
+    return canvas
+
+
+def dct_matrix(n):
+    """
+    Returns DCT-II matrix (n x n), so that DCT of `x` is `m @ x @ m.T`.
+    """
+    k = np.arange(n).reshape(-1, 1)
+    m = np.cos(np.pi * (2 * np.arange(n) + 1) * k / (2 * n))
+    m[0] /= np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+DCT = dct_matrix(PHASH_SIZE)
+
+
+def normalize(im):
+    """
+    Returns gray levels of `im` (flattened onto white), cropped to the ink
+    and padded to a square, as PIL image - so that pictograms differing
+    in margins or crop can be compared.
+    """
+    gray = flatten(*to_arrays(im))
+    rows = np.flatnonzero((gray < INK_THRESHOLD).any(axis=1))
+    cols = np.flatnonzero((gray < INK_THRESHOLD).any(axis=0))
+    if rows.size:
+        gray = gray[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    h, w = gray.shape
+    side = max(h, w)
+    square = np.full((side, side), 255, dtype=np.uint8)
+    square[(side - h) // 2:(side - h) // 2 + h,
+           (side - w) // 2:(side - w) // 2 + w] = gray
+    return Image.fromarray(square)
+
+
+def phash(im):
+    """
+    Returns perceptual (DCT) hash of the image `im`: 64 bits as a signed
+    integer (to fit into a BigIntegerField). Compare with `hamming`.
+    """
+    small = normalize(im).resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    freq = (DCT @ np.asarray(small, dtype=np.float64) @ DCT.T)[:8, :8]
+    bits = (freq > np.median(freq.flat[1:])).flatten()
+    value = int(np.packbits(bits).view('>u8')[0])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a, b):
+    """
+    Returns number of differing bits between 64-bit hashes `a` and `b`.
+    """
+    return bin((a ^ b) & MASK64).count('1')
@@ -0,0 +1,426 @@
+"""
+Slicing contact sheets into tiles (pictograms).
+
+Maintained Python 3 version of `_scripts/image_slicer` (originally by Sam
+Dobson, MIT license). Tiles are cropped one by one and encoded in a pool
+of threads: PIL releases the GIL while encoding, so tiles of one sheet are
+saved on all cores without copying images between processes.
+
+Sheets stored as uncompressed BMP or PPM (what scanners usually produce)
+are never decoded whole: rows of the sheet are read band by band (one row
+of tiles at a time), so that memory stays at about one band whatever the
+size of the scan. Other sheets (JPEG, PNG, TIFF) are decoded whole.
+
+Instead of splitting a sheet into equal cells, the grid can be detected
+from white gutters between pictograms (see `detect_grid`).
+"""
+
+import os
+from collections import deque
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
+from math import sqrt, ceil, floor
+
+import numpy as np
+from PIL import Image
+
+from core.pictogram import INK_THRESHOLD
+
+
+SHEET_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.ppm')
+
+# Default grid of a contact sheet.
+COLUMNS = 5
+ROWS = 7
+
+TILE_LIMIT = 99 * 99
+
+# Gutter is a run of at least MIN_GUTTER rows (columns) of a sheet, in
+# which no more than GUTTER_NOISE of pixels are ink (specks of dust).
+MIN_GUTTER = 4
+GUTTER_NOISE = 0.005
+
+# Rows of uncompressed sheets decoded at once while detecting the grid.
+PROFILE_BAND = 256
+
+# Formats (as of `Image.format`) of sheets read by rows, if uncompressed.
+BAND_FORMATS = ('BMP', 'PPM')
+
+
+def get_basename(filename):
+    """Strip path and extension. Return basename."""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+class Tile:
+    """Represents a single tile."""
+
+    def __init__(self, image, number, position, coords, filename=None):
+        self.image = image
+        self.number = number
+        self.position = position
+        self.coords = coords
+        self.filename = filename
+
+    @property
+    def row(self):
+        return self.position[0]
+
+    @property
+    def column(self):
+        return self.position[1]
+
+    @property
+    def basename(self):
+        """Strip path and extension. Return base filename."""
+        return get_basename(self.filename)
+
+    def generate_filename(self, directory=None, prefix='tile',
+                          format='png', path=True):
+        """Construct and return a filename for this tile."""
+        filename = f'{prefix}_{self.row:02d}_{self.column:02d}.{format}'
+        if not path:
+            return filename
+        return os.path.join(directory or os.getcwd(), filename)
+
+    def save(self, filename=None, format='png'):
+        if not filename:
+            filename = self.generate_filename(format=format)
+        self.image.save(filename, format)
+        self.filename = filename
+
+    def __repr__(self):
+        """Show tile number, and if saved to disk, filename."""
+        if self.filename:
+            return f'<Tile #{self.number} - {os.path.basename(self.filename)}>'
+        return f'<Tile #{self.number}>'
+
+
+def calc_columns_rows(n):
+    """
+    Calculate the number of columns and rows required to divide an image
+    into ``n`` parts.
+
+    Return a tuple of integers in the format (num_columns, num_rows)
+    """
+    num_columns = int(ceil(sqrt(n)))
+    num_rows = int(ceil(n / float(num_columns)))
+    return (num_columns, num_rows)
+
+
+def get_combined_size(tiles):
+    """Calculate combined size of tiles."""
+    columns = max(tile.column for tile in tiles)
+    rows = max(tile.row for tile in tiles)
+    tile_w, tile_h = tiles[0].image.size
+    return (tile_w * columns, tile_h * rows)
+
+
+def join(tiles):
+    """
+    Pastes `tiles` back together. Returns `Image` instance.
+    """
+    im = Image.new('RGB', get_combined_size(tiles), None)
+    for tile in tiles:
+        im.paste(tile.image, tile.coords)
+    return im
+
+
+def validate_grid(columns, rows):
+    """Basic sanity checks prior to performing a split."""
+    try:
+        columns, rows = int(columns), int(rows)
+    except (TypeError, ValueError):
+        raise ValueError('columns and rows could not be cast to integer.')
+
+    if columns < 1 or rows < 1 or not 2 <= columns * rows <= TILE_LIMIT:
+        raise ValueError(
+            f'Number of tiles must be between 2 and {TILE_LIMIT} '
+            f'(you asked for {columns}x{rows}).'
+            )
+    return columns, rows
+
+
+def grid(size, columns=COLUMNS, rows=ROWS):
+    """
+    Splits image of `size` into equal cells. Returns list of (row, column,
+    area) - 1-based position and crop box of every cell.
+    """
+    columns, rows = validate_grid(columns, rows)
+    im_w, im_h = size
+    tile_w, tile_h = int(floor(im_w / columns)), int(floor(im_h / rows))
+    return [
+        (row + 1, column + 1,
+         (column * tile_w, row * tile_h,
+          (column + 1) * tile_w, (row + 1) * tile_h))
+        for row in range(rows)
+        for column in range(columns)
+        ]
+
+
+def raw_strips(im):
+    """
+    Returns list of (y0, y1, offset, rawmode, stride, ystep) of strips of
+    uncompressed image `im` (not loaded yet), or None if rows of `im` can't
+    be read separately: only uncompressed BMP and PPM (PGM, PBM) images
+    are read by rows, anything else is decoded whole.
+    """
+    if im.format not in BAND_FORMATS:
+        return None
+
+    width = im.size[0]
+    strips = []
+    for codec, extents, offset, args in im.tile:
+        if codec != 'raw' or extents[0] != 0 or extents[2] != width:
+            return None
+        if isinstance(args, str):
+            args = (args, )
+        rawmode, stride, ystep = (tuple(args) + (0, 1))[:3]
+        if not stride:
+            try:
+                stride = len(Image.new(im.mode, (width, 1)).tobytes(
+                    'raw', rawmode))
+            except (ValueError, OSError):
+                return None
+        strips.append((extents[1], extents[3], offset, rawmode, stride, ystep))
+    return sorted(strips) or None
+
+
+def load_rows(filename, strips, y0, y1):
+    """
+    Decodes only rows `y0`..`y1` of the image `filename`, stored as
+    `strips` (see `raw_strips`): reads their bytes from the file and
+    decodes them with `Image.frombuffer`. Returns them as an image.
+    """
+    with Image.open(filename) as im:
+        mode, width, palette = im.mode, im.size[0], im.palette
+    band = Image.new(mode, (width, y1 - y0))
+    if mode == 'P' and palette is not None:
+        band.putpalette(palette)
+
+    with open(filename, 'rb') as f:
+        for top, bottom, offset, rawmode, stride, ystep in strips:
+            start, end = max(y0, top), min(y1, bottom)
+            if start >= end:
+                continue
+            if ystep < 0:
+                # Stored bottom-up: the last row of the band comes first.
+                offset += (bottom - end) * stride
+            else:
+                offset += (start - top) * stride
+            f.seek(offset)
+            data = f.read((end - start) * stride)
+            part = Image.frombuffer(mode, (width, end - start), data, 'raw',
+                                    rawmode, stride, ystep)
+            band.paste(part, (0, start - y0))
+    return band
+
+
+def ink_profiles(filename):
+    """
+    Returns numbers of ink pixels in every row and in every column of the
+    image `filename` (path or file object), as two arrays.
+    """
+    with Image.open(filename) as im:
+        width, height = im.size
+        strips = raw_strips(im) if isinstance(filename, str) else None
+        if strips is None:
+            ink = np.asarray(im.convert('L')) < INK_THRESHOLD
+            return ink.sum(axis=1), ink.sum(axis=0)
+
+    row_ink = np.zeros(height, dtype=np.int64)
+    column_ink = np.zeros(width, dtype=np.int64)
+    for y0 in range(0, height, PROFILE_BAND):
+        y1 = min(y0 + PROFILE_BAND, height)
+        with load_rows(filename, strips, y0, y1) as band:
+            ink = np.asarray(band.convert('L')) < INK_THRESHOLD
+        row_ink[y0:y1] = ink.sum(axis=1)
+        column_ink += ink.sum(axis=0)
+    return row_ink, column_ink
+
+
+def find_spans(blank, count=None, min_gutter=MIN_GUTTER):
+    """
+    Splits lines (rows or columns) of a sheet into spans of tiles, cutting
+    in the middle of gutters: runs of at least `min_gutter` `blank` lines
+    (boolean array). If `count` is given, only the widest `count` - 1
+    gutters are cut.
+
+    Outer margins are trimmed to half of a typical gutter.
+
+    Returns list of (start, end).
+    """
+    length = len(blank)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], blank, [0]))))
+    runs = list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+    gutters = [(start, end) for start, end in runs
+               if start > 0 and end < length and end - start >= min_gutter]
+    if count is not None:
+        if len(gutters) < count - 1:
+            raise ValueError(
+                f'Found {len(gutters) + 1} tiles instead of {count}.')
+        gutters = sorted(
+            sorted(gutters, key=lambda run: run[0] - run[1])[:count - 1])
+
+    half = int(np.median([end - start for start, end in gutters]) // 2) \
+        if gutters else min_gutter
+    head, tail = 0, length
+    if runs and runs[0][0] == 0:
+        head = max(0, runs[0][1] - half)
+    if runs and runs[-1][1] == length:
+        tail = min(length, runs[-1][0] + half)
+
+    cuts = [head] + [(start + end) // 2 for start, end in gutters] + [tail]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def detect_grid(filename, columns=None, rows=None, min_gutter=MIN_GUTTER):
+    """
+    Detects cells of the sheet `filename` from white gutters between
+    them, using ink projections of rows and columns. Expected number of
+    `columns` and `rows` is optional.
+
+    Returns list of (row, column, area) like `grid`.
+    """
+    row_ink, column_ink = ink_profiles(filename)
+    ys = find_spans(row_ink <= GUTTER_NOISE * len(column_ink), rows,
+                    min_gutter)
+    xs = find_spans(column_ink <= GUTTER_NOISE * len(row_ink), columns,
+                    min_gutter)
+    validate_grid(len(xs), len(ys))
+    return [
+        (row + 1, column + 1, (x0, y0, x1, y1))
+        for row, (y0, y1) in enumerate(ys)
+        for column, (x0, x1) in enumerate(xs)
+        ]
+
+
+def iter_tiles(filename, columns=COLUMNS, rows=ROWS, detect=False):
+    """
+    Yields tiles of the image `filename` (path or file object), cropped one
+    at a time. If `detect` is True, the grid is detected from gutters
+    (`columns` and `rows` are then optional), otherwise the sheet is split
+    into equal cells.
+
+    Uncompressed images given by path are read one row of tiles at a time
+    (see `load_rows`): neither the whole image nor already yielded tiles
+    are kept in memory.
+    """
+    cells = None
+    if detect:
+        cells = detect_grid(filename, columns, rows)
+        if hasattr(filename, 'seek'):
+            filename.seek(0)
+
+    with Image.open(filename) as im:
+        cells = list(enumerate(cells or grid(im.size, columns, rows), 1))
+        strips = raw_strips(im) if isinstance(filename, str) else None
+        if strips is None:
+            for number, (row, column, area) in cells:
+                yield Tile(im.crop(area), number, (row, column), area[:2])
+            return
+
+    for _, row_cells in groupby(cells, key=lambda cell: cell[1][0]):
+        row_cells = list(row_cells)
+        _, y0, _, y1 = row_cells[0][1][2]
+        band = load_rows(filename, strips, y0, y1)
+        for number, (row, column, (x0, _, x1, _)) in row_cells:
+            yield Tile(band.crop((x0, 0, x1, y1 - y0)),
+                       number, (row, column), (x0, y0))
+        band.close()
+
+
+def slice_image(filename, columns=COLUMNS, rows=ROWS, detect=False):
+    """
+    Split an image into a grid of `columns` x `rows` tiles (see
+    `iter_tiles`).
+
+    Returns tuple of :class:`Tile` instances.
+    """
+    return tuple(iter_tiles(filename, columns, rows, detect))
+
+
+def save_tile(tile, filename, format='png'):
+    tile.save(filename=filename, format=format)
+    # Saved tiles don't need their pixels anymore.
+    tile.image = None
+    return tile
+
+
+def save_tiles(tiles, prefix='', directory=None, format='png', jobs=1):
+    """
+    Write image files to disk (`directory` is created if it doesn't exist).
+
+    `tiles` can be any iterable (e.g. `iter_tiles`): with `jobs` > 1 tiles
+    are encoded in a pool of threads, taking next tiles only as threads
+    become free, so that few decoded tiles are held in memory at once.
+
+    Returns tuple of saved :class:`Tile` instances.
+    """
+    directory = directory or os.getcwd()
+    os.makedirs(directory, exist_ok=True)
+
+    def filename(tile):
+        return tile.generate_filename(
+            prefix=prefix, directory=directory, format=format)
+
+    if jobs <= 1:
+        return tuple(save_tile(tile, filename(tile), format)
+                     for tile in tiles)
+
+    saved = []
+    with ThreadPoolExecutor(jobs) as executor:
+        pending = deque()
+        for tile in tiles:
+            pending.append(
+                executor.submit(save_tile, tile, filename(tile), format))
+            if len(pending) > 2 * jobs:
+                saved.append(pending.popleft().result())
+        while pending:
+            saved.append(pending.popleft().result())
+    return tuple(saved)
+
+
+def find_sheets(path):
+    """
+    Returns sorted list of contact sheets in directory `path` (or `path`
+    itself, if it is a file).
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(path, fname) for fname in os.listdir(path)
+        if not fname.startswith('.')
+        and os.path.splitext(fname)[1].lower() in SHEET_EXTENSIONS
+        and os.path.isfile(os.path.join(path, fname))
+        )
+
+
+def slice_sheets(filenames, output, columns=COLUMNS, rows=ROWS,
+                 format='png', jobs=1, dry_run=False, detect=False):
+    """
+    Slices every sheet in `filenames` into `output` directory, naming
+    tiles `<sheet basename>_<row>_<column>.<format>`.
+
+    Yields (filename, tiles) for every sheet.
+    """
+    for filename in filenames:
+        if dry_run:
+            # Only report the grid, without cropping tiles.
+            if detect:
+                cells = detect_grid(filename, columns, rows)
+            else:
+                with Image.open(filename) as im:
+                    cells = grid(im.size, columns, rows)
+            yield filename, tuple(
+                Tile(None, number, (row, column), area[:2])
+                for number, (row, column, area) in enumerate(cells, 1)
+                )
+            continue
+
+        tiles = iter_tiles(filename, columns, rows, detect)
+        yield filename, save_tiles(tiles,
+                                   prefix=get_basename(filename),
+                                   directory=output,
+                                   format=format,
+                                   jobs=jobs)
@@ -0,0 +1,73 @@
+"""Storage backends."""
+
+import os
+import hashlib
+import posixpath
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage, which names files by SHA-256 of their content:
+
+        <upload_to>/ab/cd/abcd...ef.png
+
+    (sharded by the first two pairs of hex digits). Identical content is
+    stored once, whatever name it was saved under, and a file behind a
+    name never changes, so that URLs can be cached forever.
+    """
+    def content_name(self, name, content):
+        """
+        Returns name of `content` (File), which is saved as `name`.
+        """
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        digest = sha256.hexdigest()
+        _, ext = posixpath.splitext(name)
+        return posixpath.join(
+            posixpath.dirname(name),
+            digest[:2],
+            digest[2:4],
+            digest + ext.lower()
+            )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name.replace('\\', '/'), content)
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and move it in place, so that the name
+        # never points to a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                content.seek(0)
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # The same name always means the same content.
+        return name
@@ -0,0 +1,261 @@
+"""
+Contact sheets ("tables") of pictograms: pages of IMG_NUM x IMG_NUM
+captioned cells, with numbered columns and rows.
+
+Pages are rendered from (pictogram, caption) pairs, pictograms are only
+opened while their page is rendered, so any number of pages can be made
+without holding more than a page in memory. Rendering is independent of
+the database, so pages can be rendered in a pool of processes (see
+`iter_pages`).
+
+Captioned cells are cached on disk (see `CellCache`), so that pages are
+assembled from cells rendered before, and only cells of changed
+pictograms (or captions) are rendered again.
+"""
+
+import io
+import os
+import re
+import hashlib
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from core.utils import atomic_write, chunked
+
+
+IMG_NUM = 6
+CELL_SIZE = (100, 125)
+MARGIN = 25
+PAGE_SIZE = (CELL_SIZE[0] * IMG_NUM + MARGIN,
+             CELL_SIZE[1] * IMG_NUM + MARGIN)
+PER_PAGE = IMG_NUM * IMG_NUM
+
+FONT_SIZE = 8
+FONT_SIZE_PAGE_NUM = 16
+
+# Fonts tried (in this order) if none is given explicitly; the default
+# bitmap font of PIL is used if neither is found.
+FONT_PATHS = (
+    'DejaVuSansMono.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSansMono.ttf',
+    '/System/Library/Fonts/Monaco.dfont',
+    '/System/Library/Fonts/Monaco.ttf',
+    )
+
+BORDER_COLOR = (125, 125, 125)
+
+# Caption lines are broken after so many characters.
+CAPTION_WIDTH = 17
+
+FORMATS = ('jpeg', 'png', 'pdf')
+
+# Bump to invalidate cached cells when their layout changes.
+CELL_VERSION = 1
+
+# Names of files in content-addressed storage (see core.storage).
+CONTENT_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+@lru_cache(maxsize=None)
+def get_font(size, path=None):
+    """
+    Returns TrueType font of `size` from `path` (if given) or one of
+    FONT_PATHS.
+    """
+    if path:
+        return ImageFont.truetype(path, size)
+
+    for candidate in FONT_PATHS:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def wrap_caption(caption, width=CAPTION_WIDTH):
+    """
+    Breaks `caption` into lines of `width` characters, hyphenated.
+    """
+    if len(caption) <= width + 1:
+        return caption
+
+    lines = [caption[i:i + width] for i in range(0, len(caption), width)]
+    return '\n'.join(
+        line if line.endswith('-') or i == len(lines) - 1 else line + '-'
+        for i, line in enumerate(lines)
+        )
+
+
+def make_cell(pict, caption, font=None):
+    """
+    Returns captioned cell (RGB image of CELL_SIZE) with pictogram `pict`
+    (file name, file object or PIL image; None for caption only) and a
+    gray border.
+    """
+    cell = Image.new('RGB', CELL_SIZE, (255, 255, 255))
+    if pict is not None:
+        im = pict if isinstance(pict, Image.Image) else Image.open(pict)
+        rgba = im.convert('RGBA')
+        cell.paste(rgba, (0, 0), rgba)
+        if im is not pict:
+            im.close()
+
+    draw = ImageDraw.Draw(cell)
+    draw.text((5, 100), wrap_caption(caption), (0, 0, 0),
+              font=font or get_font(FONT_SIZE))
+    draw.rectangle((0, 0, CELL_SIZE[0] - 1, CELL_SIZE[1] - 1),
+                   outline=BORDER_COLOR)
+    return cell
+
+
+def file_digest(path):
+    """
+    Returns SHA-256 of the file `path`: taken from its name, if the file
+    is stored by content (see `core.storage.ContentAddressedStorage`).
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if CONTENT_NAME.match(stem):
+        return stem
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class CellCache:
+    """
+    Captioned cells (see `make_cell`) stored as PNG files under `root`,
+    keyed by content of the pictogram, caption, font and CELL_VERSION:
+
+        <root>/ab/abcd...ef.png
+
+    Pictograms are given by path. Counts cells taken from the cache
+    (`hits`) and rendered (`misses`).
+    """
+    def __init__(self, root):
+        self.root = str(root)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, pict, caption, font):
+        font_id = f'{getattr(font, "path", "default")}:' \
+                  f'{getattr(font, "size", 0)}'
+        return hashlib.sha256(
+            f'{CELL_VERSION}\0{file_digest(pict)}\0{caption}\0{font_id}'
+            .encode()
+            ).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.png')
+
+    def get(self, pict, caption, font=None):
+        """
+        Returns cell for `pict` and `caption`, rendering and storing it if
+        it is not in the cache yet.
+        """
+        font = font or get_font(FONT_SIZE)
+        if pict is None:
+            return make_cell(pict, caption, font)
+
+        path = self.path(self.key(pict, caption, font))
+        try:
+            cell = Image.open(path)
+            cell.load()
+        except OSError:
+            pass
+        else:
+            self.hits += 1
+            return cell
+
+        self.misses += 1
+        cell = make_cell(pict, caption, font)
+        self.store(path, cell)
+        return cell
+
+    def store(self, path, cell):
+        # Other processes never read a partially written cell.
+        with atomic_write(path) as f:
+            cell.save(f, 'PNG')
+
+
+def new_page(num, font_path=None):
+    """
+    Returns blank page `num` with numbered columns and rows.
+    """
+    page = Image.new('RGB', PAGE_SIZE, (255, 255, 255))
+    draw = ImageDraw.Draw(page)
+    font = get_font(FONT_SIZE, font_path)
+    for i in range(IMG_NUM):
+        draw.text((MARGIN + i * CELL_SIZE[0] + 50, 10), str(i + 1),
+                  (0, 0, 0), font=font)
+        draw.text((10, MARGIN + i * CELL_SIZE[1] + 62), str(i + 1),
+                  (0, 0, 0), font=font)
+    draw.text((5, 5), str(num), (0, 0, 0),
+              font=get_font(FONT_SIZE_PAGE_NUM, font_path))
+    return page
+
+
+def render_page(num, items, font_path=None, cache=None):
+    """
+    Returns page `num` with cells for `items` - list of (pict, caption).
+    Cells are taken from `cache` (`CellCache`), if given.
+    """
+    page = new_page(num, font_path)
+    font = get_font(FONT_SIZE, font_path)
+    for i, (pict, caption) in enumerate(items):
+        row, column = divmod(i, IMG_NUM)
+        if cache is None:
+            cell = make_cell(pict, caption, font)
+        else:
+            cell = cache.get(pict, caption, font)
+        page.paste(cell, (MARGIN + column * CELL_SIZE[0],
+                          MARGIN + row * CELL_SIZE[1]))
+    return page
+
+
+def encode_page(num, items, font_path=None, format='jpeg', cache_root=None):
+    """
+    Renders page `num` and returns (num, encoded image, number of cells
+    rendered - not taken from the cache under `cache_root`). Pages of PDF
+    are encoded as JPEG (see `core.pdf.PDFWriter.add_jpeg`).
+    """
+    cache = CellCache(cache_root) if cache_root else None
+    page = render_page(num, items, font_path, cache)
+    buf = io.BytesIO()
+    page.save(buf, 'PNG' if format == 'png' else 'JPEG', quality=90)
+    rendered = len(items) if cache is None else cache.misses
+    return num, buf.getvalue(), rendered
+
+
+def iter_pages(items, jobs=1, font_path=None, format='jpeg',
+               cache_root=None):
+    """
+    Splits `items` (iterable of (pict, caption)) into pages and yields
+    results of `encode_page` in order of pages.
+
+    With `jobs` > 1 pages are rendered in a pool of processes, taking
+    items for next pages only as workers become free.
+    """
+    pages = enumerate(chunked(items, PER_PAGE), 1)
+    if jobs <= 1:
+        for num, page_items in pages:
+            yield encode_page(num, page_items, font_path, format, cache_root)
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        pending = deque()
+        for num, page_items in pages:
+            pending.append(pool.apply_async(
+                encode_page,
+                (num, page_items, font_path, format, cache_root)))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
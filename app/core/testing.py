@@ -0,0 +1,48 @@
+"""
+Helpers shared by tests of all apps.
+"""
+
+import os
+import tempfile
+
+from PIL import Image, ImageDraw
+
+from django.test import override_settings
+
+from core.pictogram import PICT_SIZE
+
+
+def make_pict(shape='figure', offset=(0, 0), ink='black', mode='RGB'):
+    """
+    Returns a pictogram (100x100, ink on white): a 'figure' (head, body
+    and legs), a 'box', or nothing (None), moved by `offset`.
+    """
+    im = Image.new(mode, PICT_SIZE, 'white')
+    draw = ImageDraw.Draw(im)
+    dx, dy = offset
+    if shape == 'figure':
+        draw.ellipse((40 + dx, 10 + dy, 60 + dx, 30 + dy), fill=ink)
+        draw.rectangle((45 + dx, 30 + dy, 55 + dx, 65 + dy), fill=ink)
+        draw.line((50 + dx, 65 + dy, 30 + dx, 90 + dy), fill=ink, width=6)
+        draw.line((50 + dx, 65 + dy, 70 + dx, 90 + dy), fill=ink, width=6)
+    elif shape == 'box':
+        draw.rectangle((20 + dx, 20 + dy, 80 + dx, 40 + dy), fill=ink)
+        draw.rectangle((20 + dx, 60 + dy, 40 + dx, 80 + dy), fill=ink)
+    return im
+
+
+class TempMediaMixin:
+    """
+    Points MEDIA_ROOT and caches to a temporary directory for every test.
+    """
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        settings = override_settings(
+            MEDIA_ROOT=os.path.join(tmp.name, 'media'),
+            CELL_CACHE_ROOT=os.path.join(tmp.name, 'cells'),
+            SEQUENCE_CACHE_ROOT=os.path.join(tmp.name, 'sequences'))
+        settings.enable()
+        self.addCleanup(settings.disable)
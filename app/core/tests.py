@@ -1,3 +1,618 @@
-from django.test import TestCase
+import io
+import os
+import re
+import random
+import hashlib
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from PIL import Image, ImageDraw
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.pictogram import PICT_SIZE, check_img, check_pixels, get_info, \
+    hamming, luminance, phash, to_arrays
+from core import slicer, tables
+from core.models import Score, ScoredItem, TaggedUserItem, \
+    resolve_content_objects
+from core.pdf import PDFWriter, iter_pdf
+from core.storage import ContentAddressedStorage
+from core.testing import TempMediaMixin, make_pict
+from core.utils import BKTree, Progress, RangeMaxTree, format_duration
+from asana.models import Asana, AsanaForm
+from sequence.models import Sequence
+
+
+def codes(found):
+    return [x.code for x in found]
+
+
+class PictogramTest(SimpleTestCase):
+    def test_get_info(self):
+        info = get_info('standing/tree-pose_2__15.png')
+        self.assertEqual((info['name'], info['variant'], info['difficulty']),
+                         ('Tree-Pose', 2, 15))
+        self.assertEqual(info['errors'], [])
+        self.assertEqual(codes(get_info('tree_2.png')['errors']),
+                         ['difficulty'])
+        self.assertEqual(codes(get_info('tree__15.png')['errors']),
+                         ['variant'])
+
+    def test_check_pixels(self):
+        self.assertEqual(check_pixels(make_pict()), ([], []))
+
+        errors, _ = check_pixels(make_pict().resize((100, 99)))
+        self.assertIn('size', codes(errors))
+
+        errors, _ = check_pixels(make_pict(ink=(0, 0, 200)))
+        self.assertEqual(codes(errors), ['monochrome'])
+
+        errors, _ = check_pixels(make_pict(None))
+        self.assertEqual(codes(errors), ['blank'])
+
+        errors, warnings = check_pixels(make_pict(offset=(0, 15)))
+        self.assertEqual((errors, codes(warnings)), ([], ['border']))
+
+        im = make_pict(mode='RGBA')
+        im.putpixel((0, 0), (255, 255, 255, 0))
+        errors, warnings = check_pixels(im)
+        self.assertEqual((errors, codes(warnings)), ([], ['alpha']))
+
+    def test_colored_ink(self):
+        # Dark ink of any color counts, not only where its brightest
+        # channel is dark.
+        for ink in ((200, 0, 0), (0, 0, 255), (90, 90, 90)):
+            with self.subTest(ink=ink):
+                errors, _ = check_pixels(make_pict(ink=ink))
+                self.assertNotIn('blank', codes(errors))
+
+    def test_luminance(self):
+        rgb = np.random.default_rng(0).integers(0, 256, (50, 70, 3),
+                                                dtype=np.uint8)
+        im = Image.fromarray(rgb, 'RGB')
+        np.testing.assert_array_equal(luminance(rgb),
+                                      np.asarray(im.convert('L')))
+        gray = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+        np.testing.assert_array_equal(luminance(gray), np.arange(256))
+
+    def test_check_img(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'tree-pose_0__7.png')
+            make_pict(None).save(filename)
+            info = check_img(filename)
+            self.assertEqual((info['name'], info['difficulty']),
+                             ('Tree-Pose', 7))
+            self.assertEqual(codes(info['errors']), ['blank'])
+            self.assertIsInstance(info['image'], Image.Image)
+
+    def test_to_arrays(self):
+        rgb, alpha = to_arrays(make_pict(mode='L'))
+        self.assertEqual((rgb.shape, alpha.shape),
+                         (PICT_SIZE + (3, ), PICT_SIZE))
+        self.assertTrue((alpha == 255).all())
+
+
+    def test_phash(self):
+        figure = phash(make_pict())
+        self.assertEqual(phash(make_pict()), figure)
+        self.assertTrue(-(1 << 63) <= figure < 1 << 63)
+        # Margins and crop do not matter, shapes do.
+        self.assertEqual(hamming(phash(make_pict(offset=(8, 5))), figure), 0)
+        self.assertLessEqual(
+            hamming(phash(make_pict().resize((80, 80)).resize(PICT_SIZE)),
+                    figure),
+            6)
+        self.assertGreater(hamming(phash(make_pict('box')), figure), 6)
+
+    def test_hamming(self):
+        self.assertEqual(hamming(0, 0), 0)
+        self.assertEqual(hamming(0b1011, 0b0001), 2)
+        self.assertEqual(hamming(-1, 0), 64)
+        self.assertEqual(hamming(-1, (1 << 63) - 1), 1)
+
+
+class BKTreeTest(SimpleTestCase):
+    def test_search(self):
+        rnd = random.Random(0)
+        keys = [rnd.getrandbits(16) for _ in range(500)]
+        tree = BKTree(hamming)
+        for i, key in enumerate(keys):
+            tree.add(key, i)
+        self.assertEqual(len(tree), len(keys))
+
+        for key in keys[:20] + [rnd.getrandbits(16) for _ in range(20)]:
+            for radius in (0, 2, 4):
+                expected = sorted((hamming(key, x), i)
+                                  for i, x in enumerate(keys)
+                                  if hamming(key, x) <= radius)
+                found = tree.search(key, radius)
+                self.assertEqual(sorted(found), expected)
+                self.assertEqual([d for d, _ in found],
+                                 sorted(d for d, _ in found))
+
+    def test_empty(self):
+        self.assertEqual(BKTree(hamming).search(0, 64), [])
+
+
+class RangeMaxTreeTest(SimpleTestCase):
+    def test_against_list(self):
+        rnd = random.Random(0)
+        for size in (1, 2, 7, 64):
+            tree, naive = RangeMaxTree(size), [0] * size
+            for _ in range(300):
+                lo = rnd.randrange(size)
+                hi = rnd.randrange(lo, size)
+                if rnd.random() < 0.5:
+                    value = rnd.randrange(10)
+                    tree.assign(lo, hi, value)
+                    naive[lo:hi + 1] = [value] * (hi - lo + 1)
+                else:
+                    self.assertEqual(tree.query(lo, hi),
+                                     max(naive[lo:hi + 1]))
+
+
+class StorageTest(TempMediaMixin, SimpleTestCase):
+    def test_save(self):
+        storage = ContentAddressedStorage()
+        name = storage.save('pict/Tadasana_0.PNG', ContentFile(b'tadasana'))
+        digest = hashlib.sha256(b'tadasana').hexdigest()
+        self.assertEqual(name,
+                         f'pict/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        with storage.open(name) as f:
+            self.assertEqual(f.read(), b'tadasana')
+        self.assertEqual(os.listdir(os.path.dirname(storage.path(name))),
+                         [f'{digest}.png'])
+
+        # The same content under any name is stored once.
+        self.assertEqual(
+            storage.save('pict/Samasthiti_1.png', ContentFile(b'tadasana')),
+            name)
+        self.assertEqual(storage.get_available_name(name), name)
+        other = storage.save('pict/Tadasana_0.png', ContentFile(b'other'))
+        self.assertNotEqual(other, name)
+        with storage.open(name) as f:
+            self.assertEqual(f.read(), b'tadasana')
+
+
+class ProgressTest(SimpleTestCase):
+    def test_format_duration(self):
+        self.assertEqual(format_duration(0), '0:00:00')
+        self.assertEqual(format_duration(3725.9), '1:02:05')
+
+    def test_line(self):
+        stream = io.StringIO()
+        with mock.patch('time.perf_counter', return_value=100):
+            progress = Progress(total=50, stream=stream)
+        with mock.patch('time.perf_counter', return_value=110):
+            progress.update(20, errors=1)
+            # Not a terminal: printed every 10 seconds only.
+            progress.update(21, errors=1)
+            progress.finish(25, errors=2)
+        self.assertEqual(stream.getvalue().splitlines(), [
+            '[>] 20/50 files, 2.0/s, ETA 0:00:15, 1 error(s)',
+            '[>] 25/50 files, 2.5/s, ETA 0:00:10, 2 error(s)',
+            ])
+
+        progress = Progress(stream=io.StringIO())
+        self.assertIn('ETA ?', progress.line(10))
+
+
+class SlicerTest(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        # 2 rows of 3 pictograms, 100x100 each.
+        self.sheet = Image.new('RGB', (300, 200), 'white')
+        for i, shape in enumerate(('figure', 'box', None) * 2):
+            self.sheet.paste(make_pict(shape, offset=(i, i)),
+                             (i % 3 * 100, i // 3 * 100))
+        self.filename = os.path.join(self.tmp, 'sheet.png')
+        self.sheet.save(self.filename)
+
+    def test_grid(self):
+        self.assertEqual(slicer.grid((305, 210), columns=3, rows=2), [
+            (1, 1, (0, 0, 101, 105)), (1, 2, (101, 0, 202, 105)),
+            (1, 3, (202, 0, 303, 105)), (2, 1, (0, 105, 101, 210)),
+            (2, 2, (101, 105, 202, 210)), (2, 3, (202, 105, 303, 210)),
+            ])
+        for columns, rows in ((1, 1), (0, 5), ('x', 2), (100, 100)):
+            with self.assertRaises(ValueError):
+                slicer.grid((100, 100), columns, rows)
+
+    def test_iter_tiles(self):
+        tiles = list(slicer.iter_tiles(self.filename, columns=3, rows=2))
+        self.assertEqual([(x.number, x.row, x.column) for x in tiles],
+                         [(1, 1, 1), (2, 1, 2), (3, 1, 3),
+                          (4, 2, 1), (5, 2, 2), (6, 2, 3)])
+        for tile in tiles:
+            x, y = tile.coords
+            self.assertEqual(
+                tile.image.tobytes(),
+                self.sheet.crop((x, y, x + 100, y + 100)).tobytes())
+        self.assertEqual(slicer.join(tiles).tobytes(), self.sheet.tobytes())
+
+    def test_bands(self):
+        # Uncompressed sheets are read by rows of tiles.
+        for ext, banded in (('.bmp', True), ('.ppm', True), ('.png', False)):
+            with self.subTest(ext=ext):
+                filename = os.path.join(self.tmp, f'sheet{ext}')
+                self.sheet.save(filename)
+                with Image.open(filename) as im:
+                    self.assertEqual(slicer.raw_strips(im) is not None,
+                                     banded)
+                tiles = list(slicer.iter_tiles(filename, columns=3, rows=2))
+                self.assertEqual(len(tiles), 6)
+                for tile in tiles:
+                    x, y = tile.coords
+                    self.assertEqual(
+                        tile.image.tobytes(),
+                        self.sheet.crop((x, y, x + 100, y + 100)).tobytes())
+
+    def test_save_tiles(self):
+        saved = {}
+        for jobs in (1, 3):
+            directory = os.path.join(self.tmp, f'jobs{jobs}')
+            tiles = slicer.save_tiles(
+                slicer.iter_tiles(self.filename, columns=3, rows=2),
+                prefix='sheet', directory=directory, jobs=jobs)
+            self.assertEqual([x.number for x in tiles], list(range(1, 7)))
+            self.assertTrue(all(x.image is None for x in tiles))
+            saved[jobs] = {}
+            for name in sorted(os.listdir(directory)):
+                with Image.open(os.path.join(directory, name)) as im:
+                    saved[jobs][name] = im.tobytes()
+        self.assertEqual(sorted(saved[1]), [
+            f'sheet_{row:02d}_{column:02d}.png'
+            for row in (1, 2) for column in (1, 2, 3)])
+        self.assertEqual(saved[3], saved[1])
+
+    def test_dry_run(self):
+        (filename, tiles), = slicer.slice_sheets(
+            slicer.find_sheets(self.tmp), self.tmp, columns=3, rows=2,
+            dry_run=True)
+        self.assertEqual(filename, self.filename)
+        self.assertEqual(len(tiles), 6)
+        self.assertEqual(os.listdir(self.tmp), ['sheet.png'])
+
+
+class GridTest(SimpleTestCase):
+    def test_find_spans(self):
+        blank = np.array([1] * 6 + [0] * 20 + [1] * 10 + [0] * 20 + [1] * 2
+                         + [0] * 20 + [1] * 8, dtype=bool)
+        # Cut in the middle of gutters, margins trimmed to half of a
+        # typical gutter.
+        self.assertEqual(slicer.find_spans(blank, min_gutter=5),
+                         [(1, 31), (31, 83)])
+        self.assertEqual(slicer.find_spans(blank, min_gutter=2),
+                         [(3, 31), (31, 57), (57, 81)])
+        # Only the widest gutters are cut, when the count is known.
+        self.assertEqual(slicer.find_spans(blank, count=2, min_gutter=2),
+                         [(1, 31), (31, 83)])
+        with self.assertRaises(ValueError):
+            slicer.find_spans(blank, count=5, min_gutter=2)
+
+    def test_detect_grid(self):
+        # 3 rows of 4 pictograms with uneven gutters and margins.
+        columns, rows = (12, 140, 250, 390), (20, 150, 260)
+        sheet = Image.new('RGB', (510, 380), 'white')
+        for y in rows:
+            for x in columns:
+                sheet.paste(make_pict(), (x, y))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for ext in ('.png', '.bmp'):
+                filename = os.path.join(tmp, f'sheet{ext}')
+                sheet.save(filename)
+                with self.subTest(ext=ext):
+                    rows_ink, columns_ink = slicer.ink_profiles(filename)
+                    ink = np.asarray(sheet.convert('L')) \
+                        < slicer.INK_THRESHOLD
+                    np.testing.assert_array_equal(rows_ink, ink.sum(axis=1))
+                    np.testing.assert_array_equal(columns_ink,
+                                                  ink.sum(axis=0))
+
+                    cells = slicer.detect_grid(filename)
+                    self.assertEqual([(r, c) for r, c, _ in cells],
+                                     [(r, c) for r in range(1, 4)
+                                      for c in range(1, 5)])
+                    for (_, _, (x0, y0, x1, y1)), (x, y) in zip(
+                            cells, [(x, y) for y in rows for x in columns]):
+                        # Every cell holds its whole pictogram.
+                        self.assertTrue(x0 <= x + 28 and x + 72 <= x1)
+                        self.assertTrue(y0 <= y + 10 and y + 92 <= y1)
+                    self.assertEqual(
+                        len(slicer.detect_grid(filename, columns=4, rows=3)),
+                        12)
+                    self.assertEqual(
+                        len(list(slicer.iter_tiles(filename, columns=4,
+                                                   rows=3, detect=True))),
+                        12)
+
+
+def make_sheet(mode, size=(503, 611)):
+    """
+    Returns a sheet in `mode` with some ink and noise, so that every row
+    is different.
+    """
+    rgb = np.random.default_rng(1).integers(0, 256, (size[1], size[0], 3),
+                                            dtype=np.uint8)
+    im = Image.fromarray(rgb, 'RGB')
+    draw = ImageDraw.Draw(im)
+    for x in range(0, size[0], 100):
+        for y in range(0, size[1], 100):
+            draw.rectangle((x + 10, y + 10, x + 80, y + 80), fill='black')
+    if mode == 'P':
+        return im.quantize(16)
+    return im.convert(mode)
+
+
+class BandRowsTest(SimpleTestCase):
+    # (mode, extension, save options): uncompressed BMP and PPM are read
+    # by rows, the rest is decoded whole.
+    BANDS = (
+        ('RGB', '.bmp', {}),
+        ('L', '.bmp', {}),
+        ('P', '.bmp', {}),
+        ('1', '.bmp', {}),
+        ('RGB', '.ppm', {}),
+        ('L', '.pgm', {}),
+        ('1', '.pbm', {}),
+        )
+    WHOLE = (
+        ('RGB', '.tif', {}),
+        ('RGB', '.tif', {'compression': 'tiff_lzw'}),
+        ('L', '.tif', {}),
+        ('RGB', '.png', {}),
+        ('RGB', '.jpg', {}),
+        )
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def save(self, mode, ext, options):
+        filename = os.path.join(self.tmp.name, f'sheet_{mode}{ext}')
+        make_sheet(mode).save(filename, **options)
+        return filename
+
+    def test_band_equals_full_decode(self):
+        for mode, ext, options in self.BANDS:
+            with self.subTest(mode=mode, ext=ext):
+                filename = self.save(mode, ext, options)
+                with Image.open(filename) as im:
+                    strips = slicer.raw_strips(im)
+                    full = im.copy()
+                self.assertIsNotNone(strips)
+                height = full.height
+                for y0, y1 in ((0, height), (0, 1), (7, 263),
+                               (height // 2, height // 2 + 101),
+                               (height - 5, height)):
+                    band = slicer.load_rows(filename, strips, y0, y1)
+                    expected = full.crop((0, y0, full.width, y1))
+                    self.assertEqual(band.mode, expected.mode)
+                    self.assertEqual(band.size, expected.size)
+                    self.assertEqual(band.tobytes(), expected.tobytes())
+                    if band.mode == 'P':
+                        self.assertEqual(band.getpalette(),
+                                         expected.getpalette())
+
+    def test_other_formats_decoded_whole(self):
+        for mode, ext, options in self.WHOLE:
+            with self.subTest(mode=mode, ext=ext, **options):
+                filename = self.save(mode, ext, options)
+                with Image.open(filename) as im:
+                    self.assertIsNone(slicer.raw_strips(im))
+
+    def test_ink_profiles(self):
+        for mode, ext, options in self.BANDS + self.WHOLE:
+            with self.subTest(mode=mode, ext=ext, **options):
+                filename = self.save(mode, ext, options)
+                with Image.open(filename) as im:
+                    ink = np.asarray(im.convert('L')) < slicer.INK_THRESHOLD
+                rows, columns = slicer.ink_profiles(filename)
+                np.testing.assert_array_equal(rows, ink.sum(axis=1))
+                np.testing.assert_array_equal(columns, ink.sum(axis=0))
+
+
+class PDFWriterTest(SimpleTestCase):
+    def pages(self):
+        for size, mode in (((40, 30), 'RGB'), ((20, 50), 'L')):
+            buf = io.BytesIO()
+            Image.new(mode, size, 'gray').save(buf, 'JPEG')
+            yield buf.getvalue()
+
+    def test_xref(self):
+        f = io.BytesIO()
+        with PDFWriter(f) as pdf:
+            for data in self.pages():
+                pdf.add_jpeg(data)
+        data = f.getvalue()
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertTrue(data.endswith(b'%%EOF\n'))
+
+        startxref = int(re.search(rb'startxref\n(\d+)\n', data).group(1))
+        self.assertTrue(data[startxref:].startswith(b'xref\n'))
+        header, *entries = data[startxref:].split(b'trailer')[0] \
+            .splitlines()[1:]
+        first, count = map(int, header.split())
+        self.assertEqual((first, count, len(entries)), (0, 9, 9))
+        self.assertEqual(entries[0], b'0000000000 65535 f ')
+        for obj_id, entry in enumerate(entries[1:], 1):
+            # Entries are 20 bytes long, with the end of line.
+            self.assertEqual(len(entry) + 1, 20)
+            offset = int(entry[:10])
+            self.assertTrue(data[offset:].startswith(f'{obj_id} 0 obj\n'
+                                                     .encode()))
+        self.assertIn(b'/Size 9 /Root 1 0 R', data)
+        self.assertIn(b'/Count 2', data)
+
+    def test_iter_pdf(self):
+        f = io.BytesIO()
+        with PDFWriter(f) as pdf:
+            for data in self.pages():
+                pdf.add_jpeg(data)
+        chunks = list(iter_pdf(self.pages()))
+        # A chunk per page and the trailer.
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(b''.join(chunks), f.getvalue())
+
+
+class TablesTest(SimpleTestCase):
+    def test_wrap_caption(self):
+        self.assertEqual(tables.wrap_caption('Tadasana'), 'Tadasana')
+        self.assertEqual(tables.wrap_caption('Adho-Mukha-Svanasana 2'),
+                         'Adho-Mukha-Svanas-\nana 2')
+
+    def test_iter_pages(self):
+        items = [(make_pict(shape), f'Asana {i}')
+                 for i, shape in enumerate(('figure', 'box') * 20)]
+        pages = list(tables.iter_pages(items, format='png'))
+        self.assertEqual([(num, rendered) for num, _, rendered in pages],
+                         [(1, 36), (2, 4)])
+        with Image.open(io.BytesIO(pages[0][1])) as im:
+            self.assertEqual((im.format, im.size), ('PNG', tables.PAGE_SIZE))
+        self.assertEqual(list(tables.iter_pages(items, jobs=2,
+                                                format='png')),
+                         pages)
+
+
+class CellCacheTest(TempMediaMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.items = []
+        for i, shape in enumerate(('figure', 'box', None)):
+            filename = os.path.join(self.tmp, f'pict{i}.png')
+            make_pict(shape).save(filename)
+            self.items.append((filename, f'Asana {i}'))
+
+    def test_get(self):
+        cache = tables.CellCache(os.path.join(self.tmp, 'cells'))
+        for pict, caption in self.items:
+            self.assertEqual(cache.get(pict, caption).tobytes(),
+                             tables.make_cell(pict, caption).tobytes())
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+        for pict, caption in self.items:
+            cache.get(pict, caption)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+        # Another caption, or content of the pictogram.
+        pict, caption = self.items[0]
+        cache.get(pict, 'Tadasana')
+        make_pict('box').save(pict)
+        cache.get(pict, caption)
+        self.assertEqual((cache.hits, cache.misses), (3, 5))
+        # The same content, under any name.
+        cache.get(self.items[1][0], caption)
+        self.assertEqual((cache.hits, cache.misses), (4, 5))
+
+    def test_content_name(self):
+        digest = 'ab' * 32
+        filename = os.path.join(self.tmp, f'{digest}.png')
+        make_pict().save(filename)
+        self.assertEqual(tables.file_digest(filename), digest)
+        with open(self.items[0][0], 'rb') as f:
+            self.assertEqual(tables.file_digest(self.items[0][0]),
+                             hashlib.sha256(f.read()).hexdigest())
+
+    def test_pages(self):
+        cache_root = os.path.join(self.tmp, 'cells')
+        expected = tables.encode_page(1, self.items, format='png')
+        self.assertEqual(expected[2], 3)
+        self.assertEqual(tables.encode_page(1, self.items, format='png',
+                                            cache_root=cache_root),
+                         expected)
+        # Pages built of cached cells are the same.
+        self.assertEqual(tables.encode_page(1, self.items, format='png',
+                                            cache_root=cache_root),
+                         expected[:2] + (0, ))
+
+
+class ResolveContentObjectsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='user')
+        cls.forms = [
+            AsanaForm.objects.create(asana=Asana.objects.create(name=name))
+            for name in ('Tadasana', 'Vrksasana', 'Utkatasana')
+            ]
+        cls.sequences = [
+            Sequence.objects.create(name=name, user=user)
+            for name in ('morning', 'evening')
+            ]
+        for obj in cls.forms + cls.sequences:
+            TaggedUserItem.objects.create(name='tag', user=user,
+                                          content_object=obj)
+        # Of a deleted form.
+        TaggedUserItem.objects.create(name='tag', user=user,
+                                      content_type=ContentType.objects
+                                      .get_for_model(AsanaForm),
+                                      object_id=0)
+
+    def setUp(self):
+        # Content types are cached by the first lookup.
+        ContentType.objects.get_for_models(AsanaForm, Sequence)
+
+    def check(self, items):
+        objects = [x.content_object for x in items]
+        self.assertEqual(objects, self.forms + self.sequences + [None])
+        self.assertEqual([x.asana.name for x in objects[:3]],
+                         ['Tadasana', 'Vrksasana', 'Utkatasana'])
+
+    def test_resolve(self):
+        items = list(TaggedUserItem.objects.order_by('id'))
+        # A query per content type, asanas of forms included.
+        with self.assertNumQueries(2):
+            resolve_content_objects(items, {AsanaForm: 'asana'})
+            self.check(items)
+
+    def test_queryset(self):
+        with self.assertNumQueries(3):
+            items = list(TaggedUserItem.objects.order_by('id')
+                         .with_content_objects({'asana.asanaform': 'asana'}))
+            self.check(items)
+
+
+class ChangelistTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='admin', is_staff=True,
+                                        is_superuser=True)
+        self.score = Score.objects.create(name='level', user=self.user,
+                                          minval=0, maxval=10)
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        for i in range(count):
+            form = AsanaForm.objects.create(
+                asana=Asana.objects.create(name=f'asana {i}'),
+                pict=f'asana/pict/{i}.png')
+            sequence = Sequence.objects.create(name=f'seq {i}',
+                                               user=self.user)
+            for obj in (form, sequence):
+                TaggedUserItem.objects.create(name='tag', user=self.user,
+                                              content_object=obj)
+                ScoredItem.objects.create(name='level', score=self.score,
+                                          content_object=obj, val=i)
+
+    def count_queries(self, model):
+        url = reverse(f'admin:core_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_queries(self):
+        # Queries do not depend on the number of rows on a page.
+        for model in ('taggeduseritem', 'scoreditem'):
+            self.add_rows(2)
+            few = self.count_queries(model)
+            self.add_rows(20)
+            self.assertEqual(self.count_queries(model), few)
@@ -1,7 +1,13 @@
 """Project-wide utils."""
 
+import os
 import re
+import sys
+import time
 import logging
+import tempfile
+from contextlib import contextmanager
+from itertools import islice
 
 
 CONSOLE = logging.getLogger("commands")
@@ -19,3 +25,192 @@ def split_text(text, **kwargs):
 
 def extract_hashtags(text):
     return re.findall(r"#(\w+)", text)
+
+
+def chunked(iterable, size):
+    """
+    Splits iterable into lists of `size` items (the last one can be shorter).
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """
+    Opens a temporary file next to `path` for writing and moves it in
+    place when the block exits without errors, so that readers never see
+    a partially written file. Creates missing directories.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def format_duration(seconds):
+    """
+    Formats `seconds` as H:MM:SS.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+class Progress:
+    """
+    Live progress line: items done (of `total`, if known), rate, ETA and
+    errors. On a terminal the line is rewritten in place at most every
+    `interval` seconds, otherwise a new line is printed every 10 seconds.
+    """
+    def __init__(self, total=None, label='files', stream=None, interval=0.2):
+        self.total = total
+        self.label = label
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty()
+        self.interval = interval if self.tty else 10
+        self.started = time.perf_counter()
+        self.shown = 0
+
+    def line(self, done, errors=0):
+        elapsed = time.perf_counter() - self.started
+        rate = done / elapsed if elapsed else 0
+        total = f'/{self.total}' if self.total else ''
+        eta = '?'
+        if self.total and rate:
+            eta = format_duration(max(self.total - done, 0) / rate)
+        return (f'[>] {done}{total} {self.label}, {rate:.1f}/s, '
+                f'ETA {eta}, {errors} error(s)')
+
+    def update(self, done, errors=0, force=False):
+        now = time.perf_counter()
+        if not force and now - self.shown < self.interval:
+            return
+        self.shown = now
+        if self.tty:
+            self.stream.write('\r\033[K' + self.line(done, errors))
+        else:
+            self.stream.write(self.line(done, errors) + '\n')
+        self.stream.flush()
+
+    def finish(self, done, errors=0):
+        self.update(done, errors, force=True)
+        if self.tty:
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree: metric index for nearest-neighbour search, e.g.
+    by Hamming distance between hashes. Searching within a small radius
+    visits only a fraction of the tree, instead of comparing with every
+    item.
+
+        tree = BKTree(hamming)
+        tree.add(hash, value)
+        tree.search(hash, 4)  # -> [(distance, value), ...]
+    """
+    def __init__(self, distance):
+        self.distance = distance
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, value):
+        self.size += 1
+        if self.root is None:
+            self.root = (key, value, {})
+            return
+
+        node = self.root
+        while True:
+            dist = self.distance(key, node[0])
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = (key, value, {})
+                return
+            node = child
+
+    def search(self, key, radius):
+        """
+        Returns list of (distance, value) for items within `radius` from
+        `key`, nearest first.
+        """
+        found = []
+        candidates = [self.root] if self.root is not None else []
+        while candidates:
+            node_key, value, children = candidates.pop()
+            dist = self.distance(key, node_key)
+            if dist <= radius:
+                found.append((dist, value))
+            for child_dist, child in children.items():
+                if dist - radius <= child_dist <= dist + radius:
+                    candidates.append(child)
+        found.sort(key=lambda x: x[0])
+        return found
+
+
+class RangeMaxTree:
+    """
+    Segment tree over `size` positions (all 0 initially) with lazy range
+    assignment: both `query` (max over a range) and `assign` (set every
+    position of a range) take O(log size).
+
+        tree = RangeMaxTree(10)
+        tree.assign(2, 5, 1)
+        tree.query(0, 3)  # -> 1
+    """
+    def __init__(self, size):
+        self.size = size
+        self.max = [0] * (4 * max(size, 1))
+        self.pending = [None] * (4 * max(size, 1))
+
+    def push(self, node):
+        value = self.pending[node]
+        if value is not None:
+            for child in (2 * node, 2 * node + 1):
+                self.max[child] = self.pending[child] = value
+            self.pending[node] = None
+
+    def query(self, lo, hi, node=1, start=0, end=None):
+        """Returns max over positions `lo`..`hi` (inclusive)."""
+        if end is None:
+            end = self.size - 1
+        if hi < start or end < lo:
+            return 0
+        if lo <= start and end <= hi:
+            return self.max[node]
+        self.push(node)
+        middle = (start + end) // 2
+        return max(self.query(lo, hi, 2 * node, start, middle),
+                   self.query(lo, hi, 2 * node + 1, middle + 1, end))
+
+    def assign(self, lo, hi, value, node=1, start=0, end=None):
+        """Sets positions `lo`..`hi` (inclusive) to `value`."""
+        if end is None:
+            end = self.size - 1
+        if hi < start or end < lo:
+            return
+        if lo <= start and end <= hi:
+            self.max[node] = self.pending[node] = value
+            return
+        self.push(node)
+        middle = (start + end) // 2
+        self.assign(lo, hi, value, 2 * node, start, middle)
+        self.assign(lo, hi, value, 2 * node + 1, middle + 1, end)
+        self.max[node] = max(self.max[2 * node], self.max[2 * node + 1])
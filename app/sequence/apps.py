@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SequenceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sequence'
+
+    def ready(self):
+        from sequence import signals  # noqa: F401
@@ -0,0 +1,88 @@
+"""
+Export of many sequences (a programme: all sequences of a user, or with
+a tag) as one printable PDF, a page per sequence.
+
+Sequences are loaded with a fixed number of queries (see
+`sequence.render.load_all`), pages are rendered in a pool of processes
+with cells of items taken from `core.tables.CellCache`, and written out
+(see `core.pdf`) in order as they are ready, so that only a few pages are
+held in memory at a time.
+"""
+
+import io
+import multiprocessing
+from collections import deque
+
+import django
+from PIL import Image, ImageDraw
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+
+from core.models import TaggedUserItem
+from core.tables import CellCache, get_font
+from sequence.models import Sequence
+from sequence.render import draw_image, load_all
+
+
+FONT_SIZE_TITLE = 16
+TITLE_HEIGHT = 30
+
+
+def get_sequences(user=None, tag=None):
+    """
+    Returns sequences of `user` and/or tagged with `tag`, by name.
+    """
+    sequences = Sequence.objects.all()
+    if user is not None:
+        sequences = sequences.filter(user=user)
+    if tag:
+        sequences = sequences.filter(id__in=TaggedUserItem.objects.filter(
+            name=tag,
+            content_type=ContentType.objects.get_for_model(Sequence)
+            ).values('object_id'))
+    return sequences.order_by('name', 'id')
+
+
+def render_page(title, items, subsequences, cache_root=None):
+    """
+    Returns page (JPEG data) of the sequence with a `title` on top, and
+    the number of cells rendered (not taken from the cache under
+    `cache_root`; all of them without a cache).
+    """
+    cache = CellCache(cache_root) if cache_root else None
+    im = draw_image(items, subsequences, cache)
+    page = Image.new('RGB', (im.width, im.height + TITLE_HEIGHT), 'white')
+    page.paste(im, (0, TITLE_HEIGHT))
+    ImageDraw.Draw(page).text((10, 8), title, 'black',
+                              font=get_font(FONT_SIZE_TITLE))
+    buf = io.BytesIO()
+    page.save(buf, 'JPEG', quality=90)
+    return buf.getvalue(), len(items) if cache is None else cache.misses
+
+
+def iter_pages(sequences, jobs=1, cache_root=None):
+    """
+    Yields results of `render_page` for every sequence of `sequences`
+    (list of `Sequence`), in their order.
+
+    With `jobs` > 1 pages are rendered in a pool of processes, no more
+    than a few pages ahead of the consumer.
+    """
+    loaded = load_all(sequences)
+    pages = ((x.name, *loaded[x.id], cache_root) for x in sequences)
+    if jobs <= 1:
+        for args in pages:
+            yield render_page(*args)
+        return
+
+    # Workers must not inherit open connections of the parent process.
+    connections.close_all()
+    with multiprocessing.Pool(jobs, initializer=django.setup) as pool:
+        pending = deque()
+        for args in pages:
+            pending.append(pool.apply_async(render_page, args))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
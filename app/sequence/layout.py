@@ -0,0 +1,130 @@
+"""
+Geometry of a rendered sequence, shared by all renderers (see
+sequence.render).
+
+Items are laid out in rows of PER_ROW cells (see `core.tables.make_cell`),
+each item except the first gets an arrow from the left (dashed for
+transitional items), its marks are written below the cell. Sub-sequences
+are drawn as brackets below the marks, each in its own lane (see
+`assign_lanes`); brackets crossing the end of a row are continued in the
+next one.
+"""
+
+from core.tables import CELL_SIZE
+from core.utils import RangeMaxTree
+
+
+PER_ROW = 8
+MARGIN = 10
+# Space between cells, where arrows are drawn.
+GAP = 30
+MARKS_HEIGHT = 16
+LANE_HEIGHT = 16
+ROW_GAP = 20
+
+
+def assign_lanes(spans):
+    """
+    Assigns lanes (0 is nearest to items) to `spans` - list of (first,
+    last) item indexes, so that spans sharing an item never share a lane,
+    and spans within others are drawn nearer to items.
+
+    Spans are placed shortest first (ties broken by position, so lanes
+    never depend on the order of `spans`), each one in the lane above the
+    highest span placed under any of its items. Positions are compressed
+    to endpoints of spans and lanes under them are kept in a segment tree,
+    which makes it O(n log n) in the number of spans, whatever the number
+    of items.
+
+    Returns list of lanes in order of `spans`.
+    """
+    points = sorted({x for span in spans for x in span})
+    position = {x: i for i, x in enumerate(points)}
+    skyline = RangeMaxTree(len(points))
+    lanes = [0] * len(spans)
+    by_length = sorted(range(len(spans)), key=lambda i: (
+        spans[i][1] - spans[i][0], spans[i][0], spans[i][1], i))
+    for i in by_length:
+        first, last = position[spans[i][0]], position[spans[i][1]]
+        lanes[i] = skyline.query(first, last)
+        skyline.assign(first, last, lanes[i] + 1)
+    return lanes
+
+
+def layout(items, subsequences):
+    """
+    Computes positions of `items` (list of dicts with 'order' and
+    'transitional', in order) and `subsequences` (list of dicts with
+    'span' - orders of the first and the last item, and 'mark').
+
+    Returns dict with 'width', 'height', 'lanes' (max. number of lanes in
+    a row), and lists of 'cells' (item index, x, y, and y of marks),
+    'arrows' (x1, x2, y, dashed) and 'brackets' (subsequence index, first
+    and last item index, lane, and segments per row: x1, x2, y of the top
+    of ticks, y of the line, and whether the ends are real or continued).
+    Same input always gives the same layout.
+    """
+    cell_w, cell_h = CELL_SIZE
+    index = {item['order']: i for i, item in enumerate(items)}
+    spans, brackets = [], []
+    for i, sub in enumerate(subsequences):
+        try:
+            first, last = sorted(index[x] for x in sub['span'])
+        except KeyError:
+            # Refers to a removed item.
+            continue
+        spans.append((first, last))
+        brackets.append({'subsequence': i, 'first': first, 'last': last})
+
+    for bracket, lane in zip(brackets, assign_lanes(spans)):
+        bracket.update({'lane': lane, 'segments': []})
+
+    rows = (len(items) + PER_ROW - 1) // PER_ROW
+    columns = min(len(items), PER_ROW)
+
+    # Lanes taken in every row (brackets spanning several rows are
+    # continued in each of them).
+    row_lanes = [0] * rows
+    for bracket in brackets:
+        for row in range(bracket['first'] // PER_ROW,
+                         bracket['last'] // PER_ROW + 1):
+            row_lanes[row] = max(row_lanes[row], bracket['lane'] + 1)
+
+    cells, arrows, tops = [], [], []
+    y = MARGIN
+    for row in range(rows):
+        first, last = row * PER_ROW, min((row + 1) * PER_ROW, len(items)) - 1
+        for i in range(first, last + 1):
+            x = MARGIN + GAP + (i - first) * (cell_w + GAP)
+            cells.append({'item': i, 'x': x, 'y': y,
+                          'marks_y': y + cell_h + 2})
+            if i:
+                arrows.append({'x1': x - GAP + 4, 'x2': x - 4,
+                               'y': y + cell_w // 2,
+                               'dashed': bool(items[i]['transitional'])})
+        tops.append(y + cell_h + MARKS_HEIGHT)
+        y = tops[-1] + row_lanes[row] * LANE_HEIGHT + ROW_GAP
+
+    for bracket in brackets:
+        for row in range(bracket['first'] // PER_ROW,
+                         bracket['last'] // PER_ROW + 1):
+            start = max(bracket['first'], row * PER_ROW)
+            end = min(bracket['last'], (row + 1) * PER_ROW - 1)
+            bracket['segments'].append({
+                'row': row,
+                'x1': cells[start]['x'] + cell_w // 2,
+                'x2': cells[end]['x'] + cell_w // 2,
+                'top': tops[row],
+                'y': tops[row] + (bracket['lane'] + 1) * LANE_HEIGHT - 4,
+                'open_start': start != bracket['first'],
+                'open_end': end != bracket['last'],
+                })
+
+    return {
+        'width': MARGIN * 2 + GAP + columns * (cell_w + GAP) - GAP,
+        'height': max(y - ROW_GAP + MARGIN, MARGIN * 2),
+        'lanes': max(row_lanes, default=0),
+        'cells': cells,
+        'arrows': arrows,
+        'brackets': brackets,
+        }
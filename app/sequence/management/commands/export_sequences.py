@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Exports sequences (all, those of a user, and/or those tagged with --tag)
+as one PDF, a page per sequence (see `sequence.export`).
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.pdf import PDFWriter
+from core.utils import Progress
+from sequence.export import get_sequences, iter_pages
+
+
+def main(**kwargs):
+    """
+    Renders pages in `jobs` processes and writes them to `output` as
+    they are ready.
+    """
+    user = None
+    if kwargs.get('user'):
+        try:
+            user = User.objects.get(username=kwargs['user'])
+        except User.DoesNotExist:
+            print(f'[!] No user {kwargs["user"]}')
+            return
+
+    sequences = list(get_sequences(user, kwargs.get('tag')))
+    if not sequences:
+        print('[!] No sequences found')
+        return
+
+    cache_root = None
+    if not kwargs.get('no_cache', False):
+        cache_root = str(kwargs.get('cache') or settings.CELL_CACHE_ROOT)
+    output = kwargs.get('output') or 'sequences.pdf'
+    progress = None
+    if kwargs.get('verbosity', 1):
+        progress = Progress(total=len(sequences), label='pages')
+
+    num = rendered = 0
+    with open(output, 'wb') as f, PDFWriter(f) as pdf:
+        for data, page_rendered in iter_pages(sequences,
+                                              jobs=kwargs.get('jobs') or 1,
+                                              cache_root=cache_root):
+            pdf.add_jpeg(data)
+            num += 1
+            rendered += page_rendered
+            if progress is not None:
+                progress.update(num)
+
+    if progress is not None:
+        progress.finish(num)
+    print(f'[=] Exported {num} sequence(s) to {output} '
+          f'({rendered} cell(s) rendered)')
+
+
+class Command(BaseCommand):
+    help = """Export sequences as one PDF, a page per sequence."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-u',
+            '--user',
+            action='store', dest='user', default=None,
+            help='Only sequences of this user (username).')
+        parser.add_argument(
+            '-t',
+            '--tag',
+            action='store', dest='tag', default=None,
+            help='Only sequences with this tag.')
+        parser.add_argument(
+            '-o',
+            '--output',
+            action='store', dest='output', default=None,
+            help='Output PDF file (default: sequences.pdf).')
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            action='store', dest='jobs', type=int, default=1,
+            help='Number of processes rendering pages.')
+        parser.add_argument(
+            '--cache',
+            action='store', dest='cache', default=None,
+            help='Directory of cached cells (default: CELL_CACHE_ROOT).')
+        parser.add_argument(
+            '--no-cache',
+            action='store_true', dest='no_cache', default=False,
+            help='Render all cells, do not use the cache.')
+
+    def handle(self, *args, **opts):
+        main(**opts)
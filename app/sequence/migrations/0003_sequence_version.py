@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sequence', '0002_sequenceitem_mark_sequenceitem_transitional_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sequence',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented on every change of items or sub-sequences.'),
+        ),
+    ]
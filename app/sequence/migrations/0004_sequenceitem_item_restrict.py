@@ -0,0 +1,20 @@
+# Generated by Django 4.1 on 2026-10-18 09:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_tag_score_indexes'),
+        ('sequence', '0003_sequence_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sequenceitem',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, to='core.taggeduseritem'),
+        ),
+    ]
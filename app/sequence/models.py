@@ -17,19 +17,33 @@ class Sequence(NamedUserModel):
     Sequence also can be categorized in some way with use of Score.
     For example if a user wants to "star" a sequence, he/she can use
     ScoredItem for this purpose (where Score would be 'stars').
+
+    `version` is incremented whenever any of its items or sub-sequences
+    changes (see sequence.signals), renders are cached by it.
     """
-    pass
+    version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text=_('Incremented on every change of items or sub-sequences.')
+        )
 
 
 class SequenceItem(models.Model):
-    """Sequence item (ordered)."""
+    """
+    Sequence item (ordered).
+
+    Its tagged item can't be deleted while the item is in a sequence
+    (RestrictedError), neither directly nor with the tagged object (e.g.
+    an AsanaForm, with its tags), unless the sequence is deleted too:
+    items must be removed from sequences first.
+    """
     sequence = models.ForeignKey(
         Sequence,
         related_name='items',
         on_delete=models.CASCADE
         )
     order = models.PositiveSmallIntegerField()
-    item = models.ForeignKey(TaggedUserItem, on_delete=models.CASCADE)
+    item = models.ForeignKey(TaggedUserItem, on_delete=models.RESTRICT)
     transitional = models.BooleanField(
         default=False,
         help_text=_('Transitional items are marked with dashed arrow.')
@@ -0,0 +1,280 @@
+"""
+Rendering sequences to PNG and SVG (see sequence.layout).
+
+Renders are cached on disk (SEQUENCE_CACHE_ROOT) by sequence id and a
+digest of its loaded data (see `digest`): items, their names and
+pictograms, and sub-sequences. So a render is stale neither after changes
+to the sequence, nor after a rename of an asana or a tag, or a re-import
+of a pictogram (which fire no signals bumping `Sequence.version`), and a
+repeated request for an unchanged sequence costs only loading it. Cells
+of items are taken from `core.tables.CellCache`.
+"""
+
+import hashlib
+import io
+import json
+import os
+from html import escape
+
+from PIL import Image, ImageDraw
+
+from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
+
+from core.models import MARKS, resolve_content_objects
+from core.tables import CELL_SIZE, CellCache, FONT_SIZE, get_font, \
+    make_cell, wrap_caption
+from core.utils import atomic_write
+from asana.models import AsanaForm
+from sequence.layout import layout
+from sequence.models import Sequence, SequenceItem, SubSequence
+
+
+# Bump to invalidate cached renders when their look changes.
+RENDER_VERSION = 1
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    }
+
+MARK_LABELS = dict(MARKS)
+
+BORDER_COLOR = '#7d7d7d'
+
+
+def load_all(sequences):
+    """
+    Returns {sequence id: (items, subsequences)} for `sequences` (list of
+    `Sequence`), as returned by `load`. Takes a fixed number of queries,
+    however many sequences: items with their tagged items, content objects
+    with asanas of forms (one query per content type, see
+    `core.models.resolve_content_objects`), and sub-sequences.
+    """
+    prefetch_related_objects(
+        sequences,
+        Prefetch('items', queryset=SequenceItem.objects
+                 .select_related('item').order_by('order')),
+        Prefetch('subsequences', queryset=SubSequence.objects.order_by('id'))
+        )
+    resolve_content_objects(
+        [x.item for sequence in sequences for x in sequence.items.all()],
+        {AsanaForm: 'asana'}
+        )
+
+    result = {}
+    for sequence in sequences:
+        items = []
+        for seq_item in sequence.items.all():
+            obj = seq_item.item.content_object
+            pict = getattr(obj, 'pict', None)
+            content_type = seq_item.item.content_type
+            items.append({
+                'id': seq_item.id,
+                'order': seq_item.order,
+                'type': f'{content_type.app_label}.{content_type.model}',
+                'object_id': seq_item.item.object_id,
+                'name': getattr(obj, 'name', None) or seq_item.item.name,
+                'pict': pict.path if pict else None,
+                'url': pict.url if pict else None,
+                'mark': list(seq_item.mark),
+                'marks': [MARK_LABELS.get(x, x) for x in seq_item.mark],
+                'transitional': seq_item.transitional,
+                })
+        subsequences = [
+            {'id': sub.id, 'span': list(sub.span), 'mark': sub.mark,
+             'label': MARK_LABELS.get(sub.mark, sub.mark)}
+            for sub in sequence.subsequences.all()
+            ]
+        result[sequence.id] = items, subsequences
+    return result
+
+
+def load(sequence):
+    """
+    Returns (items, subsequences) of `sequence` as lists of dicts:
+    items with 'id', 'order', 'type' ('<app label>.<model>' of the content
+    object) and 'object_id', 'name', 'pict' (path of the pictogram or
+    None), 'url' (of the pictogram), 'mark' (codes), 'marks' (labels) and
+    'transitional'; subsequences with 'id', 'span', 'mark' and 'label'.
+    """
+    return load_all([sequence])[sequence.id]
+
+
+def text_size(draw, text, font):
+    try:
+        box = draw.textbbox((0, 0), text, font=font)
+    except ValueError:
+        # Bitmap fonts in older PIL.
+        return font.getsize(text)
+    return box[2] - box[0], box[3] - box[1]
+
+
+def draw_centered(draw, x, y, text, font, background=None):
+    """
+    Draws `text` centered horizontally at `x`, and vertically at `y`.
+    """
+    width, height = text_size(draw, text, font)
+    left, top = x - width // 2, y - height // 2
+    if background:
+        draw.rectangle((left - 2, top - 1, left + width + 2, top + height + 1),
+                       fill=background)
+    draw.text((left, top), text, 'black', font=font)
+
+
+def draw_dashed(draw, x1, x2, y, dash=4):
+    for x in range(x1, x2, dash * 2):
+        draw.line((x, y, min(x + dash, x2), y), fill='black')
+
+
+def draw_image(items, subsequences, cache=None):
+    """
+    Returns RGB image of the sequence, with cells of items taken from
+    `cache` (`CellCache`), if given.
+    """
+    geometry = layout(items, subsequences)
+    im = Image.new('RGB', (geometry['width'], geometry['height']), 'white')
+    draw = ImageDraw.Draw(im)
+    font = get_font(FONT_SIZE)
+
+    for cell in geometry['cells']:
+        item = items[cell['item']]
+        if cache is None:
+            image = make_cell(item['pict'], item['name'], font)
+        else:
+            image = cache.get(item['pict'], item['name'], font)
+        im.paste(image, (cell['x'], cell['y']))
+        if item['marks']:
+            draw_centered(draw, cell['x'] + CELL_SIZE[0] // 2,
+                          cell['marks_y'] + 6, ' '.join(item['marks']), font)
+
+    for arrow in geometry['arrows']:
+        x1, x2, y = arrow['x1'], arrow['x2'], arrow['y']
+        if arrow['dashed']:
+            draw_dashed(draw, x1, x2 - 4, y)
+        else:
+            draw.line((x1, y, x2 - 4, y), fill='black')
+        draw.polygon(((x2, y), (x2 - 6, y - 4), (x2 - 6, y + 4)),
+                     fill='black')
+
+    for bracket in geometry['brackets']:
+        label = subsequences[bracket['subsequence']]['label']
+        for seg in bracket['segments']:
+            draw.line((seg['x1'], seg['y'], seg['x2'], seg['y']),
+                      fill='black')
+            if not seg['open_start']:
+                draw.line((seg['x1'], seg['top'], seg['x1'], seg['y']),
+                          fill='black')
+            if not seg['open_end']:
+                draw.line((seg['x2'], seg['top'], seg['x2'], seg['y']),
+                          fill='black')
+            draw_centered(draw, (seg['x1'] + seg['x2']) // 2, seg['y'],
+                          label, font, background='white')
+    return im
+
+
+def render_png(items, subsequences, cache=None):
+    im = draw_image(items, subsequences, cache)
+    buf = io.BytesIO()
+    im.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+def render_svg(items, subsequences):
+    geometry = layout(items, subsequences)
+    cell_w, cell_h = CELL_SIZE
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" '
+        f'xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{geometry["width"]}" height="{geometry["height"]}" '
+        f'font-family="monospace" font-size="{FONT_SIZE + 2}">',
+        '<defs><marker id="arrow" markerWidth="6" markerHeight="8" '
+        'refX="6" refY="4" orient="auto">'
+        '<path d="M0,0 L6,4 L0,8 z"/></marker></defs>',
+        '<rect width="100%" height="100%" fill="white"/>',
+        ]
+    for cell in geometry['cells']:
+        item = items[cell['item']]
+        x, y = cell['x'], cell['y']
+        out.append(f'<rect x="{x + 0.5}" y="{y + 0.5}" width="{cell_w - 1}" '
+                   f'height="{cell_h - 1}" fill="white" '
+                   f'stroke="{BORDER_COLOR}"/>')
+        if item['url']:
+            out.append(f'<image x="{x}" y="{y}" width="{cell_w}" '
+                       f'height="{cell_w}" '
+                       f'xlink:href="{escape(item["url"])}"/>')
+        for i, line in enumerate(wrap_caption(item['name']).split('\n')):
+            out.append(f'<text x="{x + 5}" y="{y + cell_w + 9 + i * 10}">'
+                       f'{escape(line)}</text>')
+        if item['marks']:
+            out.append(f'<text x="{x + cell_w // 2}" '
+                       f'y="{cell["marks_y"] + 10}" text-anchor="middle">'
+                       f'{escape(" ".join(item["marks"]))}</text>')
+
+    for arrow in geometry['arrows']:
+        dashed = ' stroke-dasharray="4,4"' if arrow['dashed'] else ''
+        out.append(f'<line x1="{arrow["x1"]}" y1="{arrow["y"]}" '
+                   f'x2="{arrow["x2"]}" y2="{arrow["y"]}" stroke="black"'
+                   f'{dashed} marker-end="url(#arrow)"/>')
+
+    for bracket in geometry['brackets']:
+        label = subsequences[bracket['subsequence']]['label']
+        for seg in bracket['segments']:
+            start_y = seg['y'] if seg['open_start'] else seg['top']
+            end_y = seg['y'] if seg['open_end'] else seg['top']
+            out.append(f'<polyline points="{seg["x1"]},{start_y} '
+                       f'{seg["x1"]},{seg["y"]} {seg["x2"]},{seg["y"]} '
+                       f'{seg["x2"]},{end_y}" fill="none" stroke="black"/>')
+            middle = (seg['x1'] + seg['x2']) // 2
+            out.append(f'<text x="{middle}" y="{seg["y"] + 4}" '
+                       f'text-anchor="middle" stroke="white" '
+                       f'stroke-width="3" paint-order="stroke">'
+                       f'{escape(label)}</text>')
+
+    out.append('</svg>')
+    return '\n'.join(out).encode()
+
+
+def digest(items, subsequences):
+    """
+    Returns digest of `items` and `subsequences` (as returned by `load`).
+    Pictograms are named by their content (see
+    `core.storage.ContentAddressedStorage`), so their paths stand for it.
+    """
+    data = json.dumps([items, subsequences], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def cache_path(sequence_id, key, fmt):
+    return os.path.join(settings.SEQUENCE_CACHE_ROOT, str(sequence_id),
+                        f'{key}-{RENDER_VERSION}.{fmt}')
+
+
+def get_render(sequence_id, fmt='png'):
+    """
+    Returns path to the render of sequence `sequence_id` in format `fmt`,
+    rendering it only if the sequence (or anything shown in it) changed
+    since it was rendered. Raises `Sequence.DoesNotExist`.
+    """
+    items, subsequences = load(Sequence.objects.get(id=sequence_id))
+    path = cache_path(sequence_id, digest(items, subsequences), fmt)
+    if os.path.exists(path):
+        return path
+
+    if fmt == 'svg':
+        data = render_svg(items, subsequences)
+    else:
+        data = render_png(items, subsequences,
+                          CellCache(settings.CELL_CACHE_ROOT))
+    with atomic_write(path) as f:
+        f.write(data)
+
+    # Renders of previous states are never needed again.
+    directory = os.path.dirname(path)
+    for name in os.listdir(directory):
+        if name.endswith(f'.{fmt}') and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return path
@@ -0,0 +1,29 @@
+"""
+Keeps `Sequence.version` up to date: any saved or deleted item or
+sub-sequence increments the version of its sequence.
+
+Note: bulk operations (`QuerySet.update`, `bulk_create`, ...) don't send
+signals - call `bump_version` after them.
+"""
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from sequence.models import Sequence, SequenceItem, SubSequence
+
+
+def bump_version(*sequence_ids):
+    Sequence.objects.filter(id__in=sequence_ids).update(
+        version=F('version') + 1,
+        updated=timezone.now()
+        )
+
+
+@receiver(post_save, sender=SequenceItem)
+@receiver(post_delete, sender=SequenceItem)
+@receiver(post_save, sender=SubSequence)
+@receiver(post_delete, sender=SubSequence)
+def sequence_changed(sender, instance, **kwargs):
+    bump_version(instance.sequence_id)
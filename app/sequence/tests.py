@@ -1,3 +1,385 @@
-from django.test import TestCase
+import io
+import os
+import random
+import shutil
+from contextlib import redirect_stdout
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from core.models import TaggedUserItem
+from core.testing import TempMediaMixin, make_pict
+from asana.models import Asana, AsanaForm
+from sequence.export import get_sequences
+from sequence.layout import PER_ROW, assign_lanes, layout
+from sequence.models import Sequence, SequenceItem, SubSequence
+from sequence.render import get_render, load, load_all
+
+
+def png(shape='figure'):
+    buf = io.BytesIO()
+    make_pict(shape).save(buf, 'PNG')
+    return ContentFile(buf.getvalue())
+
+
+class SequenceTestCase(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='user')
+        self.sequence = Sequence.objects.create(name='seq', user=self.user)
+
+    def add_form(self, name, shape='figure'):
+        form = AsanaForm(asana=Asana.objects.create(name=name))
+        form.pict.save(f'{name}.png', png(shape))
+        return form
+
+    def add_item(self, form, order, sequence=None):
+        tag = TaggedUserItem.objects.create(name='seq', user=self.user,
+                                            content_object=form)
+        return SequenceItem.objects.create(sequence=sequence or self.sequence,
+                                           order=order, item=tag)
+
+    def version(self):
+        return Sequence.objects.get(id=self.sequence.id).version
+
+
+class VersionTest(SequenceTestCase):
+    def test_bumped(self):
+        item = self.add_item(self.add_form('tadasana'), 1)
+        self.assertEqual(self.version(), 1)
+        item.transitional = True
+        item.save()
+        sub = SubSequence.objects.create(sequence=self.sequence, span=[1, 1],
+                                         mark='lr')
+        sub.delete()
+        item.delete()
+        self.assertEqual(self.version(), 5)
+
+
+class RenderCacheTest(SequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.form = self.add_form('tadasana')
+        self.add_item(self.form, 1)
+
+    def test_unchanged(self):
+        path = get_render(self.sequence.id)
+        # The sequence is loaded (to be digested), but not rendered.
+        with self.assertNumQueries(4), \
+                mock.patch('sequence.render.render_png') as render_png:
+            self.assertEqual(get_render(self.sequence.id), path)
+        render_png.assert_not_called()
+
+    def test_changed(self):
+        for fmt in ('png', 'svg'):
+            path = get_render(self.sequence.id, fmt)
+            self.add_item(self.add_form(f'utkatasana {fmt}', 'box'),
+                          self.version() + 1)
+            changed = get_render(self.sequence.id, fmt)
+            self.assertNotEqual(changed, path)
+            self.assertFalse(os.path.exists(path))
+            if fmt == 'svg':
+                with open(changed, 'rb') as f:
+                    self.assertIn(b'utkatasana svg', f.read())
+            else:
+                with Image.open(changed) as im:
+                    self.assertEqual(im.format, 'PNG')
+
+    def test_rename(self):
+        for fmt in ('png', 'svg'):
+            path = get_render(self.sequence.id, fmt)
+            Asana.objects.filter(id=self.form.asana_id) \
+                .update(name=f'samasthiti {fmt}')
+            renamed = get_render(self.sequence.id, fmt)
+            self.assertNotEqual(renamed, path)
+            self.assertFalse(os.path.exists(path))
+            if fmt == 'svg':
+                with open(renamed, 'rb') as f:
+                    self.assertIn(b'samasthiti', f.read())
+
+    def test_pictogram_reimported(self):
+        path = get_render(self.sequence.id)
+        # As the importer does it: no signals.
+        pict = AsanaForm.pict.field.storage.save('asana/pict/x.png',
+                                                  png('box'))
+        AsanaForm.objects.filter(id=self.form.id).update(pict=pict)
+        self.assertNotEqual(get_render(self.sequence.id), path)
+
+
+class RenderViewTest(SequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_item(self.add_form('tadasana'), 1)
+
+    def get(self, user, fmt='png'):
+        self.client.force_login(user)
+        return self.client.get(reverse('sequence:render',
+                                       args=[self.sequence.id, fmt]))
+
+    def test_owner(self):
+        for fmt, content_type in (('png', 'image/png'),
+                                  ('svg', 'image/svg+xml')):
+            response = self.get(self.user, fmt)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], content_type)
+            self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(self.get(self.user, 'gif').status_code, 404)
+
+    def test_other_user(self):
+        other = User.objects.create(username='other')
+        self.assertEqual(self.get(other).status_code, 404)
+        other.is_staff = True
+        other.save()
+        response = self.get(other)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content))
+
+
+class LayoutViewTest(SequenceTestCase):
+    def test_layout(self):
+        form = self.add_form('tadasana')
+        for order in (1, 2):
+            self.add_item(form, order)
+        SubSequence.objects.create(sequence=self.sequence, span=[1, 2],
+                                   mark='lr')
+        self.client.force_login(self.user)
+        url = reverse('sequence:layout', args=[self.sequence.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['id'], data['version']),
+                         (self.sequence.id, self.version()))
+        self.assertEqual([x['name'] for x in data['items']],
+                         ['tadasana', 'tadasana'])
+        self.assertNotIn('pict', data['items'][0])
+        self.assertEqual(data['subsequences'][0]['span'], [1, 2])
+        self.assertEqual(len(data['layout']['cells']), 2)
+        self.assertEqual(data['layout']['lanes'], 1)
+
+        self.client.force_login(User.objects.create(username='other'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ExportTest(SequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Sequence.objects.create(name='other', user=self.user)
+        forms = [self.add_form(name, shape) for name, shape in (
+            ('tadasana', 'figure'), ('utkatasana', 'box'))]
+        for i, form in enumerate(forms, 1):
+            self.add_item(form, i)
+            self.add_item(form, i, self.other)
+        SubSequence.objects.create(sequence=self.other, span=[1, 2],
+                                   mark='lr')
+
+    def test_load_all(self):
+        sequences = list(Sequence.objects.order_by('id'))
+        with self.assertNumQueries(3):
+            loaded = load_all(sequences)
+        self.assertEqual(loaded[self.other.id], load(self.other))
+        items, subsequences = loaded[self.other.id]
+        self.assertEqual([x['name'] for x in items],
+                         ['tadasana', 'utkatasana'])
+        self.assertEqual(subsequences[0]['span'], [1, 2])
+
+    def test_get_sequences(self):
+        Sequence.objects.create(
+            name='foreign', user=User.objects.create(username='other'))
+        TaggedUserItem.objects.create(name='morning', user=self.user,
+                                      content_object=self.other)
+        self.assertEqual(list(get_sequences(self.user)),
+                         [self.other, self.sequence])
+        self.assertEqual(list(get_sequences(tag='morning')), [self.other])
+        self.assertEqual(get_sequences().count(), 3)
+
+    def export(self, *args):
+        output = os.path.join(self.tmp, 'out.pdf')
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            call_command('export_sequences', '-o', output, *args,
+                         verbosity=0)
+        with open(output, 'rb') as f:
+            return f.read(), stdout.getvalue()
+
+    def test_command(self):
+        data, output = self.export('-u', 'user')
+        self.assertTrue(data.startswith(b'%PDF'))
+        self.assertIn(b'/Count 2', data)
+        self.assertIn('Exported 2 sequence(s)', output)
+        self.assertIn('(2 cell(s) rendered)', output)
+        # Cells of the first export are cached.
+        self.assertEqual(self.export('-u', 'user')[0], data)
+        self.assertIn('(0 cell(s) rendered)', self.export('-u', 'user')[1])
+        shutil.rmtree(settings.CELL_CACHE_ROOT)
+        # Every cell of both pages is rendered, none is stored.
+        data, output = self.export('-u', 'user', '--no-cache')
+        self.assertIn('(4 cell(s) rendered)', output)
+        self.assertFalse(os.path.exists(settings.CELL_CACHE_ROOT))
+        self.assertIn('No user', self.export('-u', 'nobody')[1])
+
+    def test_view(self):
+        url = reverse('sequence:export')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.user)
+        # Pages are rendered in the request, no pool in a web worker.
+        with mock.patch('multiprocessing.Pool') as pool, \
+                mock.patch('django.db.connections.close_all') as close_all:
+            response = self.client.get(url)
+            data = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data.startswith(b'%PDF'))
+        self.assertIn(b'/Count 2', data)
+        pool.assert_not_called()
+        close_all.assert_not_called()
+        response = self.client.get(url, {'tag': 'nothing'})
+        self.assertEqual(response.status_code, 404)
+
+
+class APITest(SequenceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.forms = [self.add_form(name, shape) for name, shape in (
+            ('tadasana', 'figure'), ('utkatasana', 'box'))]
+        self.client.force_login(self.user)
+
+    def add_sequence(self, name, length):
+        sequence = Sequence.objects.create(name=name, user=self.user)
+        for order in range(1, length + 1):
+            item = self.add_item(self.forms[order % 2], order, sequence)
+        item.mark = ['lr']
+        item.save()
+        SubSequence.objects.create(sequence=sequence, span=[1, length],
+                                   mark='x2')
+        return sequence
+
+    def test_detail(self):
+        sequence = self.add_sequence('long', 10)
+        url = reverse('sequence:detail', args=[sequence.id])
+        # Session, user, sequence, and three queries of load_all.
+        with self.assertNumQueries(6):
+            data = self.client.get(url).json()
+        self.assertEqual(len(data['items']), 10)
+        item = data['items'][-1]
+        self.assertEqual(
+            {k: item[k] for k in ('order', 'type', 'object_id', 'name',
+                                  'mark', 'transitional')},
+            {'order': 10, 'type': 'asana.asanaform',
+             'object_id': self.forms[0].id, 'name': 'tadasana',
+             'mark': ['lr'], 'transitional': False})
+        self.assertNotIn('pict', item)
+        self.assertEqual(data['subsequences'][0]['span'], [1, 10])
+
+        self.client.force_login(User.objects.create(username='other'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_list(self):
+        url = reverse('sequence:sequences')
+        self.add_sequence('seq 0', 1)
+        with self.assertNumQueries(6):
+            self.client.get(url)
+        for i in range(1, 3):
+            self.add_sequence(f'seq {i}', i + 1)
+        with self.assertNumQueries(6):
+            data = self.client.get(url).json()
+        self.assertEqual([(x['name'], len(x['items']))
+                          for x in data['sequences']],
+                         [('seq', 0), ('seq 0', 1), ('seq 1', 2),
+                          ('seq 2', 3)])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class LanesTest(SimpleTestCase):
+    def check(self, spans, lanes):
+        # Spans sharing an item never share a lane.
+        for i, (a, b) in enumerate(spans):
+            for j, (c, d) in enumerate(spans[:i]):
+                if a <= d and c <= b:
+                    self.assertNotEqual(lanes[i], lanes[j])
+
+    def test_nested(self):
+        spans = [(1, 3), (0, 5), (2, 2), (4, 5)]
+        lanes = assign_lanes(spans)
+        self.assertEqual(lanes, [1, 2, 0, 0])
+        self.check(spans, lanes)
+
+    def test_order_independent(self):
+        spans = [(0, 2), (2, 4), (4, 6), (1, 5), (3, 3), (0, 6)]
+        lanes = assign_lanes(spans)
+        self.check(spans, lanes)
+        by_span = dict(zip(spans, lanes))
+        for _ in range(10):
+            shuffled = random.Random(_).sample(spans, len(spans))
+            self.assertEqual(dict(zip(shuffled, assign_lanes(shuffled))),
+                             by_span)
+
+    def skyline(self, spans):
+        # Lowest free lane under every item, shortest spans first.
+        lanes, skyline = [0] * len(spans), {}
+        for i in sorted(range(len(spans)), key=lambda i: (
+                spans[i][1] - spans[i][0], spans[i][0], spans[i][1], i)):
+            first, last = spans[i]
+            lanes[i] = max(skyline.get(x, 0) for x in range(first, last + 1))
+            for x in range(first, last + 1):
+                skyline[x] = lanes[i] + 1
+        return lanes
+
+    def test_random(self):
+        rnd = random.Random(0)
+        for _ in range(50):
+            spans = []
+            for _ in range(rnd.randrange(1, 30)):
+                first = rnd.randrange(10 ** rnd.randrange(1, 6))
+                spans.append((first, first + rnd.randrange(10)))
+            lanes = assign_lanes(spans)
+            self.check(spans, lanes)
+            self.assertEqual(lanes, self.skyline(spans))
+
+    def test_empty(self):
+        self.assertEqual(assign_lanes([]), [])
+
+
+class LayoutTest(SimpleTestCase):
+    def items(self, count):
+        return [{'order': i + 1, 'transitional': i % 3 == 2}
+                for i in range(count)]
+
+    def test_cells_and_arrows(self):
+        result = layout(self.items(PER_ROW + 2), [])
+        cells = result['cells']
+        self.assertEqual(len(cells), PER_ROW + 2)
+        self.assertEqual(len({x['y'] for x in cells}), 2)
+        self.assertEqual(cells[PER_ROW]['x'], cells[0]['x'])
+        self.assertEqual([x['dashed'] for x in result['arrows']],
+                         [i % 3 == 2 for i in range(1, PER_ROW + 2)])
+        self.assertEqual(result['lanes'], 0)
+
+    def test_brackets(self):
+        items = self.items(PER_ROW + 4)
+        subsequences = [
+            {'span': [2, 4], 'mark': 'lr'},
+            {'span': [3, 4], 'mark': 'x2'},
+            # Continued in the next row.
+            {'span': [PER_ROW - 1, PER_ROW + 2], 'mark': 'x4'},
+            # Refers to a removed item.
+            {'span': [1, 99], 'mark': 'lr'},
+            ]
+        result = layout(items, subsequences)
+        brackets = {x['subsequence']: x for x in result['brackets']}
+        self.assertEqual(sorted(brackets), [0, 1, 2])
+        self.assertEqual((brackets[1]['lane'], brackets[0]['lane']), (0, 1))
+        self.assertEqual(result['lanes'], 2)
+
+        segments = brackets[2]['segments']
+        self.assertEqual([(x['row'], x['open_start'], x['open_end'])
+                          for x in segments],
+                         [(0, False, True), (1, True, False)])
+        self.assertEqual(layout(items, subsequences), result)
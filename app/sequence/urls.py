@@ -0,0 +1,14 @@
+from django.urls import path
+
+from sequence import views
+
+
+app_name = 'sequence'
+
+urlpatterns = [
+    path('', views.sequences, name='sequences'),
+    path('<int:pk>/', views.detail, name='detail'),
+    path('export.pdf', views.export, name='export'),
+    path('<int:pk>/render.<str:fmt>', views.render, name='render'),
+    path('<int:pk>/layout/', views.layout, name='layout'),
+]
@@ -1,3 +1,147 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import FileResponse, Http404, JsonResponse, \
+    StreamingHttpResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from core.pdf import iter_pdf
+
+from sequence.export import get_sequences, iter_pages
+from sequence.layout import layout as get_layout
+from sequence.models import Sequence
+from sequence.render import FORMATS, get_render, load, load_all
+
+
+def visible(request):
+    """
+    Returns sequences visible to the user of `request` (own, or all for
+    staff).
+    """
+    if request.user.is_staff:
+        return Sequence.objects.all()
+    return Sequence.objects.filter(user_id=request.user.id)
+
+
+def get_sequence_id(request, pk):
+    """
+    Returns id of sequence `pk` if it is visible to the user of `request`
+    (its owner or staff), otherwise raises Http404.
+    """
+    if not visible(request).filter(id=pk).exists():
+        raise Http404(f'No sequence {pk}')
+    return pk
+
+
+def get_sequence(request, pk):
+    """
+    Returns sequence `pk` if it is visible to the user of `request`,
+    otherwise raises Http404.
+    """
+    try:
+        return visible(request).get(id=pk)
+    except Sequence.DoesNotExist:
+        raise Http404(f'No sequence {pk}')
+
+
+def get_owner(request):
+    """
+    Returns user whose sequences are listed for `request`: the user
+    (staff: the one given by `?user=<username>`, or None for all users).
+    Raises Http404 for anonymous users and unknown usernames.
+    """
+    if not request.user.is_staff:
+        if not request.user.is_authenticated:
+            raise Http404('No sequences')
+        return request.user
+
+    username = request.GET.get('user')
+    if not username:
+        return None
+    try:
+        return User.objects.get(username=username)
+    except User.DoesNotExist:
+        raise Http404(f'No user {username}')
+
+
+def serialize(sequence, items, subsequences):
+    return {
+        'id': sequence.id,
+        'name': sequence.name,
+        'note': sequence.note,
+        'version': sequence.version,
+        'updated': sequence.updated,
+        'items': [{k: v for k, v in item.items() if k != 'pict'}
+                  for item in items],
+        'subsequences': subsequences,
+        }
+
+
+@require_GET
+def sequences(request):
+    """
+    Sequences of the user (see `get_owner`), optionally only those tagged
+    with `?tag=`, with their items and sub-sequences.
+    """
+    found = list(get_sequences(get_owner(request), request.GET.get('tag')))
+    loaded = load_all(found)
+    return JsonResponse({
+        'sequences': [serialize(x, *loaded[x.id]) for x in found],
+        })
+
+
+@require_GET
+def detail(request, pk):
+    """
+    Sequence `pk` with its items (names and pictogram URLs of their
+    forms, marks, transitional flags) and sub-sequences.
+    """
+    sequence = get_sequence(request, pk)
+    return JsonResponse(serialize(sequence, *load(sequence)))
+
+
+@require_GET
+def render(request, pk, fmt):
+    """
+    Sequence `pk` rendered as PNG or SVG (cached, see `get_render`).
+    """
+    if fmt not in FORMATS:
+        raise Http404(f'Unknown format {fmt}')
+
+    try:
+        path = get_render(get_sequence_id(request, pk), fmt)
+    except Sequence.DoesNotExist:
+        raise Http404(f'No sequence {pk}')
+    return FileResponse(open(path, 'rb'), content_type=FORMATS[fmt])
+
+
+@require_GET
+def layout(request, pk):
+    """
+    Layout of sequence `pk` (positions of cells, arrows and lanes of
+    sub-sequences, see `sequence.layout.layout`), for clients drawing it
+    themselves.
+    """
+    sequence = get_sequence(request, pk)
+    items, subsequences = load(sequence)
+    data = serialize(sequence, items, subsequences)
+    data['layout'] = get_layout(items, subsequences)
+    return JsonResponse(data)
+
+
+@require_GET
+def export(request):
+    """
+    Sequences of the user (see `get_owner`), optionally only those tagged
+    with `?tag=`, as one PDF, streamed page by page as they are rendered.
+    Pages are rendered in this process (no pool in a web worker), for
+    big exports see the `export_sequences` command.
+    """
+    found = list(get_sequences(get_owner(request), request.GET.get('tag')))
+    if not found:
+        raise Http404('No sequences')
+
+    pages = iter_pages(found, cache_root=str(settings.CELL_CACHE_ROOT))
+    response = StreamingHttpResponse(iter_pdf(data for data, _ in pages),
+                                     content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="sequences.pdf"'
+    return response
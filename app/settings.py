@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -94,10 +95,11 @@ DATABASES = {
         'PORT': os.environ.get('POSTGRES_PORT', '5432')
     }
 }
-print("\n[>] PostgreSQL:")
-print(f"{DATABASES['default']['NAME'] :<10}{DATABASES['default']['HOST']}:{DATABASES['default']['PORT']}")
+print("\n[>] PostgreSQL:", file=sys.stderr)
+print(f"{DATABASES['default']['NAME'] :<10}{DATABASES['default']['HOST']}:{DATABASES['default']['PORT']}",
+      file=sys.stderr)
 
-print("-" * 80)
+print("-" * 80, file=sys.stderr)
 
 
 # Password validation
@@ -138,6 +140,12 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'public/media'
 
+# Captioned pictogram cells of contact sheets (see core.tables.CellCache).
+CELL_CACHE_ROOT = BASE_DIR / 'public/cache/cells'
+
+# Rendered sequences (see sequence.render).
+SEQUENCE_CACHE_ROOT = BASE_DIR / 'public/cache/sequences'
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field